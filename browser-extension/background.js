@@ -65,16 +65,10 @@ async function handleApiRequest(endpoint, method = 'GET', body = null) {
 chrome.runtime.onMessage.addListener((message, sender, sendResponse) => {
     // Handle async responses
     if (message.type === 'cast') {
-        const serverUrl = getServerUrl();
-        fetch(`${serverUrl}/metadata`, {
-            method: "POST",
-            body: JSON.stringify({ source_url: message.url, start_time: message.currentTime }),
-            headers: {
-                "Content-Type": "application/json"
-            }
-        }).then(() => {
+        startCast(message.url, message.currentTime).then(() => {
             sendResponse({ success: true });
         }).catch((error) => {
+            console.error('[MTXCast] Failed to cast URL:', error);
             sendResponse({ success: false, error: error.message });
         });
         return true; // Keep channel open for async response
@@ -93,20 +87,43 @@ chrome.runtime.onMessage.addListener((message, sender, sendResponse) => {
     }
 });
 
-// Cast URL function
-async function castUrl(url, startTime = 0) {
-    const serverUrl = `http://${serverHost}:${serverPort}`;
-    try {
-        const response = await fetch(`${serverUrl}/metadata`, {
-            method: "POST",
-            body: JSON.stringify({ source_url: url, start_time: startTime }),
-            headers: {
-                "Content-Type": "application/json"
-            }
-        });
+// Long-poll a cast job until it is playing or has failed
+async function waitForJob(serverUrl, job) {
+    while (job.phase !== 'playing' && job.phase !== 'failed') {
+        const response = await fetch(`${serverUrl}/jobs/${job.id}?wait=30&since=${job.version}`);
         if (!response.ok) {
             throw new Error(`HTTP ${response.status}`);
         }
+        job = await response.json();
+    }
+    return job;
+}
+
+// Cast a URL and wait until it is playing; throws if the cast fails
+async function startCast(url, startTime = 0) {
+    const serverUrl = getServerUrl();
+    const response = await fetch(`${serverUrl}/metadata?async=true`, {
+        method: "POST",
+        body: JSON.stringify({ source_url: url, start_time: startTime }),
+        headers: {
+            "Content-Type": "application/json"
+        }
+    });
+    if (!response.ok) {
+        throw new Error(`HTTP ${response.status}`);
+    }
+    // The server accepts every async cast; extraction failures only show up in the job
+    const job = await waitForJob(serverUrl, await response.json());
+    if (job.phase === 'failed') {
+        throw new Error(job.error || 'Cast failed');
+    }
+    return job;
+}
+
+// Cast URL function
+async function castUrl(url, startTime = 0) {
+    try {
+        await startCast(url, startTime);
         return true;
     } catch (error) {
         console.error('[MTXCast] Failed to cast URL:', error);
@@ -14,7 +14,9 @@ const syncState = {
     serverPort: 8080,
     serverSeekCooldown: 3000, // milliseconds - ignore server sync after sending seek (increased for reliability)
     castButton: null, // Reference to the cast button element
-    isHandlingClick: false // Flag to prevent multiple simultaneous click handlers
+    isHandlingClick: false, // Flag to prevent multiple simultaneous click handlers
+    lastPrefetchedUrl: null, // Page URL most recently sent to /metadata/prefetch
+    castId: 0 // Incremented per cast click, so a late failure only undoes its own cast
 };
 
 // Get server URL
@@ -119,6 +121,30 @@ async function seekServer(position) {
     }
 }
 
+// Ask the server to resolve this page's video ahead of a cast (once per URL)
+async function prefetchCurrentPage() {
+    const url = location.href;
+    if (syncState.lastPrefetchedUrl === url) {
+        return;
+    }
+    syncState.lastPrefetchedUrl = url;
+
+    try {
+        const result = await chrome.runtime.sendMessage({
+            type: 'apiRequest',
+            endpoint: '/metadata/prefetch',
+            method: 'POST',
+            body: { source_url: url }
+        });
+        if (result && result.success) {
+            console.log(`[MTXCast] Prefetch ${result.data?.status || 'requested'}: ${url}`);
+        }
+    } catch (error) {
+        // Prefetching is best-effort; casting works without it
+        console.debug('[MTXCast] Prefetch failed:', error);
+    }
+}
+
 // Synchronize video with server
 async function syncWithServer() {
     if (!syncState.active || !syncState.videoElement) {
@@ -435,6 +461,7 @@ function addCastButtonToVideo(videoElement) {
     const showButton = () => {
         if (!syncState.active) {
             castButton.style.opacity = '1';
+            prefetchCurrentPage();
         }
     };
 
@@ -520,11 +547,23 @@ function addCastButtonToVideo(videoElement) {
 
             let currentTime = targetVideo.currentTime;
             let url = location.href;
+            const castId = ++syncState.castId;
             
             chrome.runtime.sendMessage({
                 type: 'cast',
                 currentTime: currentTime,
                 url: url
+            }).then((result) => {
+                if (result && result.success) {
+                    return;
+                }
+                console.error('[MTXCast] Cast failed:', result?.error);
+                // Undo the casting state unless the user has already stopped or recast
+                if (syncState.active && syncState.castId === castId) {
+                    stopSync();
+                    targetVideo.classList.remove('mtxcast-casting');
+                    updateCastButton(false);
+                }
             });
 
             // Start synchronization
@@ -5,13 +5,20 @@ Command-line interface for controlling MTXCast server
 """
 
 import argparse
+import hashlib
 import json
 import sys
+import time
 from pathlib import Path
 from typing import Optional
 
 import requests
-from requests.exceptions import RequestException
+from requests.exceptions import ConnectionError, RequestException, Timeout
+
+
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_RETRIES = 5
+UPLOAD_TIMEOUT = (10, 120)  # seconds to connect, and to wait for each response
 
 
 class MTXCastClient:
@@ -72,16 +79,87 @@ class MTXCastClient:
         )
 
     def upload_file(self, file_path: str, start_time: float = 0.0) -> dict:
-        """Upload and play a media file"""
+        """Upload and play a media file
+
+        The file's SHA-256 is sent first, so a file the server already has plays
+        without being transferred. Otherwise it is sent in ranges; an interrupted
+        range is resumed from the offset the server reports.
+        """
         path = Path(file_path)
         if not path.exists():
             print(f"Error: File not found: {file_path}", file=sys.stderr)
             sys.exit(1)
 
+        size = path.stat().st_size
+        session = self._request(
+            "POST",
+            "/uploads",
+            json={
+                "filename": path.name,
+                "size": size,
+                "sha256": _file_sha256(path),
+                "start_time": start_time,
+            },
+        )
+        if session.get("status") == "complete":
+            return session
+
+        upload_url = session["upload_url"]
+        offset = session.get("received", 0)
+        retries = 0
+        resync = False  # ask the server how much it stored before sending more
         with open(path, "rb") as f:
-            files = {"file": (path.name, f, "application/octet-stream")}
-            data = {"start_time": str(start_time)}
-            return self._request("POST", "/upload", files=files, data=data)
+            while offset < size:
+                try:
+                    if resync:
+                        response = requests.get(
+                            f"{self.base_url}{upload_url}", headers=self.headers, timeout=UPLOAD_TIMEOUT
+                        )
+                    else:
+                        f.seek(offset)
+                        chunk = f.read(UPLOAD_CHUNK_SIZE)
+                        end = offset + len(chunk) - 1
+                        response = requests.put(
+                            f"{self.base_url}{upload_url}",
+                            data=chunk,
+                            headers={**self.headers, "Content-Range": f"bytes {offset}-{end}/{size}"},
+                            timeout=UPLOAD_TIMEOUT,
+                        )
+                except (ConnectionError, Timeout) as e:
+                    error = str(e)
+                else:
+                    if response.ok:
+                        state = response.json()
+                        if state.get("status") == "failed":
+                            print(f"Error: Upload failed: {state.get('error')}", file=sys.stderr)
+                            sys.exit(1)
+                        offset = state["received"]
+                        if not resync:
+                            retries = 0
+                        resync = False
+                        continue
+                    if response.status_code != 409 and response.status_code < 500:
+                        # Size limits and bad ranges do not go away by retrying
+                        print(f"Error: Upload failed: {response.status_code} {response.text}", file=sys.stderr)
+                        sys.exit(1)
+                    # 409: the server is still finishing a stalled request, or stored a different amount
+                    error = f"{response.status_code} {response.text}"
+                retries += 1
+                if retries > UPLOAD_RETRIES:
+                    print(f"Error: Upload failed: {error}", file=sys.stderr)
+                    sys.exit(1)
+                time.sleep(min(2 ** retries, 30))
+                # Continue from whatever the server actually stored
+                resync = True
+        return self._request("POST", f"{upload_url}/finalize")
+
+
+def _file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
 
 
 def format_status(status: dict) -> str:
@@ -245,10 +323,12 @@ Examples:
             if args.json:
                 print(json.dumps(result, indent=2))
             else:
-                print(f"Stream Type: {result.get('stream_type', 'N/A')}")
-                print(f"Title: {result.get('title', 'N/A')}")
-                print(f"Playing: {result.get('is_playing', False)}")
-                print(f"File: {result.get('file_path', 'N/A')}")
+                print(f"Upload: {result.get('status', 'N/A')}")
+                print(f"Title: {result.get('filename', 'N/A')}")
+                print(f"SHA-256: {result.get('sha256', 'N/A')}")
+                if result.get("deduplicated"):
+                    print("Already on the server; nothing was transferred")
+                print(f"Playing: {result.get('playback_started', False)}")
 
     except KeyboardInterrupt:
         print("\nInterrupted by user", file=sys.stderr)
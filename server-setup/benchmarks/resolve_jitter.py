@@ -0,0 +1,118 @@
+"""Measure event-loop frame jitter while URLs are being resolved.
+
+A 30 fps ticker on the asyncio loop stands in for WHIP frame delivery and API
+handling. The script records how late each tick fires while extractions run,
+first in threads (extract_processes=0) and then in the process pool.
+
+    python benchmarks/resolve_jitter.py https://www.youtube.com/watch?v=... [more URLs]
+    python benchmarks/resolve_jitter.py --synthetic   # no network: CPU-bound stand-in for extraction
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import re
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from mtxcast.extract_pool import ExtractionPool  # noqa: E402
+
+FRAME_INTERVAL = 1 / 30
+
+
+def synthetic_extraction(rounds: int = 400) -> int:
+    """Regex and JSON work of roughly the size of one YouTube extraction"""
+    blob = json.dumps({"formats": [{"url": f"https://example.invalid/{i}?sig={i * 7919}", "itag": i} for i in range(300)]})
+    total = 0
+    for _ in range(rounds):
+        data = json.loads(blob)
+        total += sum(len(re.findall(r"sig=(\d+)", f["url"])) for f in data["formats"])
+    return total
+
+
+async def _ticker(stop: asyncio.Event, lateness: List[float]) -> None:
+    next_tick = time.perf_counter() + FRAME_INTERVAL
+    while not stop.is_set():
+        await asyncio.sleep(max(0.0, next_tick - time.perf_counter()))
+        now = time.perf_counter()
+        lateness.append((now - next_tick) * 1000)
+        next_tick = max(next_tick + FRAME_INTERVAL, now)
+
+
+async def _measure(label: str, work: Callable[[], Awaitable[None]]) -> None:
+    stop = asyncio.Event()
+    lateness: List[float] = []
+    ticker = asyncio.create_task(_ticker(stop, lateness))
+    started = time.perf_counter()
+    await work()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await ticker
+    lateness.sort()
+    p99 = lateness[min(len(lateness) - 1, int(len(lateness) * 0.99))]
+    print(
+        f"{label:>8}: {elapsed:6.2f}s  ticks={len(lateness):4d}  "
+        f"late p50={statistics.median(lateness):6.2f}ms p99={p99:7.2f}ms max={lateness[-1]:7.2f}ms"
+    )
+
+
+async def _run_synthetic(jobs: int, processes: int) -> None:
+    async def in_threads() -> None:
+        await asyncio.gather(*(asyncio.to_thread(synthetic_extraction) for _ in range(jobs)))
+
+    pool = ExtractionPool(processes)
+    pool.warm_up()
+
+    async def in_processes() -> None:
+        await asyncio.gather(*(pool.run(synthetic_extraction) for _ in range(jobs)))
+
+    try:
+        await _measure("threads", in_threads)
+        await _measure("process", in_processes)
+    finally:
+        pool.close()
+
+
+async def _run_urls(urls: List[str], processes: int) -> None:
+    from mtxcast.metadata import MetadataPayload, MetadataResolver
+
+    payloads = [MetadataPayload(source_url=url) for url in urls]
+    for label, count in (("threads", 0), ("process", processes)):
+        # cache_size=0 so every round really extracts
+        resolver = MetadataResolver(cache_size=0, extract_processes=count)
+        await asyncio.to_thread(resolver.warm_up)
+
+        async def work() -> None:
+            await asyncio.gather(*(resolver.resolve(payload) for payload in payloads))
+
+        try:
+            await _measure(label, work)
+        finally:
+            resolver.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("urls", nargs="*", help="URLs to resolve")
+    parser.add_argument("--synthetic", action="store_true", help="use a CPU-bound stand-in instead of real URLs")
+    parser.add_argument("--jobs", type=int, default=4, help="synthetic extractions per round")
+    parser.add_argument("--processes", type=int, default=2, help="extraction pool size")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        asyncio.run(_run_synthetic(args.jobs, args.processes))
+    elif args.urls:
+        asyncio.run(_run_urls(args.urls, args.processes))
+    else:
+        parser.error("pass URLs or --synthetic")
+
+
+if __name__ == "__main__":
+    main()
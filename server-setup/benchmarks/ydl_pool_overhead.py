@@ -0,0 +1,122 @@
+"""Measure per-resolve overhead of a fresh YoutubeDL against the warm pool.
+
+Each round resolves the same input twice: once with a YoutubeDL constructed
+for that call (how resolves worked before the pool) and once with an instance
+checked out of YdlPool. The difference is the setup cost the pool saves.
+
+    python benchmarks/ydl_pool_overhead.py https://www.youtube.com/watch?v=... [more URLs]
+    python benchmarks/ydl_pool_overhead.py --synthetic   # no network: format selection on a canned info dict
+"""
+
+from __future__ import annotations
+
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from yt_dlp import YoutubeDL  # noqa: E402
+
+from mtxcast.metadata import _YDL_PROFILES, _resolve_stream  # noqa: E402
+from mtxcast.ydl_pool import YdlPool  # noqa: E402
+
+
+def synthetic_info() -> Dict[str, Any]:
+    """Unprocessed result of roughly the shape of one YouTube extraction"""
+    formats = [
+        {
+            "format_id": f"v{height}",
+            "url": f"https://example.invalid/v{height}",
+            "ext": "mp4",
+            "vcodec": "avc1.4d401e",
+            "acodec": "none",
+            "height": height,
+            "tbr": height * 2.5,
+        }
+        for height in (144, 240, 360, 480, 720, 1080)
+    ]
+    formats += [
+        {
+            "format_id": f"a{abr}",
+            "url": f"https://example.invalid/a{abr}",
+            "ext": "m4a",
+            "vcodec": "none",
+            "acodec": "mp4a.40.2",
+            "abr": abr,
+        }
+        for abr in (48, 128, 160)
+    ]
+    return {
+        "id": "synthetic",
+        "title": "Synthetic",
+        "extractor": "generic",
+        "webpage_url": "https://example.invalid/",
+        "formats": formats,
+    }
+
+
+def _select_formats(ydl: YoutubeDL) -> None:
+    ydl.process_ie_result(synthetic_info(), download=False)
+
+
+def _measure(label: str, rounds: int, work: Callable[[], None]) -> List[float]:
+    timings: List[float] = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        work()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    p90 = timings[min(len(timings) - 1, int(len(timings) * 0.9))]
+    print(
+        f"{label:>6}: rounds={len(timings):4d}  "
+        f"p50={statistics.median(timings):8.2f}ms p90={p90:8.2f}ms mean={statistics.fmean(timings):8.2f}ms"
+    )
+    return timings
+
+
+def _run(rounds: int, resolve: Callable[[YoutubeDL], None]) -> None:
+    profile = _YDL_PROFILES["extract"]
+    pool = YdlPool(_YDL_PROFILES)
+    pool.warm_up()
+
+    def fresh() -> None:
+        with YoutubeDL(dict(profile)) as ydl:
+            resolve(ydl)
+
+    def pooled() -> None:
+        with pool.acquire("extract") as ydl:
+            resolve(ydl)
+
+    try:
+        fresh_ms = statistics.median(_measure("fresh", rounds, fresh))
+        pooled_ms = statistics.median(_measure("pooled", rounds, pooled))
+    finally:
+        pool.close()
+    print(f" saved: {fresh_ms - pooled_ms:8.2f}ms per resolve (p50)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("urls", nargs="*", help="URLs to resolve")
+    parser.add_argument("--synthetic", action="store_true", help="select formats from a canned info dict instead of real URLs")
+    parser.add_argument("--rounds", type=int, default=50, help="resolves per variant")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        _run(args.rounds, _select_formats)
+    elif args.urls:
+        def resolve_urls(ydl: YoutubeDL) -> None:
+            for url in args.urls:
+                _resolve_stream(ydl, url)
+
+        _run(args.rounds, resolve_urls)
+    else:
+        parser.error("pass URLs or --synthetic")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,139 @@
 from __future__ import annotations
 
+import asyncio
 import logging
-import tempfile
-from pathlib import Path
-from typing import Annotated
+import time
+import uuid
+from typing import Annotated, Any, Dict
 
-from fastapi import Body, Depends, FastAPI, File, Form, Header, HTTPException, Request, Response, UploadFile, status
+from fastapi import (
+    Body,
+    Depends,
+    FastAPI,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    WebSocket,
+    WebSocketDisconnect,
+    status,
+)
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import PlainTextResponse
 
+from .cast_jobs import CastJob, CastJobManager
 from .config import ServerConfig
-from .metadata import MetadataPayload
-from .stream_manager import StreamManager
+from .metadata import MetadataPayload, MetadataResolver
+from .metrics import CONTENT_TYPE, REGISTRY, Histogram, RequestMetricsMiddleware
+from .play_queue import PlayQueue, QueueReorderPayload
+from .qoe import GROUP_COLUMNS, QoeStore
+from .storage import StorageManager
+from .stream_manager import CastSupersededError, PlayerStatus, StreamManager
+from .tracing import TRACER, span
+from .uploads import (
+    UPLOAD_DIR,
+    InvalidUploadError,
+    UploadConflictError,
+    UploadManager,
+    UploadSession,
+    UploadSessionPayload,
+    UploadTooLargeError,
+    receive_multipart_upload,
+)
 from .webrtc import WhipEndpoint
 
 LOGGER = logging.getLogger(__name__)
 
+HTTP_SECONDS = Histogram(
+    "mtxcast_http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ["method", "route", "status"],
+)
+
+# Upper bound for /status?wait=, so a long-poll cannot hold a connection forever
+_MAX_STATUS_WAIT = 60.0
+
 
 def _token_dependency(expected: str | None):
-    async def _verify(x_api_token: Annotated[str | None, Header(alias="X-API-Token")] = None) -> None:
-        if expected and x_api_token != expected:
+    async def _verify(
+        x_api_token: Annotated[str | None, Header(alias="X-API-Token")] = None,
+        authorization: Annotated[str | None, Header()] = None,
+    ) -> None:
+        if not expected:
+            return
+        # Scrapers such as Prometheus can only send the token as a bearer token
+        scheme, _, credentials = (authorization or "").partition(" ")
+        bearer = credentials.strip() if scheme.lower() == "bearer" else None
+        if expected not in (x_api_token, bearer):
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid API token")
 
     return _verify
 
 
-def build_api(manager: StreamManager, whip: WhipEndpoint, config: ServerConfig) -> FastAPI:
+def _status_dict(state: PlayerStatus) -> Dict[str, Any]:
+    return {
+        "version": state.version,
+        "stream_type": state.stream_type.name,
+        "title": state.title,
+        "is_playing": state.is_playing,
+        "volume": state.volume,
+        "position": state.position,
+        "duration": state.duration,
+        "is_seekable": state.is_seekable,
+        "sampled_at": state.sampled_at,
+        "playback_rate": state.playback_rate,
+        "is_advancing": state.is_advancing,
+    }
+
+
+def _if_none_match(request: Request) -> set[str]:
+    header = request.headers.get("If-None-Match") or ""
+    return {tag.strip().removeprefix("W/") for tag in header.split(",") if tag.strip()}
+
+
+async def _run_socket_command(manager: StreamManager, message: Dict[str, Any]) -> PlayerStatus:
+    command = message.get("command")
+    if command == "play":
+        return await manager.resume()
+    if command == "pause":
+        return await manager.pause()
+    if command == "stop":
+        return await manager.stop()
+    if command == "seek":
+        return await manager.seek(float(message.get("position", 0.0)))
+    if command == "volume":
+        return await manager.set_volume(max(0.0, min(float(message.get("volume", 1.0)), 1.0)))
+    raise ValueError(f"Unknown command: {command}")
+
+
+async def _push_status(websocket: WebSocket, manager: StreamManager) -> None:
+    """Send the full status once, then only the fields that changed"""
+    sent = _status_dict(manager.status)
+    await websocket.send_json({"type": "status", "server_now": time.monotonic(), "status": sent})
+    while True:
+        state = await manager.wait_for_change(sent["version"])
+        current = _status_dict(state)
+        # Snapshots published while the previous message was being sent collapse into one delta
+        changes = {k: v for k, v in current.items() if k != "version" and v != sent[k]}
+        sent = current
+        if changes:
+            await websocket.send_json(
+                {"type": "delta", "version": state.version, "server_now": time.monotonic(), "changes": changes}
+            )
+
+
+def build_api(
+    manager: StreamManager,
+    whip: WhipEndpoint,
+    config: ServerConfig,
+    resolver: MetadataResolver,
+    queue: PlayQueue,
+    uploads: UploadManager,
+    storage: StorageManager,
+    jobs: CastJobManager,
+    qoe: QoeStore,
+) -> FastAPI:
     app = FastAPI(title="MTXCast", version="0.1.0")
     app.add_middleware(
         CORSMiddleware,
@@ -34,26 +142,69 @@ def build_api(manager: StreamManager, whip: WhipEndpoint, config: ServerConfig)
         allow_methods=["*"],
         allow_headers=["*"],
     )
+    app.add_middleware(RequestMetricsMiddleware, histogram=HTTP_SECONDS)
 
     token_dep = Depends(_token_dependency(config.api_token))
+    # Versions restart at 0 with the process; the boot ID keeps old ETags from matching
+    boot_id = uuid.uuid4().hex[:8]
+
+    @app.post(f"{config.metadata_endpoint}/prefetch", dependencies=[token_dep], status_code=status.HTTP_202_ACCEPTED)
+    async def prefetch_metadata(payload: MetadataPayload) -> dict:
+        """Resolve a URL in the background so a later cast of it starts immediately"""
+        return {"status": resolver.prefetch(payload)}
 
     @app.post(config.metadata_endpoint, dependencies=[token_dep])
-    async def post_metadata(payload: MetadataPayload) -> dict:
+    async def post_metadata(
+        payload: MetadataPayload,
+        request: Request,
+        response: Response,
+        run_async: bool = Query(False, alias="async"),
+    ) -> dict:
+        """Cast a URL; `?async=true` or `Prefer: respond-async` returns 202 with a job ID at once"""
+        # One trace per cast; an async job's spans keep arriving after this returns
+        with span("post_metadata", root=True, source_url=str(payload.source_url)) as root:
+            response.headers["X-Trace-Id"] = root.trace.trace_id
+            if run_async or "respond-async" in request.headers.get("prefer", ""):
+                job = jobs.submit(payload)
+                response.status_code = status.HTTP_202_ACCEPTED
+                response.headers["Location"] = f"/jobs/{job.job_id}"
+                return {**job.to_dict(), "status_url": f"/jobs/{job.job_id}"}
+            try:
+                LOGGER.info("Received metadata request for URL: %s", payload.source_url)
+                status_state = await manager.handle_metadata(payload)
+                LOGGER.info("Metadata playback started: %s (playing: %s)", status_state.title, status_state.is_playing)
+                return {
+                    "stream_type": status_state.stream_type.name,
+                    "title": status_state.title,
+                    "is_playing": status_state.is_playing,
+                }
+            except CastSupersededError as e:
+                LOGGER.info("%s", e)
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+            except Exception as e:
+                LOGGER.error("Error handling metadata request: %s", e, exc_info=True)
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail=f"Failed to process metadata request: {str(e)}"
+                )
+
+    def _get_job(job_id: str) -> CastJob:
         try:
-            LOGGER.info("Received metadata request for URL: %s", payload.source_url)
-            status_state = await manager.handle_metadata(payload)
-            LOGGER.info("Metadata playback started: %s (playing: %s)", status_state.title, status_state.is_playing)
-            return {
-                "stream_type": status_state.stream_type.name,
-                "title": status_state.title,
-                "is_playing": status_state.is_playing,
-            }
-        except Exception as e:
-            LOGGER.error("Error handling metadata request: %s", e, exc_info=True)
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Failed to process metadata request: {str(e)}"
-            )
+            return jobs.get(job_id)
+        except KeyError:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+
+    @app.get("/jobs", dependencies=[token_dep])
+    async def list_jobs() -> dict:
+        return {"jobs": [job.to_dict() for job in jobs.recent()]}
+
+    @app.get("/jobs/{job_id}", dependencies=[token_dep])
+    async def get_job(job_id: str, wait: float | None = None, since: int | None = None) -> dict:
+        """Phases of a cast job; `wait` + `since` long-poll for a version newer than `since`"""
+        job = _get_job(job_id)
+        if wait and since is not None:
+            await jobs.wait(job, since, min(wait, _MAX_STATUS_WAIT))
+        return job.to_dict()
 
     @app.post(config.whip_endpoint, response_class=PlainTextResponse, dependencies=[token_dep])
     async def post_whip_offer(
@@ -84,16 +235,108 @@ def build_api(manager: StreamManager, whip: WhipEndpoint, config: ServerConfig)
         return Response(status_code=status.HTTP_204_NO_CONTENT)
 
     @app.get("/status", dependencies=[token_dep])
-    async def get_status() -> dict:
+    async def get_status(
+        request: Request,
+        response: Response,
+        wait: float | None = None,
+        since: int | None = None,
+    ):
+        """Current status; `wait` + `since` long-poll for a version newer than `since`"""
         state = await manager.current_status()
+        if wait and since is not None and state.version <= since:
+            try:
+                state = await asyncio.wait_for(manager.wait_for_change(since), timeout=min(wait, _MAX_STATUS_WAIT))
+            except asyncio.TimeoutError:
+                state = await manager.current_status()
+
+        etag = f'"{boot_id}-{state.version}"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        known = _if_none_match(request)
+        if etag in known or "*" in known:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        response.headers.update(headers)
+        # server_now is not part of the snapshot; it lets clients extrapolate the position
+        return {**_status_dict(state), "server_now": time.monotonic()}
+
+    @app.websocket("/ws")
+    async def status_socket(websocket: WebSocket) -> None:
+        """Pushes status deltas and accepts play/pause/stop/seek/volume commands"""
+        # Browsers cannot set headers on WebSocket requests, so the token may also come as ?token=
+        token = websocket.headers.get("X-API-Token") or websocket.query_params.get("token")
+        if config.api_token and token != config.api_token:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+        await websocket.accept()
+        pusher = asyncio.create_task(_push_status(websocket, manager))
+        try:
+            while True:
+                message = await websocket.receive_json()
+                if not isinstance(message, dict):
+                    await websocket.send_json({"type": "result", "ok": False, "error": "Expected a JSON object"})
+                    continue
+                reply: Dict[str, Any] = {"type": "result", "id": message.get("id")}
+                try:
+                    state = await _run_socket_command(manager, message)
+                    reply.update(ok=True, status=_status_dict(state))
+                except Exception as e:
+                    LOGGER.warning("WebSocket command %r failed: %s", message.get("command"), e)
+                    reply.update(ok=False, error=str(e))
+                await websocket.send_json(reply)
+        except WebSocketDisconnect:
+            pass
+        except ValueError as e:
+            # Not JSON
+            LOGGER.warning("Closing WebSocket after malformed message: %s", e)
+            await websocket.close(code=status.WS_1003_UNSUPPORTED_DATA)
+        finally:
+            pusher.cancel()
+            await asyncio.gather(pusher, return_exceptions=True)
+
+    @app.get("/downloads", dependencies=[token_dep])
+    async def get_downloads() -> dict:
+        """Progress of active and recently finished downloads"""
+        return {"downloads": [progress.to_dict() for progress in resolver.downloads()]}
+
+    @app.get("/queue", dependencies=[token_dep])
+    async def get_queue() -> dict:
+        return queue.snapshot()
+
+    @app.post("/queue", dependencies=[token_dep], status_code=status.HTTP_201_CREATED)
+    async def enqueue(payload: MetadataPayload) -> dict:
+        """Add a URL to the end of the queue; starts playback if nothing is playing"""
+        return queue.enqueue(payload).to_dict()
+
+    @app.delete("/queue", dependencies=[token_dep])
+    async def clear_queue() -> dict:
+        queue.clear()
+        return queue.snapshot()
+
+    @app.delete("/queue/{item_id}", dependencies=[token_dep])
+    async def remove_queue_item(item_id: str) -> dict:
+        try:
+            queue.remove(item_id)
+        except KeyError:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unknown queue item: {item_id}")
+        return queue.snapshot()
+
+    @app.post("/queue/reorder", dependencies=[token_dep])
+    async def reorder_queue(payload: QueueReorderPayload) -> dict:
+        try:
+            queue.reorder(payload.item_ids)
+        except KeyError as e:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unknown queue item: {e.args[0]}")
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        return queue.snapshot()
+
+    @app.post("/queue/skip", dependencies=[token_dep])
+    async def skip_queue_item() -> dict:
+        """Play the next queued item now (stops playback if the queue is empty)"""
+        state = await queue.skip()
         return {
             "stream_type": state.stream_type.name,
             "title": state.title,
             "is_playing": state.is_playing,
-            "volume": state.volume,
-            "position": state.position,
-            "duration": state.duration,
-            "is_seekable": state.is_seekable,
         }
 
     @app.post(f"{config.control_endpoint}/play", dependencies=[token_dep])
@@ -119,6 +362,52 @@ def build_api(manager: StreamManager, whip: WhipEndpoint, config: ServerConfig)
         state = await manager.set_volume(volume)
         return {"volume": state.volume}
 
+    @app.get(f"{config.control_endpoint}/stats", dependencies=[token_dep])
+    async def control_stats() -> dict:
+        """Seek and volume commands received, applied and superseded by newer ones"""
+        return manager.control_stats()
+
+    @app.get("/qoe/sessions", dependencies=[token_dep])
+    async def list_qoe_sessions(
+        extractor: str | None = None,
+        domain: str | None = None,
+        since: float | None = None,
+        limit: int = Query(100, ge=1, le=1000),
+    ) -> dict:
+        """Playback session reports, newest first; `since` is epoch seconds"""
+        sessions = await asyncio.to_thread(qoe.sessions, extractor, domain, since, limit)
+        return {"sessions": sessions}
+
+    @app.get("/qoe/summary", dependencies=[token_dep])
+    async def qoe_summary(
+        group_by: str = Query("extractor", pattern=f"^({'|'.join(GROUP_COLUMNS)})$"),
+        extractor: str | None = None,
+        domain: str | None = None,
+        since: float | None = None,
+    ) -> dict:
+        """Startup time, rebuffering, retries, seek latency and failures per extractor, domain or delivery"""
+        groups = await asyncio.to_thread(qoe.summary, group_by, extractor, domain, since)
+        return {"group_by": group_by, "groups": groups}
+
+    @app.get("/debug/traces", dependencies=[token_dep])
+    async def list_traces() -> dict:
+        """Recent cast traces, newest first"""
+        return {"traces": [trace.summary() for trace in TRACER.recent()]}
+
+    @app.get("/debug/traces/{trace_id}", dependencies=[token_dep])
+    async def get_trace(trace_id: str, format: str = Query("json", pattern="^(json|chrome)$")) -> dict:
+        """One trace with all its spans; `format=chrome` loads in chrome://tracing or ui.perfetto.dev"""
+        try:
+            trace = TRACER.get(trace_id)
+        except KeyError:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Trace not found")
+        return trace.to_chrome() if format == "chrome" else trace.to_dict()
+
+    @app.get("/metrics", dependencies=[token_dep])
+    async def get_metrics() -> Response:
+        """Counters and latency histograms in the Prometheus text format"""
+        return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
     @app.post(f"{config.control_endpoint}/stop", dependencies=[token_dep])
     async def control_stop() -> dict:
         state = await manager.stop()
@@ -128,52 +417,36 @@ def build_api(manager: StreamManager, whip: WhipEndpoint, config: ServerConfig)
         }
 
     @app.post("/upload", dependencies=[token_dep])
-    async def upload_file(
-        file: UploadFile = File(...),
-        start_time: Annotated[float, Form()] = 0.0,
-    ) -> dict:
-        """Upload and play a media file"""
-        # Validate file type
-        content_type = file.content_type or ""
-        if not any(content_type.startswith(prefix) for prefix in ["video/", "audio/"]):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Unsupported file type: {content_type}. Only video and audio files are supported."
-            )
-        
-        # Create temporary directory for uploaded files
-        temp_dir = Path.home() / ".mtxcast" / "uploads"
-        temp_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Generate unique filename
-        file_extension = Path(file.filename or "file").suffix
-        temp_file = tempfile.NamedTemporaryFile(
-            delete=False,
-            suffix=file_extension,
-            dir=temp_dir
-        )
+    async def upload_file(request: Request) -> dict:
+        """Upload and play a media file (multipart form with `file` and optional `start_time`)"""
+        # The body is parsed as it streams in, so a large file never sits in memory
+        try:
+            upload = await receive_multipart_upload(request, UPLOAD_DIR, config.upload_max_bytes)
+        except UploadTooLargeError as e:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+        except InvalidUploadError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
         
+        file_path = upload.path
+        await asyncio.to_thread(storage.add, file_path)
         try:
-            # Save uploaded file
-            content = await file.read()
-            temp_file.write(content)
-            temp_file.close()
-            
-            file_path = Path(temp_file.name)
-            LOGGER.info(f"File uploaded: {file_path} ({len(content)} bytes)")
+            start_time = float(upload.fields.get("start_time") or 0.0)
             
             # Play the file
-            state = await manager.handle_file(str(file_path), start_time, file.filename)
+            state = await manager.handle_file(str(file_path), start_time, upload.filename)
             
             return {
                 "stream_type": state.stream_type.name,
                 "title": state.title,
                 "is_playing": state.is_playing,
                 "file_path": str(file_path),
+                "size": upload.size,
+                "sha256": upload.sha256,
+                "deduplicated": upload.deduplicated,
             }
         except Exception as e:
-            # Clean up on error
-            if file_path.exists():
+            # Clean up on error, but never an earlier upload this one was a duplicate of
+            if not upload.deduplicated and file_path.exists():
                 file_path.unlink()
             LOGGER.error(f"Error processing uploaded file: {e}", exc_info=True)
             raise HTTPException(
@@ -181,6 +454,62 @@ def build_api(manager: StreamManager, whip: WhipEndpoint, config: ServerConfig)
                 detail=f"Failed to process file: {str(e)}"
             )
 
+    @app.get("/storage", dependencies=[token_dep])
+    async def get_storage() -> dict:
+        """Disk usage of uploads and downloads, in eviction order"""
+        return await asyncio.to_thread(storage.usage)
+
+    @app.post("/uploads", dependencies=[token_dep], status_code=status.HTTP_201_CREATED)
+    async def create_upload(payload: UploadSessionPayload) -> dict:
+        """Create an upload session; PUT the file body to the returned `upload_url`.
+
+        If `sha256` matches a file the server already stores, the session is
+        complete (and playing) right away and nothing needs to be sent.
+        """
+        try:
+            session = uploads.create(payload)
+        except UploadTooLargeError as e:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+        except InvalidUploadError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        return {**session.to_dict(), "upload_url": f"/uploads/{session.upload_id}"}
+
+    def _get_upload(upload_id: str) -> UploadSession:
+        try:
+            return uploads.get(upload_id)
+        except KeyError:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+
+    @app.put("/uploads/{upload_id}", dependencies=[token_dep])
+    async def put_upload(upload_id: str, request: Request) -> dict:
+        """Receive the file body, or one `Content-Range` piece of it"""
+        session = _get_upload(upload_id)
+        try:
+            await uploads.receive(session, request)
+        except UploadTooLargeError as e:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+        except UploadConflictError as e:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+        except InvalidUploadError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        return session.to_dict()
+
+    @app.post("/uploads/{upload_id}/finalize", dependencies=[token_dep])
+    async def finalize_upload(upload_id: str) -> dict:
+        """Complete a ranged upload: checks the size and digest, then plays the file"""
+        session = _get_upload(upload_id)
+        try:
+            await uploads.finalize(session)
+        except UploadConflictError as e:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+        except InvalidUploadError as e:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+        return session.to_dict()
+
+    @app.get("/uploads/{upload_id}", dependencies=[token_dep])
+    async def get_upload(upload_id: str) -> dict:
+        return _get_upload(upload_id).to_dict()
+
     return app
 
 
@@ -9,10 +9,16 @@ from PySide6 import QtWidgets
 from qasync import QEventLoop
 
 from .api_server import build_api
+from .cast_jobs import CastJobManager
 from .config import ServerConfig, load_config
+from .download_cache import DOWNLOAD_DIR
 from .metadata import MetadataResolver
+from .play_queue import PlayQueue
 from .player import SettingsDialog, UIHandles, build_ui
+from .qoe import QoeRecorder, QoeStore
+from .storage import StorageManager
 from .stream_manager import StreamManager
+from .uploads import UPLOAD_DIR, UploadManager
 from .webrtc import WhipEndpoint
 
 LOGGER = logging.getLogger("mtxcast")
@@ -55,10 +61,49 @@ async def _async_main(handles: UIHandles, config: ServerConfig) -> None:
 
     handles.tray.wire(on_settings=open_settings, on_quit=request_quit)
 
-    resolver = MetadataResolver(config.yt_dlp_format)
-    manager = StreamManager(handles.backend, resolver)
+    storage = StorageManager(
+        {"uploads": UPLOAD_DIR, "downloads": DOWNLOAD_DIR},
+        max_bytes=config.storage_max_bytes,
+    )
+    # Clear what a previous run left behind before anything new is written
+    await asyncio.to_thread(storage.scan)
+    resolver = MetadataResolver(
+        config.yt_dlp_format,
+        cache_size=config.resolve_cache_size,
+        cache_ttl=config.resolve_cache_ttl,
+        progressive_prefix_bytes=config.progressive_prefix_bytes,
+        concurrent_fragments=config.download_concurrent_fragments,
+        prefetch_concurrency=config.prefetch_concurrency,
+        extract_processes=config.extract_processes,
+        warm_up_processes=config.extract_warm_up,
+        storage=storage,
+    )
+    # Build the YoutubeDL pool and extraction workers in the background so startup is not delayed
+    warm_up_task = asyncio.create_task(asyncio.to_thread(resolver.warm_up))
+    warm_up_task.add_done_callback(_on_warm_up_done)
+    qoe_store = await asyncio.to_thread(QoeStore, max_sessions=config.qoe_max_sessions)
+    qoe = QoeRecorder(qoe_store)
+    manager = StreamManager(handles.backend, resolver, storage, qoe)
     whip = WhipEndpoint(manager)
-    api = build_api(manager, whip, config)
+    queue = PlayQueue(
+        manager,
+        resolver,
+        lookahead=config.queue_lookahead,
+        refresh_margin=config.queue_refresh_margin,
+    )
+    queue.start()
+    uploads = UploadManager(
+        manager,
+        resolver.media_server,
+        max_bytes=config.upload_max_bytes,
+        prefix_bytes=config.progressive_prefix_bytes,
+        storage=storage,
+    )
+    handles.backend.playback_finished.connect(lambda: asyncio.create_task(queue.on_playback_finished()))
+    handles.backend.metrics_changed.connect(manager.update_metrics)
+    handles.backend.qoe_event.connect(qoe.on_player_event)
+    jobs = CastJobManager(manager, resolver)
+    api = build_api(manager, whip, config, resolver, queue, uploads, storage, jobs, qoe_store)
 
     handles.window.play_requested.connect(lambda: asyncio.create_task(manager.resume()))
     handles.window.pause_requested.connect(lambda: asyncio.create_task(manager.pause()))
@@ -81,6 +126,21 @@ async def _async_main(handles: UIHandles, config: ServerConfig) -> None:
         await server_task
     except asyncio.CancelledError:
         pass
+    try:
+        await queue.close()
+        await uploads.close()
+        await jobs.close()
+        await qoe.close()
+        # A failed warm-up was logged when it happened
+        await asyncio.gather(warm_up_task, return_exceptions=True)
+    finally:
+        # Always stop the extraction worker processes
+        resolver.close()
+
+
+def _on_warm_up_done(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        LOGGER.error("Warming up the resolver failed; it warms up on first use instead", exc_info=task.exception())
 
 
 def main() -> None:
@@ -0,0 +1,208 @@
+"""Casts that run in the background and report their progress by job ID."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Set
+
+from .metadata import MetadataPayload, MetadataResolver
+from .stream_manager import CastSupersededError, StreamManager
+from .tracing import current_span
+
+LOGGER = logging.getLogger(__name__)
+
+# Terminal phases; every other phase means the job is still running
+FINISHED_PHASES = ("playing", "failed")
+
+
+@dataclass
+class JobPhase:
+    name: str  # "queued", "resolving", "downloading", "buffering", "playing" or "failed"
+    started_at: float  # monotonic
+    ended_at: float | None = None
+
+    def to_dict(self, now: float) -> Dict[str, Any]:
+        return {"phase": self.name, "duration": (self.ended_at or now) - self.started_at}
+
+
+@dataclass
+class CastJob:
+    job_id: str
+    source_url: str
+    created: float  # epoch seconds
+    phases: List[JobPhase] = field(default_factory=list)
+    download: Dict[str, Any] | None = None  # progress while a download is running
+    error: str | None = None
+    result: Dict[str, Any] | None = None  # player status once playing
+    version: int = 0  # incremented on every change, for long-polling
+    trace_id: str | None = None  # see /debug/traces
+    changed: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    @property
+    def phase(self) -> str:
+        return self.phases[-1].name if self.phases else "queued"
+
+    @property
+    def finished(self) -> bool:
+        return self.phase in FINISHED_PHASES
+
+    def enter(self, name: str) -> None:
+        now = time.monotonic()
+        if self.phases:
+            if self.phases[-1].name == name:
+                return
+            self.phases[-1].ended_at = now
+        self.phases.append(JobPhase(name, now))
+        if name in FINISHED_PHASES:
+            self.phases[-1].ended_at = now
+        LOGGER.info("Cast job %s: %s", self.job_id, name)
+        self.touch()
+
+    def touch(self) -> None:
+        self.version += 1
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    def to_dict(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        first = self.phases[0].started_at if self.phases else now
+        last = self.phases[-1].ended_at if self.finished else None
+        return {
+            "id": self.job_id,
+            "version": self.version,
+            "source_url": self.source_url,
+            "created": self.created,
+            "phase": self.phase,
+            "phases": [p.to_dict(now) for p in self.phases],
+            "elapsed": (last or now) - first,
+            "download": self.download,
+            "error": self.error,
+            "result": self.result,
+            "trace_id": self.trace_id,
+        }
+
+
+class CastJobManager:
+    """Runs /metadata casts in the background so the request returns at once.
+
+    A job moves through resolving, downloading (for sites that require a
+    download, with progress), buffering and finally playing or failed; the
+    time spent in each phase is recorded.
+    """
+
+    def __init__(
+        self,
+        manager: StreamManager,
+        resolver: MetadataResolver,
+        history: int = 50,
+        download_poll_interval: float = 0.5,
+    ) -> None:
+        self._manager = manager
+        self._resolver = resolver
+        self._history = history  # finished jobs kept for reporting
+        self._download_poll_interval = download_poll_interval
+        self._jobs: OrderedDict[str, CastJob] = OrderedDict()
+        self._tasks: Set[asyncio.Task] = set()
+
+    def submit(self, payload: MetadataPayload) -> CastJob:
+        trace = current_span().trace
+        job = CastJob(
+            job_id=uuid.uuid4().hex[:12],
+            source_url=str(payload.source_url),
+            created=time.time(),
+            trace_id=trace.trace_id if trace is not None else None,
+        )
+        self._jobs[job.job_id] = job
+        self._trim()
+        task = asyncio.create_task(self._run(job, payload))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    def get(self, job_id: str) -> CastJob:
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        return job
+
+    def recent(self) -> List[CastJob]:
+        """Jobs newest first"""
+        return list(reversed(self._jobs.values()))
+
+    async def wait(self, job: CastJob, since_version: int, timeout: float) -> CastJob:
+        """Return once the job changes past `since_version`, or after `timeout` seconds"""
+        if job.version <= since_version and not job.finished:
+            try:
+                await asyncio.wait_for(job.changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return job
+
+    async def close(self) -> None:
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, job: CastJob, payload: MetadataPayload) -> None:
+        watcher = asyncio.create_task(self._watch_download(job))
+        try:
+            status = await self._manager.handle_metadata(payload, on_phase=job.enter)
+        except (CastSupersededError, asyncio.CancelledError) as e:
+            job.error = str(e) or "Cancelled"
+            job.enter("failed")
+            if isinstance(e, asyncio.CancelledError):
+                raise
+        except Exception as e:
+            LOGGER.error("Cast job %s failed: %s", job.job_id, e, exc_info=True)
+            job.error = str(e)
+            job.enter("failed")
+        else:
+            job.result = {
+                "stream_type": status.stream_type.name,
+                "title": status.title,
+                "is_playing": status.is_playing,
+            }
+            job.enter("playing")
+        finally:
+            watcher.cancel()
+            self._trim()
+
+    async def _watch_download(self, job: CastJob) -> None:
+        """Report download progress while the job is resolving (downloads happen inside resolution)"""
+        while True:
+            await asyncio.sleep(self._download_poll_interval)
+            if job.phase not in ("resolving", "downloading"):
+                continue
+            progress = self._resolver.download_progress(job.source_url)
+            # A download that finished before this job started belongs to an earlier cast
+            if progress is None or (progress.status != "downloading" and progress.started_at < job.created):
+                continue
+            percent = (
+                100.0 * progress.downloaded_bytes / progress.total_bytes if progress.total_bytes else None
+            )
+            download = {
+                "status": progress.status,
+                "downloaded_bytes": progress.downloaded_bytes,
+                "total_bytes": progress.total_bytes,
+                "percent": percent,
+                "speed": progress.speed,
+                "eta": progress.eta,
+            }
+            if download == job.download:
+                continue
+            job.download = download
+            if job.phase == "resolving" and progress.status == "downloading":
+                job.enter("downloading")
+            else:
+                job.touch()
+
+    def _trim(self) -> None:
+        finished = [k for k, job in self._jobs.items() if job.finished]
+        for key in finished[: max(0, len(finished) - self._history)]:
+            del self._jobs[key]
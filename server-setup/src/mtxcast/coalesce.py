@@ -0,0 +1,77 @@
+"""Latest-wins coalescing of player commands that arrive in bursts."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Generic, List, TypeVar
+
+LOGGER = logging.getLogger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class LatestWins(Generic[T, R]):
+    """Applies only the most recent of a burst of commands.
+
+    At most one command is applied at a time. Commands that arrive meanwhile
+    replace each other, and the last one is applied once `settle` returns
+    (e.g. once the player has finished the previous seek). Every caller gets
+    the result of the command that was applied in place of its own.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        apply: Callable[[T], Awaitable[R]],
+        settle: Callable[[T], Awaitable[None]] | None = None,
+    ) -> None:
+        self._name = name
+        self._apply = apply
+        self._settle = settle
+        self._pending: T | None = None
+        self._has_pending = False
+        self._waiters: List[asyncio.Future] = []
+        self._worker: asyncio.Task | None = None
+        self.submitted = 0
+        self.applied = 0
+        self.superseded = 0  # commands replaced by a newer one before they were applied
+
+    async def submit(self, value: T) -> R:
+        future = asyncio.get_running_loop().create_future()
+        self.submitted += 1
+        if self._has_pending:
+            self.superseded += 1
+            LOGGER.debug("%s %r superseded by %r", self._name, self._pending, value)
+        self._pending = value
+        self._has_pending = True
+        self._waiters.append(future)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._drain())
+        return await future
+
+    def stats(self) -> Dict[str, int]:
+        return {"submitted": self.submitted, "applied": self.applied, "superseded": self.superseded}
+
+    async def _drain(self) -> None:
+        while self._has_pending:
+            value, waiters = self._pending, self._waiters
+            self._pending, self._has_pending, self._waiters = None, False, []
+            try:
+                result = await self._apply(value)
+            except Exception as e:
+                for future in waiters:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.applied += 1
+            for future in waiters:
+                if not future.done():
+                    future.set_result(result)
+            if self._settle is not None:
+                # Commands arriving now wait here and only the newest survives
+                try:
+                    await self._settle(value)
+                except Exception as e:
+                    LOGGER.warning("Waiting for %s to settle failed: %s", self._name, e)
@@ -21,6 +21,18 @@ class ServerConfig:
     auto_fullscreen: bool = True
     autoplay: bool = True
     yt_dlp_format: str = "best"
+    resolve_cache_size: int = 64
+    resolve_cache_ttl: float = 600.0  # seconds, for URLs without an expire= hint
+    progressive_prefix_bytes: int = 4 * 1024 * 1024  # 0 waits for downloads to finish
+    download_concurrent_fragments: int = 4
+    prefetch_concurrency: int = 2
+    extract_processes: int = 2  # yt-dlp extraction worker processes; 0 extracts in threads
+    extract_warm_up: bool = True  # start the extraction workers at launch
+    queue_lookahead: int = 2  # queued items kept resolved ahead of time
+    queue_refresh_margin: float = 120.0  # seconds before URL expiry that queued items are resolved again
+    upload_max_bytes: int = 16 * 1024**3  # 0 = unlimited
+    storage_max_bytes: int = 50 * 1024**3  # uploads and downloads together; 0 = unlimited
+    qoe_max_sessions: int = 10000  # playback session reports kept; 0 = unlimited
     api_token: str | None = None
     tray_autostart: bool = True
 
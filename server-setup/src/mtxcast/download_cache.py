@@ -0,0 +1,181 @@
+"""Bounded on-disk cache of downloaded media keyed by extractor and video ID."""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Dict, Optional, Set
+
+from .resolution_cache import normalize_url
+
+LOGGER = logging.getLogger(__name__)
+
+DOWNLOAD_DIR = Path.home() / ".mtxcast" / "downloads"
+INDEX_FILE = "index.json"
+
+
+@dataclass
+class DownloadEntry:
+    filename: str  # relative to the cache directory
+    size: int
+    title: str | None = None
+    created: float = 0.0
+    last_used: float = 0.0
+
+
+class DownloadCache:
+    """Tracks downloaded files in a JSON index with a byte cap and LRU eviction.
+
+    Files are named after their key, so finding a download never requires
+    scanning the directory, and concurrent downloads of different videos
+    cannot be confused with each other. With `max_bytes=0` the cache does no
+    eviction of its own; a StorageManager enforces the quota instead, and
+    entries whose files it deleted are dropped on lookup.
+    """
+
+    def __init__(self, directory: Path = DOWNLOAD_DIR, max_bytes: int = 10 * 1024**3) -> None:
+        self._dir = directory
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: Dict[str, DownloadEntry] = {}
+        self._urls: Dict[str, str] = {}  # normalized source URL -> key
+        self._in_progress: Set[str] = set()
+        self._dir.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+    @property
+    def directory(self) -> Path:
+        return self._dir
+
+    @staticmethod
+    def key_for(info: Dict[str, Any]) -> str:
+        return f"{info.get('extractor_key') or info.get('extractor')}:{info.get('id')}"
+
+    def output_template(self, key: str) -> str:
+        """yt-dlp outtmpl that stores `key` at its content-addressed location"""
+        safe_key = re.sub(r"[^A-Za-z0-9_.-]", "_", key)
+        return str(self._dir / f"{safe_key}.%(ext)s")
+
+    def path_for(self, entry: DownloadEntry) -> Path:
+        return self._dir / entry.filename
+
+    def lookup(self, key: str) -> Optional[DownloadEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            path = self.path_for(entry)
+            if not path.exists():
+                LOGGER.info("Cached download disappeared: %s", path)
+                self._remove_locked(key)
+                self._save_locked()
+                return None
+            entry.last_used = time.time()
+            self._save_locked()
+            return entry
+
+    def lookup_url(self, url: str) -> Optional[DownloadEntry]:
+        """Find a download by source URL, without extracting it first"""
+        with self._lock:
+            key = self._urls.get(normalize_url(url))
+        return self.lookup(key) if key else None
+
+    def begin(self, key: str) -> bool:
+        """Mark `key` as downloading so eviction leaves it alone; False if it already is"""
+        with self._lock:
+            if key in self._in_progress:
+                return False
+            self._in_progress.add(key)
+            return True
+
+    def end(self, key: str) -> None:
+        with self._lock:
+            self._in_progress.discard(key)
+
+    def add(self, key: str, path: Path, title: str | None = None, source_url: str | None = None) -> None:
+        now = time.time()
+        with self._lock:
+            self._entries[key] = DownloadEntry(
+                filename=path.name,
+                size=path.stat().st_size,
+                title=title,
+                created=now,
+                last_used=now,
+            )
+            if source_url:
+                self._urls[normalize_url(source_url)] = key
+            self._evict_locked(keep=key)
+            self._save_locked()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": sum(e.size for e in self._entries.values()),
+                "max_bytes": self._max_bytes,
+                "in_progress": len(self._in_progress),
+            }
+
+    def _evict_locked(self, keep: str) -> None:
+        if not self._max_bytes:
+            return
+        total = sum(e.size for e in self._entries.values())
+        if total <= self._max_bytes:
+            return
+        candidates = sorted(
+            (k for k in self._entries if k != keep and k not in self._in_progress),
+            key=lambda k: self._entries[k].last_used,
+        )
+        for key in candidates:
+            if total <= self._max_bytes:
+                break
+            path = self.path_for(self._entries[key])
+            total -= self._entries[key].size
+            LOGGER.info("Evicting cached download %s (%d bytes)", path, self._entries[key].size)
+            try:
+                path.unlink(missing_ok=True)
+            except OSError as e:
+                LOGGER.warning("Failed to remove %s: %s", path, e)
+            self._remove_locked(key)
+
+    def _remove_locked(self, key: str) -> None:
+        self._entries.pop(key, None)
+        for url in [u for u, k in self._urls.items() if k == key]:
+            del self._urls[url]
+
+    def _load(self) -> None:
+        index_path = self._dir / INDEX_FILE
+        if not index_path.exists():
+            return
+        try:
+            with index_path.open("r", encoding="utf-8") as fh:
+                data = json.load(fh)
+            for key, raw in data.get("entries", {}).items():
+                entry = DownloadEntry(**raw)
+                if self.path_for(entry).exists():
+                    self._entries[key] = entry
+            self._urls = {u: k for u, k in data.get("urls", {}).items() if k in self._entries}
+        except (OSError, ValueError, TypeError) as e:
+            LOGGER.warning("Ignoring unreadable download index %s: %s", index_path, e)
+            self._entries.clear()
+            self._urls.clear()
+
+    def _save_locked(self) -> None:
+        index_path = self._dir / INDEX_FILE
+        tmp_path = index_path.with_suffix(".tmp")
+        data = {
+            "entries": {k: asdict(e) for k, e in self._entries.items()},
+            "urls": self._urls,
+        }
+        try:
+            with tmp_path.open("w", encoding="utf-8") as fh:
+                json.dump(data, fh, indent=2)
+            os.replace(tmp_path, index_path)
+        except OSError as e:
+            LOGGER.warning("Failed to write download index %s: %s", index_path, e)
@@ -0,0 +1,189 @@
+"""Process pool that runs yt-dlp extraction outside the server's interpreter."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.connection import Connection
+from typing import Any, Callable, List, Tuple, TypeVar
+
+LOGGER = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def _ping() -> bool:
+    return True
+
+
+def _worker_main(conn: Connection, initializer: Callable[..., None] | None, initargs: Tuple[Any, ...]) -> None:
+    if initializer is not None:
+        initializer(*initargs)
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            return
+        if job is None:
+            return
+        fn, args = job
+        try:
+            reply = (True, fn(*args))
+        except BaseException as e:
+            reply = (False, e)
+        try:
+            conn.send(reply)
+        except Exception as e:
+            # The result or the exception itself did not pickle
+            conn.send((False, RuntimeError(f"{fn.__name__} returned an unpicklable result: {e}")))
+
+
+class _Worker:
+    def __init__(self, ctx: Any, initializer: Callable[..., None] | None, initargs: Tuple[Any, ...]) -> None:
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(child_conn, initializer, initargs),
+            name="mtxcast-extract",
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+
+    def call(self, fn: Callable[..., T], args: Tuple[Any, ...]) -> T:
+        try:
+            self.conn.send((fn, args))
+            ok, value = self.conn.recv()
+        except (EOFError, OSError) as e:
+            raise BrokenProcessPool(f"Extraction worker {self.process.pid} exited unexpectedly") from e
+        if not ok:
+            raise value
+        return value
+
+    def terminate(self) -> None:
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+
+    def shutdown(self) -> None:
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=1.0)
+        self.terminate()
+
+
+class ExtractionPool:
+    """Runs picklable functions in spawned worker processes.
+
+    Extraction is CPU-bound Python that holds the GIL for seconds at a time.
+    In a thread it competes with the Qt event loop, uvicorn and the WebRTC frame
+    loop; in a separate process it does not. Workers are started with the spawn
+    method because forking a process that runs Qt and aiortc threads is unsafe.
+
+    Each call has a worker to itself, so cancelling a call terminates its
+    worker (aborting the extraction) and a fresh one takes its place.
+    ProcessPoolExecutor cannot do that: a running future ignores `cancel()`.
+    """
+
+    def __init__(self, size: int, initializer: Callable[..., None] | None = None, initargs: Tuple[Any, ...] = ()) -> None:
+        self._size = max(1, size)
+        self._initializer = initializer
+        self._initargs = initargs
+        self._ctx = multiprocessing.get_context("spawn")
+        self._idle: List[_Worker] = []
+        self._busy = 0
+        self._lock = threading.Lock()
+        self._slots = asyncio.Semaphore(self._size)
+        self._closed = False
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def warm_up(self) -> None:
+        """Start every worker now so the first extraction does not pay for interpreter startup"""
+        started = time.monotonic()
+        with self._lock:
+            missing = self._size - len(self._idle) - self._busy
+        workers = [self._spawn() for _ in range(max(0, missing))]
+        for worker in workers:
+            # Returns once the worker has imported yt-dlp and run the initializer
+            worker.call(_ping, ())
+        with self._lock:
+            self._idle.extend(workers)
+        LOGGER.info("Extraction pool warmed up: %d workers in %.2fs", len(workers), time.monotonic() - started)
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> T:
+        """Run `fn(*args)` in a worker; cancelling the call terminates the worker"""
+        async with self._slots:
+            worker = self._checkout()
+            try:
+                result = await asyncio.to_thread(worker.call, fn, args)
+            except asyncio.CancelledError:
+                # The helper thread is still blocked on the pipe; killing the
+                # worker aborts the extraction and unblocks the thread
+                LOGGER.info("Terminating extraction worker %s", worker.process.pid)
+                self._discard(worker)
+                raise
+            except BrokenProcessPool:
+                self._discard(worker)
+                raise
+            self._checkin(worker)
+            return result
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            workers, self._idle = self._idle, []
+        for worker in workers:
+            worker.shutdown()
+
+    def _spawn(self) -> _Worker:
+        return _Worker(self._ctx, self._initializer, self._initargs)
+
+    def _checkout(self) -> _Worker:
+        with self._lock:
+            worker = self._idle.pop() if self._idle else None
+            self._busy += 1
+        if worker is None or not worker.process.is_alive():
+            if worker is not None:
+                worker.terminate()
+            worker = self._spawn()
+        return worker
+
+    def _checkin(self, worker: _Worker) -> None:
+        with self._lock:
+            self._busy -= 1
+            if not self._closed:
+                self._idle.append(worker)
+                return
+        worker.shutdown()
+
+    def _discard(self, worker: _Worker) -> None:
+        worker.terminate()
+        with self._lock:
+            self._busy -= 1
+            closed = self._closed
+        if not closed:
+            # Start the replacement now rather than on the next extraction
+            threading.Thread(target=self._replace, name="mtxcast-extract-respawn", daemon=True).start()
+
+    def _replace(self) -> None:
+        worker = self._spawn()
+        try:
+            worker.call(_ping, ())
+        except BrokenProcessPool as e:
+            LOGGER.warning("Replacement extraction worker failed to start: %s", e)
+            worker.terminate()
+            return
+        with self._lock:
+            if not self._closed and len(self._idle) + self._busy < self._size:
+                self._idle.append(worker)
+                return
+        worker.shutdown()
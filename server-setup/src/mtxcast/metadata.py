@@ -2,14 +2,27 @@ from __future__ import annotations
 
 import asyncio
 import logging
-from dataclasses import dataclass
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict, dataclass, replace
 from pathlib import Path
-from typing import Optional
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 from pydantic import BaseModel, HttpUrl
-from yt_dlp import YoutubeDL
 from yt_dlp.utils import DownloadError
 
+from .download_cache import DownloadCache
+from .extract_pool import ExtractionPool
+from .metrics import Counter, Histogram
+from .progressive import GrowingFile, LocalMediaServer
+from .resolution_cache import CacheKey, ResolutionCache, normalize_url
+from .storage import StorageManager
+from .tracing import current_span, span, traced
+from .ydl_pool import YdlPool
+
 LOGGER = logging.getLogger(__name__)
 
 
@@ -30,247 +43,707 @@ class ResolvedMedia:
     file_path: str | None = None  # Local file path (for sites requiring download like niconico)
     video_file_path: str | None = None  # Local file path for separated video stream
     audio_file_path: str | None = None  # Local file path for separated audio stream
+    progressive: bool = False  # playback_url serves a download that is still in progress
+    local_path: str | None = None  # file behind a progressive playback_url
+    extractor: str | None = None  # yt-dlp extractor key, e.g. "Youtube"
+    source_url: str | None = None  # page URL the cast was requested with
+
+
+@dataclass
+class DownloadProgress:
+    key: str
+    title: str | None = None
+    source_url: str | None = None  # URL the download was requested for
+    status: str = "downloading"  # "downloading", "finished" or "error"
+    downloaded_bytes: int = 0
+    total_bytes: int | None = None
+    speed: float | None = None  # bytes/s, smoothed by yt-dlp
+    average_speed: float | None = None  # bytes/s since the download started
+    eta: float | None = None  # seconds
+    fragment_index: int | None = None
+    fragment_count: int | None = None
+    started_at: float = 0.0
+    elapsed: float = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+RESOLVE_SECONDS = Histogram(
+    "mtxcast_resolve_duration_seconds",
+    "Time to resolve a URL (extraction, plus the download prefix for download-only sites)",
+    ["extractor"],
+)
+RESOLVE_REQUESTS = Counter(
+    "mtxcast_resolve_requests_total",
+    "Resolution requests by outcome: hit (cache), miss or refresh",
+    ["result"],
+)
+DOWNLOAD_BYTES = Counter("mtxcast_download_bytes_total", "Bytes downloaded for sites that are played from disk")
+DOWNLOADS = Counter("mtxcast_downloads_total", "Downloads that finished or failed", ["status"])
+DOWNLOAD_THROUGHPUT = Histogram(
+    "mtxcast_download_throughput_bytes_per_second",
+    "Average speed of finished downloads",
+    buckets=(256e3, 1e6, 2.5e6, 5e6, 10e6, 25e6, 50e6, 100e6),
+)
+
+
+# Selection policies, written as the equivalent yt-dlp format specs. Selection itself
+# happens locally in _select_stream_formats/_select_download_formats; the specs
+# identify the policy in resolution cache keys.
+# Streamed playback: prefer separated streams, never AV1
+_STREAM_FORMAT = "bestvideo[vcodec!=av01][vcodec!^=av01]+bestaudio/best[vcodec!=av01][vcodec!^=av01]"
+# Sites that must be downloaded before playback
+_DOWNLOAD_FORMAT = "best[vcodec!=av01][vcodec!^=av01]"
+
+# YoutubeDL option profiles kept warm in the pool
+_YDL_PROFILES = {
+    "extract": {"quiet": True},
+    "download": {"quiet": True},
+}
+
+# Result types that point at another URL instead of carrying formats
+_REDIRECT_RESULT_TYPES = ("url", "url_transparent")
+_MAX_REDIRECTS = 5
+
+
+def _extract_unprocessed(ydl: Any, url: str) -> Dict[str, Any]:
+    """Run the extractor once with process=False, following redirect results"""
+    info = ydl.extract_info(url, download=False, process=False)
+    for _ in range(_MAX_REDIRECTS):
+        if info.get("_type") == "playlist":
+            first = next(iter(info.get("entries") or []), None)
+            if first is None:
+                raise RuntimeError("Playlist has no entries")
+            LOGGER.info("URL is a playlist, using its first entry")
+            info = first
+            continue
+        if info.get("_type") not in _REDIRECT_RESULT_TYPES:
+            return info
+        outer = info
+        info = ydl.extract_info(outer["url"], ie_key=outer.get("ie_key"), download=False, process=False)
+        if outer["_type"] == "url_transparent":
+            # Fields set by the outer extractor (title etc.) take precedence
+            overrides = {
+                k: v for k, v in outer.items()
+                if v is not None and k not in ("_type", "url", "ie_key", "id", "extractor", "extractor_key")
+            }
+            info = {**info, **overrides}
+    raise RuntimeError(f"Too many redirects while extracting {url}")
+
+
+def _format_url(fmt: Dict[str, Any]) -> str | None:
+    return fmt.get("url") or fmt.get("manifest_url") or fmt.get("fragment_base_url")
+
+
+def _is_av1(fmt: Dict[str, Any]) -> bool:
+    vcodec = (fmt.get("vcodec") or "").lower()
+    return vcodec.startswith("av01") or "av01" in vcodec
+
+
+def _format_rank(fmt: Dict[str, Any]) -> Tuple[float, ...]:
+    """Sort key approximating yt-dlp's default preference (higher is better).
+
+    Fields follow yt-dlp's default sort order (ie_pref, lang, quality, res,
+    fps, br, asr, source) with its defaults for missing values, so that e.g.
+    the original audio track wins over dubbed or descriptive ones.
+    """
+    def value(field: str, default: float = 0) -> float:
+        v = fmt.get(field)
+        return default if v is None else v
+
+    return (
+        value("preference"),
+        value("language_preference", -1),
+        value("quality", -1),
+        value("height"),
+        value("fps"),
+        fmt.get("tbr") or fmt.get("vbr") or 0,
+        value("abr"),
+        value("asr"),
+        value("source_preference", -1),
+    )
+
+
+def _candidate_formats(info: Dict[str, Any]) -> List[Dict[str, Any]]:
+    formats = info.get("formats") or ([info] if _format_url(info) else [])
+    return [
+        fmt for fmt in formats
+        if _format_url(fmt)
+        and not fmt.get("has_drm")
+        # Storyboards and other non-media entries have neither codec
+        and not (fmt.get("vcodec") == "none" and fmt.get("acodec") == "none")
+    ]
+
+
+def _select_stream_formats(
+    info: Dict[str, Any],
+) -> Tuple[Dict[str, Any] | None, Dict[str, Any] | None, Dict[str, Any] | None]:
+    """Apply _STREAM_FORMAT locally.
+
+    Returns (video, audio, None) for separated streams, (None, None, single) for a
+    combined stream, or (None, None, fallback) when only AV1 or unusual formats exist.
+    """
+    candidates = _candidate_formats(info)
+    non_av1 = [fmt for fmt in candidates if not _is_av1(fmt)]
+    
+    video_only = [f for f in non_av1 if f.get("vcodec") not in (None, "none") and f.get("acodec") == "none"]
+    audio_only = [f for f in non_av1 if f.get("vcodec") == "none" and f.get("acodec") != "none"]
+    if video_only and audio_only:
+        return max(video_only, key=_format_rank), max(audio_only, key=_format_rank), None
+    
+    # Codecs left unknown by the extractor are assumed to be combined, as yt-dlp does
+    combined = [f for f in non_av1 if f.get("vcodec") != "none" and f.get("acodec") != "none"]
+    if combined:
+        return None, None, max(combined, key=_format_rank)
+    
+    # Fallback: whatever is best, still avoiding AV1 when possible
+    fallback = non_av1 or candidates
+    if fallback:
+        LOGGER.warning("No combined non-AV1 format available, falling back to auto-select")
+        return None, None, max(fallback, key=_format_rank)
+    return None, None, None
+
+
+def _select_download_formats(info: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Apply _DOWNLOAD_FORMAT locally, returning the formats yt-dlp may choose from"""
+    formats = info.get("formats") or []
+    non_av1 = [fmt for fmt in formats if not _is_av1(fmt)]
+    combined = [f for f in non_av1 if f.get("vcodec") != "none" and f.get("acodec") != "none"]
+    if combined:
+        return [max(combined, key=_format_rank)]
+    # Nothing matches the filter: let yt-dlp auto-select, as the old fallback did
+    LOGGER.warning("No combined non-AV1 format to download, falling back to auto-select")
+    return non_av1 or formats
+
+
+def _resolve_stream(ydl: Any, url: str) -> ResolvedMedia:
+    """Extract `url` with `ydl` and pick the formats to stream"""
+    # Extract once without yt-dlp's format processing and pick formats locally.
+    # Running the format spec inside yt-dlp raises DownloadError when nothing
+    # matches, which used to cost a second full extraction for the fallback.
+    try:
+        info = _extract_unprocessed(ydl, url)
+        
+        # Log extracted info for debugging
+        LOGGER.debug("Extractor: %s", info.get("extractor") if info else None)
+        
+        video_format, audio_format, single_format = _select_stream_formats(info)
+        
+        if video_format and audio_format:
+            # Separated streams (video + audio)
+            LOGGER.info("Using separated streams - Video: %s, Audio: %s", 
+                       video_format.get("format_id"), audio_format.get("format_id"))
+            return ResolvedMedia(
+                playback_url="",  # Not used for separated streams
+                title=info.get("title"),
+                video_url=_format_url(video_format),
+                audio_url=_format_url(audio_format),
+                file_path=None,
+                video_file_path=None,
+                audio_file_path=None,
+                extractor=info.get("extractor_key"),
+            )
+        
+        # Single stream (video + audio combined) or fallback
+        playback_url = _format_url(single_format) if single_format else None
+        
+        if not playback_url:
+            LOGGER.error("No playback URL found. Available fields: %s", list(info.keys()) if info else None)
+            raise RuntimeError("No playable format found with direct URL")
+        
+        LOGGER.info("Using single stream URL (format %s): %s",
+                   single_format.get("format_id"), playback_url[:100])
+        return ResolvedMedia(
+            playback_url=playback_url,
+            title=info.get("title"),
+            video_url=None,
+            audio_url=None,
+            file_path=None,
+            video_file_path=None,
+            audio_file_path=None,
+            extractor=info.get("extractor_key"),
+        )
+    except DownloadError as e:
+        LOGGER.error("Failed to extract video info: %s", e)
+        raise RuntimeError(f"Failed to extract video info: {e}")
+    except Exception as e:
+        LOGGER.error("Unexpected error during extraction: %s", e)
+        raise RuntimeError(f"Unexpected error during extraction: {e}")
+
+
+# Extraction worker processes. Each keeps one YoutubeDL for its whole lifetime.
+_worker_ydl: Any = None
+
+
+def _init_extract_worker(params: Dict[str, Any]) -> None:
+    global _worker_ydl
+    from yt_dlp import YoutubeDL
+
+    _worker_ydl = YoutubeDL(dict(params))
+
+
+def _resolve_stream_in_worker(url: str) -> ResolvedMedia:
+    return _resolve_stream(_worker_ydl, url)
 
 
 class MetadataResolver:
-    def __init__(self, yt_format: str = "best") -> None:
+    def __init__(
+        self,
+        yt_format: str = "best",
+        cache_size: int = 64,
+        cache_ttl: float = 600.0,
+        progressive_prefix_bytes: int = 4 * 1024 * 1024,
+        download_cache_max_bytes: int = 10 * 1024**3,
+        concurrent_fragments: int = 4,
+        prefetch_concurrency: int = 2,
+        extract_processes: int = 2,
+        warm_up_processes: bool = True,
+        storage: StorageManager | None = None,
+    ) -> None:
         self._yt_format = yt_format
+        self._cache = ResolutionCache(max_entries=cache_size, default_ttl=cache_ttl)
+        profiles = dict(_YDL_PROFILES)
+        profiles["download"] = {
+            **profiles["download"],
+            "progress_hooks": [self._on_download_progress],
+            # HLS/DASH fragments are fetched in parallel so LAN downloads are bandwidth-bound
+            "concurrent_fragment_downloads": max(1, concurrent_fragments),
+        }
+        self._ydl_pool = YdlPool(profiles)
+        # Streamed URLs are extracted in worker processes (0 keeps extraction in threads);
+        # downloads stay in this process for progress reporting and progressive playback
+        self._extract_pool = (
+            ExtractionPool(extract_processes, _init_extract_worker, (_YDL_PROFILES["extract"],))
+            if extract_processes > 0
+            else None
+        )
+        self._warm_up_processes = warm_up_processes
+        # Playback of downloads starts once this many bytes are on disk (0 waits for the whole file)
+        self._progressive_prefix_bytes = progressive_prefix_bytes
+        self._progressive_downloads: Dict[str, GrowingFile] = {}
+        # Downloads running per key, resolving to the finished file; a second cast of the same video waits on it
+        self._active_downloads: Dict[str, Future] = {}
+        self._active_lock = threading.Lock()
+        self._media_server = LocalMediaServer()
+        self._storage = storage
+        # With a storage manager, downloads count towards its shared quota instead of a cap of their own
+        self._downloads = DownloadCache(max_bytes=0 if storage is not None else download_cache_max_bytes)
+        self._download_progress: OrderedDict[str, DownloadProgress] = OrderedDict()
+        self._progress_lock = threading.Lock()
+        self._progress_started: Dict[str, float] = {}
+        self._progress_history = 20  # finished downloads kept for reporting
+        self._download_sources: Dict[str, str] = {}  # download key -> requested URL
+        self._inflight: Dict[CacheKey, asyncio.Task] = {}
+        self._inflight_waiters: Dict[asyncio.Task, int] = {}
+        self._prefetch_semaphore = asyncio.Semaphore(max(1, prefetch_concurrency))
+        self._prefetch_pending: Set[CacheKey] = set()
+        self._prefetch_tasks: Set[asyncio.Task] = set()
+        self._max_pending_prefetches = 16
+
+    def warm_up(self) -> None:
+        """Pre-create YoutubeDL instances (and worker processes) so the first cast does not pay for it"""
+        self._ydl_pool.warm_up()
+        if self._extract_pool is not None and self._warm_up_processes:
+            self._extract_pool.warm_up()
+
+    def close(self) -> None:
+        self._ydl_pool.close()
+        if self._extract_pool is not None:
+            self._extract_pool.close()
+        self._media_server.close()
+
+    @property
+    def cache(self) -> ResolutionCache:
+        return self._cache
+
+    @property
+    def media_server(self) -> LocalMediaServer:
+        """Loopback server for files that are still being written"""
+        return self._media_server
+
+    def release(self, resolved: ResolvedMedia) -> None:
+        """Stop serving the loopback URL of a progressive result that is no longer played"""
+        if resolved.progressive:
+            self._media_server.unregister(resolved.playback_url)
 
     def _is_niconico(self, url: str) -> bool:
         """Check if URL is from niconico"""
         return "nicovideo.jp" in url or "nico.ms" in url
 
-    def _download_to_temp_file(self, url: str, title: str | None = None) -> str:
-        """Download video to temporary file using yt-dlp"""
-        # Create temporary directory for downloads
-        temp_dir = Path.home() / ".mtxcast" / "downloads"
-        temp_dir.mkdir(parents=True, exist_ok=True)
+    def downloads(self) -> List[DownloadProgress]:
+        """Snapshot of active and recently finished downloads, newest first"""
+        with self._progress_lock:
+            return [replace(p) for p in reversed(self._download_progress.values())]
+
+    def download_progress(self, url: str) -> Optional[DownloadProgress]:
+        """Latest download started for `url`, if any"""
+        wanted = normalize_url(url)
+        with self._progress_lock:
+            for entry in reversed(self._download_progress.values()):
+                if entry.source_url and normalize_url(entry.source_url) == wanted:
+                    return replace(entry)
+        return None
+
+    def _on_download_progress(self, progress: Dict[str, Any]) -> None:
+        info = progress.get("info_dict") or {}
+        key = DownloadCache.key_for(info)
+        self._record_progress(key, info, progress)
         
-        # Generate filename from title or use default
-        if title:
-            # Sanitize filename
-            safe_title = "".join(c for c in title if c.isalnum() or c in (' ', '-', '_')).strip()[:100]
-            filename_template = f"{safe_title}.%(ext)s"
+        growing = self._progressive_downloads.get(key)
+        if growing is None:
+            return
+        filename = progress.get("tmpfilename") or progress.get("filename")
+        if filename and growing.path != Path(filename):
+            growing.set_path(filename)
         else:
-            filename_template = "video.%(ext)s"
+            growing.notify()
+
+    def _record_progress(self, key: str, info: Dict[str, Any], progress: Dict[str, Any]) -> None:
+        now = time.monotonic()
+        with self._progress_lock:
+            entry = self._download_progress.get(key)
+            if entry is None or entry.status != "downloading":
+                entry = DownloadProgress(
+                    key=key,
+                    title=info.get("title"),
+                    source_url=self._download_sources.get(key),
+                    started_at=time.time(),
+                )
+                self._download_progress[key] = entry
+                self._download_progress.move_to_end(key)
+                self._progress_started[key] = now
+            elapsed = now - self._progress_started.get(key, now)
+            previous_bytes = entry.downloaded_bytes
+            
+            entry.status = progress.get("status") or entry.status
+            entry.downloaded_bytes = progress.get("downloaded_bytes") or entry.downloaded_bytes
+            entry.total_bytes = progress.get("total_bytes") or progress.get("total_bytes_estimate") or entry.total_bytes
+            entry.speed = progress.get("speed")
+            entry.eta = progress.get("eta")
+            entry.fragment_index = progress.get("fragment_index")
+            entry.fragment_count = progress.get("fragment_count")
+            entry.elapsed = elapsed
+            entry.average_speed = entry.downloaded_bytes / elapsed if elapsed > 0 else None
+            if entry.downloaded_bytes > previous_bytes:
+                DOWNLOAD_BYTES.inc(entry.downloaded_bytes - previous_bytes)
+            if entry.status == "finished":
+                DOWNLOADS.labels("finished").inc()
+                if entry.average_speed:
+                    DOWNLOAD_THROUGHPUT.observe(entry.average_speed)
+            
+            finished = [k for k, p in self._download_progress.items() if p.status != "downloading"]
+            for old in finished[: max(0, len(finished) - self._progress_history)]:
+                del self._download_progress[old]
+                self._progress_started.pop(old, None)
+
+    def _mark_download_failed(self, key: str) -> None:
+        with self._progress_lock:
+            entry = self._download_progress.get(key)
+            if entry is not None and entry.status == "downloading":
+                entry.status = "error"
+                DOWNLOADS.labels("error").inc()
+
+    def _download_to_temp_file(self, info: Dict[str, Any], progressive: bool = False) -> str:
+        """Download an already extracted video into the download cache directory using yt-dlp
+
+        With `progressive` the file is written in place (no .part rename, no fixup
+        remux afterwards) so that it can be played while it downloads.
+        """
+        key = DownloadCache.key_for(info)
+        LOGGER.info("Downloading %s to %s", key, self._downloads.directory)
+        
+        # Download from the info dict the caller already extracted, with the formats
+        # restricted to our local selection so that yt-dlp's default format choice
+        # cannot fail and nothing is extracted a second time
+        info = dict(info)
+        if info.get("formats"):
+            info["formats"] = _select_download_formats(info)
+        overrides: Dict[str, Any] = {"outtmpl": {"default": self._downloads.output_template(key)}}
+        if progressive:
+            overrides.update(nopart=True, fixup="never")
+        try:
+            with self._ydl_pool.acquire("download", **overrides) as ydl:
+                result = ydl.process_ie_result(info, download=True)
+                # yt-dlp reports where it wrote the file; no directory scan needed
+                downloads = result.get("requested_downloads") or [result]
+                file_path = downloads[-1].get("filepath") or ydl.prepare_filename(result)
+        except Exception:
+            self._mark_download_failed(key)
+            raise
         
-        output_path = temp_dir / filename_template
+        path = Path(file_path)
+        if not path.exists():
+            raise RuntimeError(f"Downloaded file not found: {path}")
+        LOGGER.info("Downloaded file: %s (size: %d bytes)", path, path.stat().st_size)
+        return str(path)
+
+    def _download_cached(self, info: Dict[str, Any], url: str, started: float) -> ResolvedMedia:
+        """Return the cached download for `info`, downloading it first if needed"""
+        key = DownloadCache.key_for(info)
+        entry = self._downloads.lookup(key)
+        if entry is not None:
+            LOGGER.info("Download cache hit for %s", key)
+            return ResolvedMedia(
+                playback_url="",
+                title=info.get("title"),
+                file_path=str(self._downloads.path_for(entry)),
+            )
         
-        LOGGER.info("Downloading video to temporary file: %s", output_path)
+        # Another URL spelling of the same video may be downloading it already
+        with self._active_lock:
+            done = self._active_downloads.get(key)
+            growing = self._progressive_downloads.get(key)
+            if done is None:
+                done = self._active_downloads[key] = Future()
+                self._downloads.begin(key)
+                self._download_sources[key] = url
+                if self._progressive_prefix_bytes > 0:
+                    growing = self._progressive_downloads[key] = GrowingFile()
+                joining = False
+            else:
+                joining = True
         
-        # Track files before download
-        files_before = set(temp_dir.glob("*"))
+        if joining:
+            if growing is not None:
+                LOGGER.info("Joining in-progress download of %s", key)
+                return self._progressive_result(growing, info, started)
+            LOGGER.info("Waiting for in-progress download of %s", key)
+            return ResolvedMedia(playback_url="", title=info.get("title"), file_path=done.result())
         
-        # Try to exclude AV1 format first, but fallback to auto-select if format is not available
-        # This is important for sites like niconico that may not support format specifications
-        ydl_opts_with_format = {
-            "quiet": True,
-            "outtmpl": str(output_path),
-            # Exclude AV1 format: -vcodec:av01 means exclude video codec av01
-            "format": "best[vcodec!=av01][vcodec!^=av01]"
-        }
+        if growing is not None:
+            return self._download_progressively(info, url, started, growing, done)
         
         try:
-            with YoutubeDL(ydl_opts_with_format) as ydl:
-                ydl.download([url])
-        except DownloadError as e:
-            # If format specification fails, fallback to auto-select (original behavior)
-            # This handles cases where the format filter is not supported or no matching format exists
-            if "Requested format is not available" in str(e) or "format is not available" in str(e).lower():
-                LOGGER.warning("Format specification failed, falling back to auto-select: %s", e)
-                ydl_opts_auto = {
-                    "quiet": True,
-                    "outtmpl": str(output_path),
-                    # Don't specify format - let yt-dlp choose the best available format
-                    # This is more reliable for sites like niconico
-                }
-                with YoutubeDL(ydl_opts_auto) as ydl:
-                    ydl.download([url])
-            else:
-                # Re-raise if it's a different error
-                raise
+            file_path = self._download_to_temp_file(info)
+            self._downloads.add(key, Path(file_path), info.get("title"), url)
+            self._register_stored(file_path)
+        except BaseException as e:
+            done.set_exception(e)
+            raise
+        finally:
+            self._end_download(key)
+        done.set_result(file_path)
         
-        # Find the newly created file
-        files_after = set(temp_dir.glob("*"))
-        new_files = files_after - files_before
+        finished = time.monotonic()
+        LOGGER.info("Download of %s finished in %.2fs", key, finished - started)
+        return ResolvedMedia(playback_url="", title=info.get("title"), file_path=file_path)
+
+    def _download_progressively(
+        self,
+        info: Dict[str, Any],
+        url: str,
+        started: float,
+        growing: GrowingFile,
+        done: Future,
+    ) -> ResolvedMedia:
+        """Start downloading in the background and return once a playable prefix is on disk"""
+        key = DownloadCache.key_for(info)
         
-        LOGGER.debug("Files before download: %d, after: %d, new: %d", 
-                    len(files_before), len(files_after), len(new_files))
+        def _worker() -> None:
+            try:
+                file_path = self._download_to_temp_file(info, progressive=True)
+                self._downloads.add(key, Path(file_path), info.get("title"), url)
+                self._register_stored(file_path)
+            except Exception as e:
+                LOGGER.error("Progressive download failed: %s", e)
+                growing.fail(e)
+                done.set_exception(e)
+                return
+            finally:
+                self._end_download(key)
+            growing.finish(file_path)
+            done.set_result(file_path)
+            LOGGER.info("Progressive download finished: %s (total %.2fs)", file_path, time.monotonic() - started)
         
-        if new_files:
-            # Get the most recently modified file (should be the downloaded one)
-            downloaded_file = max(new_files, key=lambda p: p.stat().st_mtime)
-            LOGGER.info("Downloaded file found: %s (size: %d bytes)", downloaded_file, downloaded_file.stat().st_size)
-            return str(downloaded_file)
+        threading.Thread(target=_worker, name="mtxcast-download", daemon=True).start()
+        return self._progressive_result(growing, info, started)
+
+    def _end_download(self, key: str) -> None:
+        with self._active_lock:
+            self._active_downloads.pop(key, None)
+            self._progressive_downloads.pop(key, None)
+            self._download_sources.pop(key, None)
+        self._downloads.end(key)
+
+    def _progressive_result(self, growing: GrowingFile, info: Dict[str, Any], started: float) -> ResolvedMedia:
+        growing.wait_for(self._progressive_prefix_bytes)
+        if growing.error is not None:
+            raise growing.error
         
-        # Fallback: try to find file matching the template pattern
-        base_name = output_path.stem.split("%")[0] if "%" in output_path.name else output_path.stem
-        for ext in [".mp4", ".webm", ".mkv", ".m4a", ".mp3", ".flv"]:
-            candidate = temp_dir / f"{base_name}{ext}"
-            if candidate.exists():
-                LOGGER.info("Downloaded file (found by pattern): %s", candidate)
-                return str(candidate)
+        if growing.complete:
+            # Short video: the whole file arrived before the prefix threshold
+            return ResolvedMedia(playback_url="", title=info.get("title"), file_path=str(growing.path))
         
-        raise RuntimeError(f"Downloaded file not found in {temp_dir}")
+        suffix = growing.path.suffix if growing.path else ""
+        playback_url = self._media_server.register(growing, suffix)
+        LOGGER.info(
+            "Starting progressive playback after %d bytes (%.2fs): %s",
+            growing.size(),
+            time.monotonic() - started,
+            playback_url,
+        )
+        return ResolvedMedia(
+            playback_url=playback_url,
+            title=info.get("title"),
+            progressive=True,
+            local_path=str(growing.path),
+        )
 
-    async def resolve(self, payload: MetadataPayload) -> ResolvedMedia:
-        def _run() -> ResolvedMedia:
-            url = str(payload.source_url)
-            is_niconico = self._is_niconico(url)
-            
-            # For niconico, download to temporary file to avoid 403 errors
-            if is_niconico:
-                LOGGER.info("Detected niconico URL, downloading to temporary file")
-                try:
-                    # First extract info to get title
-                    with YoutubeDL({"quiet": True}) as ydl:
-                        info = ydl.extract_info(url, download=False)
-                    
-                    title = payload.title or info.get("title")
-                    
-                    # Download to temporary file
-                    file_path = self._download_to_temp_file(url, title)
-                    
-                    LOGGER.info("Niconico video downloaded successfully: %s", file_path)
-                    
+    def _register_stored(self, file_path: str) -> None:
+        if self._storage is not None:
+            self._storage.add(file_path)
+
+    def _resolve_sync(self, url: str) -> ResolvedMedia:
+        """Blocking extraction (and download, where required) of `url`"""
+        is_niconico = self._is_niconico(url)
+        
+        # For niconico, download to temporary file to avoid 403 errors
+        if is_niconico:
+            LOGGER.info("Detected niconico URL, downloading to temporary file")
+            try:
+                # A video downloaded before is played straight from the cache
+                entry = self._downloads.lookup_url(url)
+                if entry is not None:
+                    LOGGER.info("Download cache hit for %s", url)
                     return ResolvedMedia(
-                        playback_url="",  # Not used when file_path is set
-                        title=title,
-                        start_time=payload.start_time or 0.0,
-                        video_url=None,
-                        audio_url=None,
-                        file_path=file_path,
+                        playback_url="",
+                        title=entry.title,
+                        file_path=str(self._downloads.path_for(entry)),
                     )
-                except Exception as e:
-                    LOGGER.error("Failed to download niconico video: %s", e)
-                    raise RuntimeError(f"Failed to download niconico video: {e}")
-            
-            # Let yt-dlp automatically select the best format
-            # If it selects separated streams (bestvideo+bestaudio), we'll handle them separately
-            # Exclude AV1 format (av01 codec) as it may not be supported
-            try:
-                ydl_opts = {
-                    "quiet": True,
-                    # Exclude AV1 format: -vcodec:av01 means exclude video codec av01
-                    "format": "bestvideo[vcodec!=av01][vcodec!^=av01]+bestaudio/best[vcodec!=av01][vcodec!^=av01]"
-                }
-                try:
-                    with YoutubeDL(ydl_opts) as ydl:
-                        info = ydl.extract_info(url, download=False)
-                except DownloadError as e:
-                    # If format specification fails, fallback to auto-select and filter AV1 manually
-                    if "Requested format is not available" in str(e) or "format is not available" in str(e).lower():
-                        LOGGER.warning("Format specification failed, falling back to auto-select: %s", e)
-                        ydl_opts_auto = {"quiet": True}
-                        with YoutubeDL(ydl_opts_auto) as ydl:
-                            info = ydl.extract_info(url, download=False)
-                    else:
-                        # Re-raise if it's a different error
-                        raise
-                
-                # Log extracted info for debugging
-                LOGGER.debug("Extractor: %s", info.get("extractor") if info else None)
-                LOGGER.debug("Format: %s", info.get("format") if info else None)
-                LOGGER.debug("Format ID: %s", info.get("format_id") if info else None)
-                
-                # Check if we have separated streams (requested_formats)
-                requested_formats = info.get("requested_formats", [])
-                if requested_formats and len(requested_formats) >= 2:
-                    # We have separated streams (video + audio)
-                    LOGGER.info("Detected separated streams (video + audio)")
-                    
-                    video_format = None
-                    audio_format = None
-                    video_url = None
-                    audio_url = None
-                    
-                    for fmt in requested_formats:
-                        fmt_url = fmt.get("url") or fmt.get("manifest_url") or fmt.get("fragment_base_url")
-                        if not fmt_url:
-                            continue
-                        
-                        # Exclude AV1 format
-                        vcodec = fmt.get("vcodec", "")
-                        if vcodec and (vcodec.startswith("av01") or "av01" in vcodec.lower()):
-                            LOGGER.debug("Skipping AV1 format: %s", fmt.get("format_id"))
-                            continue
-                        
-                        has_video = fmt.get("vcodec") != "none"
-                        has_audio = fmt.get("acodec") != "none"
-                        
-                        if has_video and not has_audio:
-                            video_format = fmt
-                            video_url = fmt_url
-                        elif has_audio and not has_video:
-                            audio_format = fmt
-                            audio_url = fmt_url
-                    
-                    if video_format and audio_format and video_url and audio_url:
-                        LOGGER.info("Using separated streams - Video: %s, Audio: %s", 
-                                   video_format.get("format_id"), audio_format.get("format_id"))
-                        title = payload.title or info.get("title")
-                        return ResolvedMedia(
-                            playback_url="",  # Not used for separated streams
-                            title=title,
-                            start_time=payload.start_time or 0.0,
-                            video_url=video_url,
-                            audio_url=audio_url,
-                            file_path=None,
-                            video_file_path=None,
-                            audio_file_path=None,
-                        )
-                    else:
-                        LOGGER.warning("Could not find both video and audio in separated streams")
-                
-                # Single stream (video + audio combined) or fallback
-                playback_url = (
-                    info.get("url") or 
-                    info.get("manifest_url") or 
-                    info.get("fragment_base_url")
-                )
-                
-                if not playback_url:
-                    # Try to get URL from formats list if available
-                    formats = info.get("formats", [])
-                    if formats:
-                        LOGGER.info("No direct URL, trying to find from formats list")
-                        for fmt in formats:
-                            # Exclude AV1 format
-                            vcodec = fmt.get("vcodec", "")
-                            if vcodec and (vcodec.startswith("av01") or "av01" in vcodec.lower()):
-                                LOGGER.debug("Skipping AV1 format: %s", fmt.get("format_id"))
-                                continue
-                            
-                            fmt_url = fmt.get("url") or fmt.get("manifest_url") or fmt.get("fragment_base_url")
-                            if fmt_url:
-                                playback_url = fmt_url
-                                LOGGER.info("Found URL in format %s", fmt.get("format_id"))
-                                break
                 
-                if not playback_url:
-                    LOGGER.error("No playback URL found. Available fields: %s", list(info.keys()) if info else None)
-                    raise RuntimeError("No playable format found with direct URL")
+                # Extract once; the same info dict drives the download
+                started = time.monotonic()
+                with span("yt_dlp.extract"), self._ydl_pool.acquire("extract") as ydl:
+                    info = _extract_unprocessed(ydl, url)
+                LOGGER.info("Niconico extraction took %.2fs", time.monotonic() - started)
                 
-                LOGGER.info("Using single stream URL: %s", playback_url[:100] if playback_url else None)
-                title = payload.title or info.get("title")
-                return ResolvedMedia(
-                    playback_url=playback_url,
-                    title=title,
-                    start_time=payload.start_time or 0.0,
-                    video_url=None,
-                    audio_url=None,
-                    file_path=None,
-                    video_file_path=None,
-                    audio_file_path=None,
-                )
-            except DownloadError as e:
-                LOGGER.error("Failed to extract video info: %s", e)
-                raise RuntimeError(f"Failed to extract video info: {e}")
+                with span("download", progressive=self._progressive_prefix_bytes > 0):
+                    return self._download_cached(info, url, started)
             except Exception as e:
-                LOGGER.error("Unexpected error during extraction: %s", e)
-                raise RuntimeError(f"Unexpected error during extraction: {e}")
+                LOGGER.error("Failed to download niconico video: %s", e)
+                raise RuntimeError(f"Failed to download niconico video: {e}")
+        
+        with span("yt_dlp.extract"), self._ydl_pool.acquire("extract") as ydl:
+            return _resolve_stream(ydl, url)
+
+    def _cache_key(self, url: str) -> CacheKey:
+        fmt = _DOWNLOAD_FORMAT if self._is_niconico(url) else _STREAM_FORMAT
+        return ResolutionCache.make_key(url, fmt)
+
+    async def _resolve_shared(self, key: CacheKey, url: str) -> ResolvedMedia:
+        """Resolve `url`, joining an identical resolution that is already running"""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._resolve_uncached(key, url))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._on_resolution_done(key, t))
+        else:
+            LOGGER.info("Joining in-flight resolution of %s", url)
+            current_span().event("joined_resolution")
+        self._inflight_waiters[task] = self._inflight_waiters.get(task, 0) + 1
+        try:
+            # Shielded so one waiter giving up does not abort the others
+            return await asyncio.shield(task)
+        finally:
+            remaining = self._inflight_waiters.pop(task) - 1
+            if remaining:
+                self._inflight_waiters[task] = remaining
+            elif not task.done():
+                # Nobody wants the result any more (e.g. the cast was superseded):
+                # abort the extraction instead of letting it run to completion
+                LOGGER.info("Abandoning resolution of %s", url)
+                task.cancel()
+
+    def _on_resolution_done(self, key: CacheKey, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # retrieved here so an unawaited failure is not reported twice
+
+    @traced("MetadataResolver.resolve_uncached")
+    async def _resolve_uncached(self, key: CacheKey, url: str) -> ResolvedMedia:
+        started = time.monotonic()
+        resolved = await self._run_resolve(url)
+        elapsed = time.monotonic() - started
+        extractor = resolved.extractor or ("Niconico" if self._is_niconico(url) else "unknown")
+        current_span().set(extractor=extractor)
+        RESOLVE_SECONDS.labels(extractor).observe(elapsed)
+        LOGGER.info("Resolved %s in %.2fs", url, elapsed)
+        # Progressive results point at a download in progress; once it finishes,
+        # repeats are served by the download cache instead
+        if not resolved.progressive:
+            self._cache.put(key, resolved)
+        return resolved
+
+    async def _run_resolve(self, url: str) -> ResolvedMedia:
+        if self._extract_pool is None or self._is_niconico(url):
+            # Cancelling only abandons thread work; it runs to completion in the background
+            return await asyncio.to_thread(self._resolve_sync, url)
+        # Cancelling this terminates the worker process, aborting the extraction
+        try:
+            with span("yt_dlp.extract", worker="process"):
+                return await self._extract_pool.run(_resolve_stream_in_worker, url)
+        except BrokenProcessPool:
+            # The pool restarts on the next call; do not fail this cast because of it
+            LOGGER.warning("Extraction pool unavailable, resolving %s in a thread", url)
+            return await asyncio.to_thread(self._resolve_sync, url)
+
+    def prefetch(self, payload: MetadataPayload) -> str:
+        """Resolve and cache `payload` in the background; returns what was done"""
+        url = str(payload.source_url)
+        if self._is_niconico(url):
+            # Prefetching would start a download competing with interactive casts
+            return "skipped"
+        key = self._cache_key(url)
+        if self._cache.contains(key):
+            return "cached"
+        if key in self._inflight or key in self._prefetch_pending:
+            return "in_progress"
+        if len(self._prefetch_pending) >= self._max_pending_prefetches:
+            return "busy"
+        self._prefetch_pending.add(key)
+        task = asyncio.create_task(self._run_prefetch(key, url))
+        self._prefetch_tasks.add(task)
+        task.add_done_callback(self._prefetch_tasks.discard)
+        return "queued"
+
+    async def _run_prefetch(self, key: CacheKey, url: str) -> None:
+        try:
+            # Prefetches only limit each other; interactive resolves never wait here
+            async with self._prefetch_semaphore:
+                if self._cache.contains(key):
+                    return
+                await self._resolve_shared(key, url)
+                LOGGER.info("Prefetched %s", url)
+        except Exception as e:
+            LOGGER.warning("Prefetch of %s failed: %s", url, e)
+        finally:
+            self._prefetch_pending.discard(key)
+
+    @traced("MetadataResolver.resolve")
+    async def resolve(self, payload: MetadataPayload, refresh: bool = False) -> ResolvedMedia:
+        """Resolve `payload`; `refresh` bypasses the cache, e.g. to renew signed URLs"""
+        url = str(payload.source_url)
+        key = self._cache_key(url)
+
+        resolved = None if refresh else self._cache.get(key)
+        if resolved is not None:
+            LOGGER.info("Resolution cache hit for %s", url)
+            RESOLVE_REQUESTS.labels("hit").inc()
+            current_span().set(cache="hit", extractor=resolved.extractor)
+        else:
+            RESOLVE_REQUESTS.labels("refresh" if refresh else "miss").inc()
+            current_span().set(cache="refresh" if refresh else "miss")
+            resolved = await self._resolve_shared(key, url)
 
-        return await asyncio.to_thread(_run)
+        # Cached entries are shared between casts; apply per-request fields on a copy
+        return replace(
+            resolved,
+            title=payload.title or resolved.title,
+            start_time=payload.start_time or 0.0,
+            source_url=url,
+        )
 
 
 
@@ -0,0 +1,224 @@
+"""Server-side play queue that resolves upcoming items before they are needed."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set
+
+from pydantic import BaseModel
+
+from .metadata import MetadataPayload, MetadataResolver, ResolvedMedia
+from .resolution_cache import media_expiry
+from .stream_manager import PlayerStatus, StreamManager, StreamType
+
+LOGGER = logging.getLogger(__name__)
+
+
+class QueueReorderPayload(BaseModel):
+    item_ids: List[str]  # moved to the front in this order; unlisted items keep their order
+
+
+@dataclass
+class QueueItem:
+    item_id: str
+    payload: MetadataPayload
+    added_at: float
+    resolved: ResolvedMedia | None = None
+    expires_at: float | None = None  # epoch seconds; None if the media does not expire
+    error: str | None = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.item_id,
+            "source_url": str(self.payload.source_url),
+            "title": self.payload.title or (self.resolved.title if self.resolved else None),
+            "start_time": self.payload.start_time or 0.0,
+            "added_at": self.added_at,
+            "resolved": self.resolved is not None,
+            "expires_at": self.expires_at,
+            "error": self.error,
+        }
+
+
+class PlayQueue:
+    """Items to play once the current media ends.
+
+    A background task keeps the first `lookahead` items resolved and resolves
+    them again shortly before their signed URLs expire, so advancing to the
+    next item only has to wait for the player to buffer.
+    """
+
+    def __init__(
+        self,
+        manager: StreamManager,
+        resolver: MetadataResolver,
+        lookahead: int = 2,
+        refresh_margin: float = 120.0,
+        check_interval: float = 30.0,
+    ) -> None:
+        self._manager = manager
+        self._resolver = resolver
+        self._lookahead = lookahead
+        self._refresh_margin = refresh_margin  # seconds before expiry that an item is resolved again
+        self._check_interval = check_interval
+        self._items: List[QueueItem] = []
+        self._current: QueueItem | None = None
+        self._changed = asyncio.Event()
+        self._advance_lock = asyncio.Lock()
+        self._worker: asyncio.Task | None = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    def start(self) -> None:
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._maintain())
+
+    async def close(self) -> None:
+        tasks = [t for t in (self._worker, *self._tasks) if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._worker = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "current": self._current.to_dict() if self._current else None,
+            "items": [item.to_dict() for item in self._items],
+        }
+
+    def enqueue(self, payload: MetadataPayload) -> QueueItem:
+        item = QueueItem(item_id=uuid.uuid4().hex[:12], payload=payload, added_at=time.time())
+        self._items.append(item)
+        self._changed.set()
+        LOGGER.info("Queued %s (%d items)", payload.source_url, len(self._items))
+        # Nothing to wait for: start right away instead of after the next EndOfMedia
+        if self._player_free():
+            self._spawn(self.advance(automatic=True))
+        return item
+
+    def remove(self, item_id: str) -> None:
+        item = self._find(item_id)
+        self._items.remove(item)
+        self._discard(item.resolved)
+        self._changed.set()
+
+    def reorder(self, item_ids: List[str]) -> None:
+        front = [self._find(item_id) for item_id in item_ids]
+        if len({item.item_id for item in front}) != len(front):
+            raise ValueError("Duplicate item IDs")
+        self._items = front + [item for item in self._items if item not in front]
+        self._changed.set()
+
+    def clear(self) -> None:
+        for item in self._items:
+            self._discard(item.resolved)
+        self._items.clear()
+        self._changed.set()
+
+    async def skip(self) -> PlayerStatus:
+        """Play the next item now, or stop if the queue is empty"""
+        status = await self.advance()
+        if status is None:
+            self._current = None
+            status = await self._manager.stop()
+        return status
+
+    async def on_playback_finished(self) -> None:
+        await self._manager.on_playback_finished()
+        self._current = None
+        if self._items:
+            await self.advance(automatic=True)
+
+    async def advance(self, automatic: bool = False) -> Optional[PlayerStatus]:
+        """Play the first item that can be played; None if the queue ran out.
+
+        An `automatic` advance (into an idle player) gives way to an
+        interactive cast: it does nothing while one is in flight, and puts
+        the item back if one started while the item was being resolved.
+        """
+        async with self._advance_lock:
+            while self._items:
+                if automatic and not self._player_free():
+                    LOGGER.info("Not advancing the queue: the player is busy with a cast")
+                    return None
+                item = self._items.pop(0)
+                self._changed.set()
+                try:
+                    if self._needs_resolve(item):
+                        await self._resolve(item)
+                    if automatic and not self._player_free():
+                        LOGGER.info("Not playing %s: a cast started while it resolved", item.payload.source_url)
+                        self._items.insert(0, item)
+                        return None
+                    started = time.monotonic()
+                    status = await self._manager.play_resolved(item.resolved)
+                except Exception as e:
+                    LOGGER.error("Failed to play queued item %s: %s", item.payload.source_url, e, exc_info=True)
+                    continue
+                LOGGER.info("Advanced to %s in %.2fs", item.payload.source_url, time.monotonic() - started)
+                self._current = item
+                return status
+            return None
+
+    def _player_free(self) -> bool:
+        """Nothing is playing and no cast is on its way to the screen"""
+        return self._manager.status.stream_type == StreamType.IDLE and not self._manager.cast_in_flight
+
+    async def _maintain(self) -> None:
+        while True:
+            self._changed.clear()
+            for item in self._items[: self._lookahead]:
+                if item not in self._items or not self._needs_resolve(item):
+                    continue
+                try:
+                    await self._resolve(item)
+                except Exception as e:
+                    LOGGER.warning("Pre-resolving queued item %s failed: %s", item.payload.source_url, e)
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=self._check_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def _needs_resolve(self, item: QueueItem) -> bool:
+        resolved = item.resolved
+        if resolved is None:
+            return True
+        if item.expires_at is not None and item.expires_at - time.time() < self._refresh_margin:
+            return True
+        # Downloads can be evicted from the cache while they wait in the queue
+        paths = (resolved.file_path, resolved.video_file_path, resolved.audio_file_path)
+        return not all(Path(p).exists() for p in paths if p)
+
+    async def _resolve(self, item: QueueItem) -> None:
+        started = time.monotonic()
+        try:
+            # A stale result is likely still cached, so renewals bypass the cache
+            resolved = await self._resolver.resolve(item.payload, refresh=item.resolved is not None)
+        except Exception as e:
+            item.error = str(e)
+            raise
+        self._discard(item.resolved)
+        item.resolved = resolved
+        item.expires_at = media_expiry(resolved)
+        item.error = None
+        LOGGER.info("Resolved queued item %s in %.2fs", item.payload.source_url, time.monotonic() - started)
+
+    def _discard(self, resolved: ResolvedMedia | None) -> None:
+        """Release a result that will not be played"""
+        if resolved is not None:
+            self._resolver.release(resolved)
+
+    def _find(self, item_id: str) -> QueueItem:
+        for item in self._items:
+            if item.item_id == item_id:
+                return item
+        raise KeyError(item_id)
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
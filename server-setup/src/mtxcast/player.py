@@ -4,6 +4,7 @@ import asyncio
 import logging
 import platform
 import subprocess
+import time
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Callable, Optional
@@ -16,7 +17,35 @@ from PySide6.QtMultimedia import QAudioOutput, QMediaPlayer
 from PySide6.QtMultimediaWidgets import QVideoWidget
 
 from .config import ServerConfig, save_config
+from .metrics import Counter, Histogram
 from .stream_manager import PlaybackMetrics, PlayerTransport
+from .tracing import NOOP_SPAN, current_span, span, traced
+
+BUFFERING_SECONDS = Histogram(
+    "mtxcast_player_buffering_seconds",
+    "Time play_url waited for QMediaPlayer to load or buffer the media",
+    ["mode", "outcome"],  # mode: single/separated; outcome: buffered/timeout
+)
+FIRST_FRAME_SECONDS = Histogram(
+    "mtxcast_player_time_to_first_frame_seconds",
+    "Time from starting playback until the position advances (or the first WHIP frame is shown)",
+    ["mode"],  # single, separated or whip
+)
+PLAYER_ERRORS = Counter("mtxcast_player_errors_total", "QMediaPlayer errors", ["player"])  # video or audio
+PLAYER_RETRIES = Counter("mtxcast_player_retries_total", "Playback retries after an error", ["player"])
+WHIP_FRAMES = Counter(
+    "mtxcast_whip_frames_total",
+    "WHIP video frames by stage: received, converted, rendered or dropped",
+    ["stage"],
+)
+# Resolved once so the per-frame cost is a single locked increment
+_FRAMES_RECEIVED = WHIP_FRAMES.labels("received")
+_FRAMES_CONVERTED = WHIP_FRAMES.labels("converted")
+_FRAMES_RENDERED = WHIP_FRAMES.labels("rendered")
+_FRAMES_DROPPED = WHIP_FRAMES.labels("dropped")
+
+# A seek counts as done once playback advances this far past its target (seconds)
+SEEK_ADVANCE_WINDOW = (0.1, 2.0)
 
 LOGGER = logging.getLogger(__name__)
 
@@ -136,6 +165,7 @@ class DisplayPowerManager:
 
 class VideoCanvas(QtWidgets.QLabel):
     frame_ready = QtCore.Signal(QtGui.QImage)
+    first_frame_shown = QtCore.Signal(float)  # seconds since the WHIP session attached
 
     def __init__(self) -> None:
         super().__init__()
@@ -143,10 +173,21 @@ class VideoCanvas(QtWidgets.QLabel):
         self.setText("Waiting for video...")
         self.setStyleSheet("background-color: black; color: white; font-size: 18px;")
         self.frame_ready.connect(self._on_frame_ready)
+        self._first_frame_started: float | None = None  # monotonic time the WHIP session attached
+
+    def expect_first_frame(self) -> None:
+        """Start timing until the next rendered frame"""
+        self._first_frame_started = time.monotonic()
 
     def _on_frame_ready(self, image: QtGui.QImage) -> None:
         pixmap = QtGui.QPixmap.fromImage(image)
         self.setPixmap(pixmap.scaled(self.size(), QtCore.Qt.AspectRatioMode.KeepAspectRatio, QtCore.Qt.TransformationMode.SmoothTransformation))
+        _FRAMES_RENDERED.inc()
+        if self._first_frame_started is not None:
+            elapsed = time.monotonic() - self._first_frame_started
+            FIRST_FRAME_SECONDS.labels("whip").observe(elapsed)
+            self._first_frame_started = None
+            self.first_frame_shown.emit(elapsed)
 
     def render_frame(self, image: QtGui.QImage) -> None:
         """Thread-safe method to render frame"""
@@ -508,6 +549,7 @@ class WebRTCSession:
         await self.stop()
         self._pc = pc
         self._running = True
+        self._canvas.expect_first_frame()
         self._task = asyncio.create_task(self._reader(track))
 
     async def stop(self) -> None:
@@ -533,20 +575,24 @@ class WebRTCSession:
                 try:
                     frame: VideoFrame = await track.recv()
                     frame_count += 1
+                    _FRAMES_RECEIVED.inc()
                     if frame_count % 30 == 0:  # Log every 30 frames
                         logger.debug("Received %d frames", frame_count)
                     
                     image = self._frame_to_qimage(frame)
                     if image and not image.isNull():
+                        _FRAMES_CONVERTED.inc()
                         # Emit signal to render on Qt main thread
                         self._canvas.render_frame(image)
                     else:
+                        _FRAMES_DROPPED.inc()
                         logger.warning("Failed to convert frame to QImage")
                 except MediaStreamError:
                     # Stream ended normally
                     logger.info("WebRTC stream ended (MediaStreamError)")
                     break
                 except Exception as e:
+                    _FRAMES_DROPPED.inc()
                     logger.error("Error processing frame: %s", e, exc_info=True)
                     await asyncio.sleep(0.1)  # Prevent tight loop on errors
         except asyncio.CancelledError:
@@ -594,6 +640,10 @@ class WebRTCSession:
 
 
 class PlayerBackend(QtCore.QObject):
+    playback_finished = QtCore.Signal()  # media played to the end and the player stopped
+    metrics_changed = QtCore.Signal(object)  # PlaybackMetrics, on position/duration changes
+    qoe_event = QtCore.Signal(str, object)  # (kind, value) for the session's QoE report; see QoeRecorder
+
     def __init__(self, window: PlayerWindow) -> None:
         super().__init__(window)
         self._window = window
@@ -607,6 +657,7 @@ class PlayerBackend(QtCore.QObject):
         self._audio_output: QAudioOutput | None = None
         
         self._webrtc_session = WebRTCSession(window.canvas())
+        window.canvas().first_frame_shown.connect(lambda elapsed: self.qoe_event.emit("first_frame", elapsed))
         self._display_power = DisplayPowerManager()
         self._volume = 0.8
         self._audio.setVolume(self._volume)
@@ -628,6 +679,11 @@ class PlayerBackend(QtCore.QObject):
         self._seek_applied: bool = False
         self._is_stopping: bool = False
         self._using_separated_streams: bool = False
+        self._play_started_at: float | None = None  # monotonic, until the first advancing position
+        self._trace_span = NOOP_SPAN  # play_url span of the traced cast; Qt callbacks add to it
+        self._first_position_span = None
+        self._seek_started: float | None = None  # monotonic time of the last user seek, until playback advances
+        self._seek_target = 0.0
 
         self._retry_timer = QtCore.QTimer(self)
         self._retry_timer.setSingleShot(True)
@@ -642,7 +698,11 @@ class PlayerBackend(QtCore.QObject):
         self._player.mediaStatusChanged.connect(self._on_media_status_changed)
         self._player.positionChanged.connect(self._on_position_changed)
         self._player.durationChanged.connect(self._on_duration_changed)
+        # Starting, pausing and stalling change whether the position advances
+        self._player.playbackStateChanged.connect(lambda _state: self._emit_metrics())
+        self._player.mediaStatusChanged.connect(lambda _status: self._emit_metrics())
 
+    @traced("PlayerBackend.play_url")
     async def play_url(self, url: str, start_time: float = 0.0, title: str | None = None) -> None:
         import logging
 
@@ -658,6 +718,8 @@ class PlayerBackend(QtCore.QObject):
         self._last_valid_position = None
         self._is_stopping = False
         self._using_separated_streams = False
+        self._play_started_at = time.monotonic()
+        self._begin_trace()
         
         # Re-enable audio output on video player (for single stream)
         if self._player.audioOutput() is None:
@@ -682,16 +744,24 @@ class PlayerBackend(QtCore.QObject):
         self._audio_retry_attempts = 0
         self._retry_timer.stop()
         self._audio_retry_timer.stop()
-        self._window.show_player(use_webrtc=False)
+        with span("show_player") as shown:
+            self._window.show_player(use_webrtc=False)
+            shown.set(fullscreen=self._window.isFullScreen())
         self._window.update_progress(start_time or 0.0, None, True)
         
         # Wait for media to be loaded/buffered before starting playback
+        buffering_started = time.monotonic()
+        buffering = self._trace_span.child("buffering")
         try:
             logger.info("Waiting for media buffering...")
             await asyncio.wait_for(self._buffering_event.wait(), timeout=self._buffering_timeout)
             logger.info("Media buffering completed, starting playback")
+            outcome = "buffered"
         except asyncio.TimeoutError:
             logger.warning("Media buffering timeout, starting playback anyway")
+            outcome = "timeout"
+        BUFFERING_SECONDS.labels("single", outcome).observe(time.monotonic() - buffering_started)
+        buffering.finish(outcome=outcome)
         
         # Turn on display and inhibit screen off when playback starts
         self._display_power.turn_on_display()
@@ -699,8 +769,10 @@ class PlayerBackend(QtCore.QObject):
         
         # Start playback after buffering
         self._player.play()
+        self._first_position_span = self._trace_span.child("first_position")
         # Seek will be applied in _on_media_status_changed when media is ready
 
+    @traced("PlayerBackend.play_separated_streams")
     async def play_separated_streams(
         self, 
         video_url: str, 
@@ -736,6 +808,8 @@ class PlayerBackend(QtCore.QObject):
         self._last_valid_position = None
         self._is_stopping = False
         self._using_separated_streams = True
+        self._play_started_at = time.monotonic()
+        self._begin_trace()
         
         # Set sources
         self._player.setSource(QtCore.QUrl(video_url))
@@ -760,16 +834,24 @@ class PlayerBackend(QtCore.QObject):
         self._audio_retry_attempts = 0
         self._retry_timer.stop()
         self._audio_retry_timer.stop()
-        self._window.show_player(use_webrtc=False)
+        with span("show_player") as shown:
+            self._window.show_player(use_webrtc=False)
+            shown.set(fullscreen=self._window.isFullScreen())
         self._window.update_progress(start_time or 0.0, None, True)
         
         # Wait for both streams to be loaded/buffered
+        buffering_started = time.monotonic()
+        buffering = self._trace_span.child("buffering")
         try:
             logger.info("Waiting for separated streams buffering...")
             await asyncio.wait_for(self._buffering_event.wait(), timeout=self._buffering_timeout)
             logger.info("Separated streams buffering completed, starting playback")
+            outcome = "buffered"
         except asyncio.TimeoutError:
             logger.warning("Separated streams buffering timeout, starting playback anyway")
+            outcome = "timeout"
+        BUFFERING_SECONDS.labels("separated", outcome).observe(time.monotonic() - buffering_started)
+        buffering.finish(outcome=outcome)
         
         # Turn on display and inhibit screen off when playback starts
         self._display_power.turn_on_display()
@@ -778,6 +860,7 @@ class PlayerBackend(QtCore.QObject):
         # Start both players simultaneously
         self._player.play()
         self._audio_player.play()
+        self._first_position_span = self._trace_span.child("first_position")
         
         # Seek will be applied in _on_media_status_changed when media is ready
 
@@ -787,6 +870,7 @@ class PlayerBackend(QtCore.QObject):
         if error == QMediaPlayer.Error.NoError:  # type: ignore[attr-defined]
             return
         logger.error("Audio QMediaPlayer error (%s): %s", error, error_string)
+        PLAYER_ERRORS.labels("audio").inc()
         
         # Signal buffering event to prevent indefinite waiting
         if self._buffering_event and not self._buffering_event.is_set():
@@ -871,6 +955,8 @@ class PlayerBackend(QtCore.QObject):
         await self._webrtc_session.attach(track, pc)
         logger.info("PlayerBackend: Switching to WebRTC canvas")
         self._mode = "whip"
+        self._play_started_at = None
+        self._end_trace()
         self._current_source_url = None
         self._current_video_url = None
         self._current_audio_url = None
@@ -909,6 +995,8 @@ class PlayerBackend(QtCore.QObject):
             position = self._current_duration
         
         logger.info("Seeking to position: %.2f seconds", position)
+        self._seek_started = time.monotonic()
+        self._seek_target = position
         self._is_seeking = True
         self._last_valid_position = position
         self._player.setPosition(int(position * 1000))
@@ -953,6 +1041,10 @@ class PlayerBackend(QtCore.QObject):
         self._last_valid_position = None
         self._is_stopping = False
         self._using_separated_streams = False
+        self._play_started_at = None
+        self._seek_started = None
+        self._end_trace()
+        self.qoe_event.emit("exit", "stopped")
         self._window.on_playback_stopped()
 
     def _handle_player_error(self, error, error_string: str) -> None:
@@ -962,6 +1054,7 @@ class PlayerBackend(QtCore.QObject):
         if error == QMediaPlayer.Error.NoError:  # type: ignore[attr-defined]
             return
         logger.error("QMediaPlayer error (%s): %s", error, error_string)
+        PLAYER_ERRORS.labels("video").inc()
         # Signal buffering event to prevent indefinite waiting
         if self._buffering_event and not self._buffering_event.is_set():
             self._buffering_event.set()
@@ -980,6 +1073,7 @@ class PlayerBackend(QtCore.QObject):
                 self._retry_timer.start(delay_ms)
             else:
                 logger.error("Exceeded separated stream playback retry attempts")
+                self.qoe_event.emit("exit", "failed")
             return
         
         # For single stream playback
@@ -996,8 +1090,12 @@ class PlayerBackend(QtCore.QObject):
                 self._retry_timer.start(delay_ms)
             else:
                 logger.error("Exceeded metadata playback retry attempts")
+                self.qoe_event.emit("exit", "failed")
 
     def _on_media_status_changed(self, status: QMediaPlayer.MediaStatus) -> None:
+        if status in (QMediaPlayer.MediaStatus.LoadedMedia, QMediaPlayer.MediaStatus.BufferedMedia):
+            self._trace_span.event("media_status", status=status.name)
+        self.qoe_event.emit("media_status", status.name)
         # For separated streams, buffering completion is handled in _on_audio_media_status_changed
         if self._using_separated_streams:
             # Only apply seek when video player is ready (audio player will be handled separately)
@@ -1007,6 +1105,9 @@ class PlayerBackend(QtCore.QObject):
             ):
                 if not self._seek_applied:
                     self._apply_pending_seek()
+            elif status == QMediaPlayer.MediaStatus.EndOfMedia:
+                # The video stream decides when separated playback is over
+                self._on_end_of_media()
             return
         
         # For single stream
@@ -1027,14 +1128,22 @@ class PlayerBackend(QtCore.QObject):
             if not self._seek_applied:
                 self._apply_pending_seek()
         elif status == QMediaPlayer.MediaStatus.EndOfMedia:
-            # Auto-stop when playback reaches the end
-            if not self._is_stopping:
-                import logging
-                logger = logging.getLogger(__name__)
-                logger.info("Playback reached end of media, stopping")
-                self._is_stopping = True
-                loop = asyncio.get_event_loop()
-                loop.create_task(self.stop())
+            self._on_end_of_media()
+
+    def _on_end_of_media(self) -> None:
+        # Auto-stop when playback reaches the end
+        if not self._is_stopping:
+            import logging
+            logger = logging.getLogger(__name__)
+            logger.info("Playback reached end of media, stopping")
+            self._is_stopping = True
+            self.qoe_event.emit("exit", "ended")
+            loop = asyncio.get_event_loop()
+            loop.create_task(self._stop_at_end())
+
+    async def _stop_at_end(self) -> None:
+        await self.stop()
+        self.playback_finished.emit()
 
     def _retry_metadata_playback(self) -> None:
         if self._mode != "metadata" or not self._current_source_url:
@@ -1043,6 +1152,8 @@ class PlayerBackend(QtCore.QObject):
 
         logger = logging.getLogger(__name__)
         logger.info("Retrying metadata playback now")
+        PLAYER_RETRIES.labels("video").inc()
+        self.qoe_event.emit("retry", "video")
         self._retry_timer.stop()
         
         # Reset retry attempts when starting retry (will be incremented again if it fails)
@@ -1086,6 +1197,8 @@ class PlayerBackend(QtCore.QObject):
 
         logger = logging.getLogger(__name__)
         logger.info("Retrying audio playback now")
+        PLAYER_RETRIES.labels("audio").inc()
+        self.qoe_event.emit("retry", "audio")
         self._audio_retry_timer.stop()
         
         # Get current position from video player (they should be synchronized)
@@ -1133,12 +1246,14 @@ class PlayerBackend(QtCore.QObject):
             position_ms = int(self._pending_seek * 1000)
             target_position = self._pending_seek
             logger.info("Applying seek to position: %.2f seconds", target_position)
+            seek_span = self._trace_span.child("_apply_pending_seek", position=target_position)
             self._last_valid_position = target_position
             self._player.setPosition(position_ms)
             
             # Also seek audio player if using separated streams
             if self._using_separated_streams and self._audio_player:
                 self._audio_player.setPosition(position_ms)
+            seek_span.finish()
             
             self._pending_seek = None
             self._seek_applied = True
@@ -1147,8 +1262,16 @@ class PlayerBackend(QtCore.QObject):
             QtCore.QTimer.singleShot(1000, lambda: setattr(self, "_is_seeking", False))
 
     def _on_position_changed(self, position_ms: int) -> None:
+        if self._first_position_span is not None:
+            self._first_position_span.finish(position=position_ms / 1000)
+            self._first_position_span = None
         if self._mode == "metadata":
             position = position_ms / 1000 if position_ms >= 0 else 0.0
+            if self._seek_started is not None:
+                advanced = position - self._seek_target
+                if SEEK_ADVANCE_WINDOW[0] <= advanced <= SEEK_ADVANCE_WINDOW[1]:
+                    self.qoe_event.emit("seek", time.monotonic() - self._seek_started)
+                    self._seek_started = None
             
             # Ignore position changes that jump back to 0 unexpectedly
             # This can happen during media loading or buffering
@@ -1179,7 +1302,7 @@ class PlayerBackend(QtCore.QObject):
                 logger.info("Playback reached end (position: %.2f, duration: %.2f), stopping", position, self._current_duration)
                 self._is_stopping = True
                 loop = asyncio.get_event_loop()
-                loop.create_task(self.stop())
+                loop.create_task(self._stop_at_end())
                 return
             
             # Update last valid position if it's reasonable and not a reset
@@ -1187,6 +1310,7 @@ class PlayerBackend(QtCore.QObject):
                 self._last_valid_position = position
             
             self._window.update_progress(position, self._current_duration, True)
+            self._emit_metrics(position)
         else:
             self._window.update_progress(None, None, False)
 
@@ -1198,6 +1322,49 @@ class PlayerBackend(QtCore.QObject):
             if position >= 0 and (self._last_valid_position is None or abs(position - self._last_valid_position) < 5.0):
                 self._last_valid_position = position
             self._window.update_progress(position, self._current_duration, True)
+            self._emit_metrics(position)
+
+    def _begin_trace(self) -> None:
+        """Attach the player's asynchronous milestones to the current play span"""
+        self._end_trace()
+        self._trace_span = current_span()
+
+    def _end_trace(self) -> None:
+        if self._first_position_span is not None:
+            self._first_position_span.finish("cancelled")
+            self._first_position_span = None
+        self._trace_span = NOOP_SPAN
+
+    def _emit_metrics(self, position: float | None = None) -> None:
+        if self._mode != "metadata":
+            return
+        if position is None:
+            position = self._last_valid_position
+        if position is None:
+            position = max(0.0, self._player.position() / 1000)
+        is_advancing = (
+            self._player.playbackState() == QMediaPlayer.PlaybackState.PlayingState
+            and self._player.mediaStatus() in (
+                QMediaPlayer.MediaStatus.BufferedMedia,
+                QMediaPlayer.MediaStatus.LoadedMedia,
+            )
+        )
+        if is_advancing and self._play_started_at is not None:
+            mode = "separated" if self._using_separated_streams else "single"
+            elapsed = time.monotonic() - self._play_started_at
+            FIRST_FRAME_SECONDS.labels(mode).observe(elapsed)
+            self._play_started_at = None
+            self.qoe_event.emit("first_frame", elapsed)
+        self.metrics_changed.emit(
+            PlaybackMetrics(
+                position=position,
+                duration=self._current_duration,
+                is_seekable=True,
+                playback_rate=self._player.playbackRate(),
+                is_advancing=is_advancing,
+                sampled_at=time.monotonic(),
+            )
+        )
 
     async def get_metrics(self) -> PlaybackMetrics:
         if self._mode == "metadata":
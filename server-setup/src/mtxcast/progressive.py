@@ -0,0 +1,270 @@
+"""Loopback HTTP server that lets QMediaPlayer play files while they are still being written."""
+
+from __future__ import annotations
+
+import logging
+import mimetypes
+import re
+import threading
+import time
+import uuid
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import BinaryIO, Dict, Optional, Tuple
+
+LOGGER = logging.getLogger(__name__)
+
+_CHUNK_SIZE = 256 * 1024
+_RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)")
+
+
+class GrowingFile:
+    """A file that a writer is still appending to.
+
+    The writer updates the path and calls notify() as data lands on disk, then
+    finish() or fail(). Readers block in wait_for() until enough bytes exist.
+    The on-disk size is the source of truth, so writers that report progress
+    before data is appended (e.g. fragment downloads) cannot make readers run
+    ahead of the file.
+    """
+
+    def __init__(self, path: str | Path | None = None, expected_size: int | None = None) -> None:
+        self._path = Path(path) if path else None
+        self._expected_size = expected_size
+        self._complete = False
+        self._error: BaseException | None = None
+        self._cond = threading.Condition()
+
+    @property
+    def path(self) -> Path | None:
+        return self._path
+
+    @property
+    def complete(self) -> bool:
+        return self._complete
+
+    @property
+    def error(self) -> BaseException | None:
+        return self._error
+
+    def set_path(self, path: str | Path) -> None:
+        with self._cond:
+            self._path = Path(path)
+            self._cond.notify_all()
+
+    def notify(self) -> None:
+        with self._cond:
+            self._cond.notify_all()
+
+    def finish(self, path: str | Path | None = None) -> None:
+        with self._cond:
+            if path:
+                self._path = Path(path)
+            self._complete = True
+            self._cond.notify_all()
+
+    def fail(self, error: BaseException) -> None:
+        with self._cond:
+            self._error = error
+            self._cond.notify_all()
+
+    def size(self) -> int:
+        if self._path is None:
+            return 0
+        try:
+            return self._path.stat().st_size
+        except OSError:
+            return 0
+
+    def total_size(self) -> int | None:
+        """Final size if it is known yet"""
+        if self._complete:
+            return self.size()
+        return self._expected_size
+
+    def wait_for(self, size: int, timeout: float | None = None) -> bool:
+        """Block until at least `size` bytes are on disk, the writer stops, or `timeout` passes"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self.size() >= size:
+                    return True
+                if self._complete or self._error is not None:
+                    return self.size() >= size
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                # Poll the file as well: not every writer calls notify()
+                self._cond.wait(0.5 if remaining is None else min(remaining, 0.5))
+
+    def open(self) -> BinaryIO:
+        if self._path is None:
+            raise FileNotFoundError("No file has been written yet")
+        return self._path.open("rb")
+
+
+def _token_of(url: str) -> str:
+    """Token of a /media/<token><suffix> URL (a bare token is returned as is)"""
+    return url.rsplit("/", 1)[-1].split(".", 1)[0]
+
+
+class _MediaRequestHandler(BaseHTTPRequestHandler):
+    server: "_MediaHTTPServer"
+
+    def do_HEAD(self) -> None:
+        self._serve(send_body=False)
+
+    def do_GET(self) -> None:
+        self._serve(send_body=True)
+
+    def log_message(self, format: str, *args) -> None:
+        LOGGER.debug("Local media server: " + format, *args)
+
+    def _serve(self, send_body: bool) -> None:
+        growing = self.server.files.get(_token_of(self.path))
+        if growing is None:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+
+        byte_range = self._parse_range(growing)
+        if byte_range is None:
+            return
+        start, end = byte_range
+
+        # Reads past the data on disk block until it arrives
+        if not growing.wait_for(start + 1, timeout=self.server.read_timeout) and not growing.complete:
+            if growing.error is not None:
+                self.send_error(HTTPStatus.BAD_GATEWAY, f"Download failed: {growing.error}")
+            else:
+                self.send_error(HTTPStatus.GATEWAY_TIMEOUT, "Data not available yet")
+            return
+
+        partial = "Range" in self.headers
+        total = growing.total_size()
+        if total is not None:
+            if start >= total and total > 0:
+                self._send_unsatisfiable(total)
+                return
+            end = total - 1 if end is None else min(end, total - 1)
+        elif partial and end is None:
+            # Size still unknown: answer with the bytes that exist, the player asks again
+            end = growing.size() - 1
+
+        self.send_response(HTTPStatus.PARTIAL_CONTENT if partial else HTTPStatus.OK)
+        content_type = mimetypes.guess_type(self.path)[0] or "application/octet-stream"
+        self.send_header("Content-Type", content_type)
+        self.send_header("Accept-Ranges", "bytes")
+        if end is not None:
+            self.send_header("Content-Length", str(max(0, end - start + 1)))
+            if partial:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{total if total is not None else '*'}")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        if send_body:
+            self._copy(growing, start, end)
+
+    def _parse_range(self, growing: GrowingFile) -> Optional[Tuple[int, Optional[int]]]:
+        header = self.headers.get("Range")
+        if not header:
+            return 0, None
+        match = _RANGE_RE.fullmatch(header.strip())
+        if not match or not (match.group(1) or match.group(2)):
+            self.send_error(HTTPStatus.BAD_REQUEST, "Malformed Range header")
+            return None
+        if not match.group(1):
+            # Suffix range: needs the final size
+            growing.wait_for(1 << 62, timeout=self.server.read_timeout)
+            total = growing.total_size()
+            if total is None:
+                self.send_error(HTTPStatus.GATEWAY_TIMEOUT, "Size not known yet")
+                return None
+            return max(0, total - int(match.group(2))), None
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else None
+        return start, end
+
+    def _send_unsatisfiable(self, total: int) -> None:
+        self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.send_header("Content-Range", f"bytes */{total}")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _copy(self, growing: GrowingFile, start: int, end: int | None) -> None:
+        position = start
+        try:
+            with growing.open() as fh:
+                fh.seek(start)
+                while end is None or position <= end:
+                    want = _CHUNK_SIZE if end is None else min(_CHUNK_SIZE, end - position + 1)
+                    data = fh.read(want)
+                    if data:
+                        self.wfile.write(data)
+                        position += len(data)
+                        continue
+                    if growing.complete or growing.error is not None:
+                        break
+                    if not growing.wait_for(position + 1, timeout=self.server.read_timeout):
+                        if growing.complete or growing.error is not None:
+                            break
+                        LOGGER.warning("Timed out waiting for data at byte %d of %s", position, growing.path)
+                        break
+        except (BrokenPipeError, ConnectionResetError):
+            # The player closes connections whenever it seeks
+            pass
+        except FileNotFoundError:
+            LOGGER.warning("Served file disappeared: %s", growing.path)
+
+
+class _MediaHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, read_timeout: float) -> None:
+        super().__init__(("127.0.0.1", 0), _MediaRequestHandler)
+        self.files: Dict[str, GrowingFile] = {}
+        self.read_timeout = read_timeout
+
+
+class LocalMediaServer:
+    """Serves registered GrowingFiles on 127.0.0.1 with HTTP range support."""
+
+    def __init__(self, read_timeout: float = 60.0) -> None:
+        self._read_timeout = read_timeout
+        self._server: _MediaHTTPServer | None = None
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def register(self, growing: GrowingFile, suffix: str = "") -> str:
+        """Serve `growing` and return its loopback URL"""
+        server = self._ensure_started()
+        token = uuid.uuid4().hex
+        server.files[token] = growing
+        host, port = server.server_address[:2]
+        return f"http://{host}:{port}/media/{token}{suffix}"
+
+    def unregister(self, url: str) -> None:
+        """Stop serving a URL returned by register() (or its token)"""
+        with self._lock:
+            server = self._server
+        if server is not None and server.files.pop(_token_of(url), None) is not None:
+            LOGGER.debug("Stopped serving %s", url)
+
+    def close(self) -> None:
+        with self._lock:
+            server, self._server = self._server, None
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    def _ensure_started(self) -> _MediaHTTPServer:
+        with self._lock:
+            if self._server is None:
+                self._server = _MediaHTTPServer(self._read_timeout)
+                self._thread = threading.Thread(
+                    target=self._server.serve_forever,
+                    name="mtxcast-local-media",
+                    daemon=True,
+                )
+                self._thread.start()
+                LOGGER.info("Local media server listening on %s:%s", *self._server.server_address[:2])
+            return self._server
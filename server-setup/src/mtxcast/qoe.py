@@ -0,0 +1,293 @@
+"""Quality-of-experience reports for playback sessions, kept in SQLite."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing
+from dataclasses import asdict, dataclass, fields
+from pathlib import Path
+from typing import Any, Dict, List, Set, Tuple
+from urllib.parse import urlparse
+
+LOGGER = logging.getLogger(__name__)
+
+QOE_DB = Path.home() / ".mtxcast" / "qoe.sqlite3"
+
+# Player statuses that start and end a rebuffering episode once playback has started
+_STALL_STATUSES = ("BufferingMedia", "StalledMedia")
+_RECOVERED_STATUSES = ("BufferedMedia", "LoadedMedia", "EndOfMedia")
+
+GROUP_COLUMNS = ("extractor", "domain", "delivery")
+
+
+def domain_of(url: str | None) -> str | None:
+    """Host name of `url` without a leading www."""
+    if not url:
+        return None
+    host = urlparse(url).hostname
+    if host and host.startswith("www."):
+        host = host[4:]
+    return host
+
+
+@dataclass
+class QoeSession:
+    session_id: str
+    started: float  # epoch seconds
+    delivery: str  # "stream", "separated", "progressive", "file" or "whip"
+    source_url: str | None = None
+    domain: str | None = None
+    extractor: str | None = None
+    title: str | None = None
+    startup_seconds: float | None = None  # until the position first advanced (or the first WHIP frame)
+    rebuffer_count: int = 0
+    rebuffer_seconds: float = 0.0
+    retries: int = 0  # whole-stream retries (_retry_timer)
+    audio_retries: int = 0  # audio-only retries of separated streams (_audio_retry_timer)
+    seek_count: int = 0
+    seek_latency_total: float = 0.0
+    seek_latency_max: float | None = None
+    exit_reason: str | None = None  # "ended", "stopped", "replaced", "failed", "error" or "shutdown"
+    duration_seconds: float | None = None  # wall time of the session
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+_COLUMNS = [f.name for f in fields(QoeSession)]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT UNIQUE NOT NULL,
+    started REAL NOT NULL,
+    delivery TEXT NOT NULL,
+    source_url TEXT,
+    domain TEXT,
+    extractor TEXT,
+    title TEXT,
+    startup_seconds REAL,
+    rebuffer_count INTEGER NOT NULL,
+    rebuffer_seconds REAL NOT NULL,
+    retries INTEGER NOT NULL,
+    audio_retries INTEGER NOT NULL,
+    seek_count INTEGER NOT NULL,
+    seek_latency_total REAL NOT NULL,
+    seek_latency_max REAL,
+    exit_reason TEXT,
+    duration_seconds REAL
+);
+CREATE INDEX IF NOT EXISTS sessions_extractor ON sessions (extractor, started);
+CREATE INDEX IF NOT EXISTS sessions_domain ON sessions (domain, started);
+"""
+
+
+class QoeStore:
+    """Finished sessions in a local SQLite database, capped at `max_sessions` rows"""
+
+    def __init__(self, path: Path = QOE_DB, max_sessions: int = 10000) -> None:
+        self._path = path
+        self._max_sessions = max_sessions
+        self._lock = threading.Lock()  # one writer at a time; each call opens its own connection
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as db:
+            db.executescript(_SCHEMA)
+
+    def _connect(self) -> closing[sqlite3.Connection]:
+        db = sqlite3.connect(self._path, timeout=5.0)
+        db.row_factory = sqlite3.Row
+        return closing(db)
+
+    def insert(self, session: QoeSession) -> None:
+        row = session.to_dict()
+        placeholders = ", ".join("?" for _ in _COLUMNS)
+        with self._lock, self._connect() as db, db:
+            db.execute(
+                f"INSERT OR REPLACE INTO sessions ({', '.join(_COLUMNS)}) VALUES ({placeholders})",
+                [row[c] for c in _COLUMNS],
+            )
+            if self._max_sessions:
+                db.execute(
+                    "DELETE FROM sessions WHERE id <= (SELECT id FROM sessions ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                    (self._max_sessions,),
+                )
+
+    def sessions(
+        self,
+        extractor: str | None = None,
+        domain: str | None = None,
+        since: float | None = None,
+        limit: int = 100,
+    ) -> List[Dict[str, Any]]:
+        """Sessions newest first"""
+        where, params = self._filters(extractor, domain, since)
+        with self._connect() as db:
+            rows = db.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM sessions {where} ORDER BY id DESC LIMIT ?",
+                [*params, limit],
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def summary(
+        self,
+        group_by: str = "extractor",
+        extractor: str | None = None,
+        domain: str | None = None,
+        since: float | None = None,
+    ) -> List[Dict[str, Any]]:
+        """Aggregates per extractor, domain or delivery, most sessions first"""
+        if group_by not in GROUP_COLUMNS:
+            raise ValueError(f"group_by must be one of {', '.join(GROUP_COLUMNS)}")
+        where, params = self._filters(extractor, domain, since)
+        with self._connect() as db:
+            rows = db.execute(
+                f"""
+                SELECT {group_by} AS "group",
+                    COUNT(*) AS sessions,
+                    AVG(startup_seconds) AS startup_avg,
+                    MAX(startup_seconds) AS startup_max,
+                    SUM(startup_seconds IS NULL) AS never_started,
+                    SUM(rebuffer_count > 0) AS sessions_with_rebuffering,
+                    SUM(rebuffer_count) AS rebuffer_count,
+                    SUM(rebuffer_seconds) AS rebuffer_seconds,
+                    SUM(rebuffer_seconds) / NULLIF(SUM(duration_seconds), 0) AS rebuffer_ratio,
+                    SUM(retries) AS retries,
+                    SUM(audio_retries) AS audio_retries,
+                    SUM(seek_latency_total) / NULLIF(SUM(seek_count), 0) AS seek_latency_avg,
+                    SUM(exit_reason IN ('failed', 'error')) AS failures
+                FROM sessions {where}
+                GROUP BY {group_by}
+                ORDER BY sessions DESC
+                """,
+                params,
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    @staticmethod
+    def _filters(extractor: str | None, domain: str | None, since: float | None) -> Tuple[str, List[Any]]:
+        clauses: List[str] = []
+        params: List[Any] = []
+        if extractor is not None:
+            clauses.append("extractor = ? COLLATE NOCASE")
+            params.append(extractor)
+        if domain is not None:
+            clauses.append("domain = ? COLLATE NOCASE")
+            params.append(domain_of(f"//{domain}") or domain)
+        if since is not None:
+            clauses.append("started >= ?")
+            params.append(since)
+        return ("WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+class QoeRecorder:
+    """Builds the report of the playback session on screen.
+
+    The stream manager opens a session for every cast; the player reports
+    what happens during it through `on_player_event`. A session ends when the
+    media ends, playback stops or fails, or the next cast replaces it, and is
+    then written to the store in a worker thread.
+    """
+
+    def __init__(self, store: QoeStore) -> None:
+        self._store = store
+        self._session: QoeSession | None = None
+        self._started = 0.0  # monotonic start of the session
+        self._stall_started: float | None = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def current(self) -> QoeSession | None:
+        return self._session
+
+    def begin(
+        self,
+        delivery: str,
+        source_url: str | None = None,
+        extractor: str | None = None,
+        title: str | None = None,
+    ) -> None:
+        self.end("replaced")
+        self._session = QoeSession(
+            session_id=uuid.uuid4().hex[:12],
+            started=time.time(),
+            delivery=delivery,
+            source_url=source_url,
+            domain=domain_of(source_url),
+            extractor=extractor,
+            title=title,
+        )
+        self._started = time.monotonic()
+        self._stall_started = None
+
+    def end(self, reason: str) -> None:
+        session = self._session
+        if session is None:
+            return
+        now = time.monotonic()
+        self._close_stall(now)
+        session.exit_reason = reason
+        session.duration_seconds = now - self._started
+        self._session = None
+        LOGGER.info(
+            "Playback session %s ended (%s): startup %s, %d rebuffers (%.1fs), %d retries",
+            session.session_id,
+            reason,
+            f"{session.startup_seconds:.2f}s" if session.startup_seconds is not None else "never",
+            session.rebuffer_count,
+            session.rebuffer_seconds,
+            session.retries + session.audio_retries,
+        )
+        self._spawn(asyncio.to_thread(self._store.insert, session))
+
+    def on_player_event(self, kind: str, value: Any) -> None:
+        """Player reports: first_frame (seconds), media_status (name), retry ("video"/"audio"), seek (seconds), exit (reason)"""
+        session = self._session
+        if session is None:
+            return
+        now = time.monotonic()
+        if kind == "first_frame":
+            if session.startup_seconds is None:
+                session.startup_seconds = float(value)
+        elif kind == "media_status":
+            # Buffering before the first frame is part of startup, not rebuffering
+            if value in _STALL_STATUSES and session.startup_seconds is not None and self._stall_started is None:
+                self._stall_started = now
+            elif value in _RECOVERED_STATUSES:
+                self._close_stall(now)
+        elif kind == "retry":
+            if value == "audio":
+                session.audio_retries += 1
+            else:
+                session.retries += 1
+        elif kind == "seek":
+            latency = float(value)
+            session.seek_count += 1
+            session.seek_latency_total += latency
+            session.seek_latency_max = max(latency, session.seek_latency_max or 0.0)
+        elif kind == "exit":
+            self.end(str(value))
+
+    async def close(self) -> None:
+        self.end("shutdown")
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _close_stall(self, now: float) -> None:
+        if self._stall_started is not None and self._session is not None:
+            self._session.rebuffer_count += 1
+            self._session.rebuffer_seconds += now - self._stall_started
+        self._stall_started = None
+
+    def _spawn(self, coro: Any) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._on_saved)
+
+    def _on_saved(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            LOGGER.warning("Failed to store playback session: %s", task.exception())
@@ -0,0 +1,143 @@
+"""In-process cache of resolved media keyed by normalized URL and format."""
+
+from __future__ import annotations
+
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+if TYPE_CHECKING:
+    from .metadata import ResolvedMedia
+
+LOGGER = logging.getLogger(__name__)
+
+CacheKey = Tuple[str, str]
+
+# Query parameters that never change what yt-dlp extracts
+_IGNORED_QUERY_PARAMS = {"feature", "si", "pp", "fbclid", "gclid"}
+# Signed media URLs carry their expiry either as a query parameter (?expire=...)
+# or as a path segment (googlevideo HLS/DASH manifests use /expire/<ts>/)
+_EXPIRE_QUERY_PARAMS = ("expire", "expires", "Expires")
+_EXPIRE_PATH_RE = re.compile(r"/expire/(\d+)")
+
+
+def normalize_url(url: str) -> str:
+    """Normalize a source URL so trivially different spellings share a cache entry"""
+    parts = urlsplit(url.strip())
+    query = [
+        (k, v)
+        for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k not in _IGNORED_QUERY_PARAMS and not k.startswith("utm_")
+    ]
+    query.sort()
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or "/", urlencode(query), ""))
+
+
+def url_expiry(url: str | None) -> float | None:
+    """Return the epoch time at which a signed media URL expires, if it says so"""
+    if not url:
+        return None
+    parts = urlsplit(url)
+    for key, value in parse_qsl(parts.query):
+        if key in _EXPIRE_QUERY_PARAMS and value.isdigit():
+            return float(value)
+    match = _EXPIRE_PATH_RE.search(parts.path)
+    if match:
+        return float(match.group(1))
+    return None
+
+
+def media_expiry(media: "ResolvedMedia") -> float | None:
+    """Earliest expiry among the signed URLs of `media`, if any of them carry one"""
+    urls = (media.playback_url, media.video_url, media.audio_url)
+    expiries = [e for e in (url_expiry(u) for u in urls) if e is not None]
+    return min(expiries) if expiries else None
+
+
+@dataclass
+class _CacheEntry:
+    media: "ResolvedMedia"
+    expires_at: float
+
+
+class ResolutionCache:
+    """LRU cache of ResolvedMedia whose entries expire with their signed URLs."""
+
+    def __init__(self, max_entries: int = 64, default_ttl: float = 600.0, expiry_margin: float = 60.0) -> None:
+        self._max_entries = max_entries
+        self._default_ttl = default_ttl
+        # Drop entries a little before the URL actually expires so playback
+        # (and any retries in PlayerBackend) still has time to use it
+        self._expiry_margin = expiry_margin
+        self._entries: OrderedDict[CacheKey, _CacheEntry] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(url: str, fmt: str) -> CacheKey:
+        return normalize_url(url), fmt
+
+    def get(self, key: CacheKey) -> Optional["ResolvedMedia"]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires_at <= time.time() or not self._files_exist(entry.media):
+                LOGGER.debug("Resolution cache entry expired: %s", key[0])
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.media
+
+    def contains(self, key: CacheKey) -> bool:
+        """Whether a valid entry exists, without touching LRU order or counters"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry.expires_at > time.time() and self._files_exist(entry.media)
+
+    def put(self, key: CacheKey, media: "ResolvedMedia") -> None:
+        if self._max_entries <= 0:
+            return
+        expires_at = self._expires_at(media)
+        if expires_at <= time.time():
+            LOGGER.debug("Not caching already-expired resolution for %s", key[0])
+            return
+        with self._lock:
+            self._entries[key] = _CacheEntry(media=media, expires_at=expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                LOGGER.debug("Resolution cache evicted: %s", evicted[0])
+
+    def invalidate(self, key: CacheKey) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def _expires_at(self, media: "ResolvedMedia") -> float:
+        expiry = media_expiry(media)
+        if expiry is not None:
+            return expiry - self._expiry_margin
+        return time.time() + self._default_ttl
+
+    @staticmethod
+    def _files_exist(media: "ResolvedMedia") -> bool:
+        paths = (media.file_path, media.video_file_path, media.audio_file_path)
+        return all(Path(p).exists() for p in paths if p)
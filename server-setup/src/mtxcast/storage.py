@@ -0,0 +1,246 @@
+"""Disk quota for uploaded and downloaded media with LRU eviction."""
+
+from __future__ import annotations
+
+import fnmatch
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Set, Tuple
+
+LOGGER = logging.getLogger(__name__)
+
+STORAGE_INDEX = Path.home() / ".mtxcast" / "storage.json"
+
+# Bookkeeping files that live next to the media and are never evicted
+_INDEX_NAMES = ("index.json", "index.tmp")
+# Partial files left behind by a previous run by yt-dlp
+_LEFTOVER_PATTERNS = ("*.part", "*.part-Frag*", "*.ytdl")
+# Uploads are written under this prefix until they are complete. Sessions do
+# not survive a restart, so unregistered files with it are leftovers; a
+# finished upload that could not be renamed is registered and kept.
+PARTIAL_UPLOAD_PREFIX = "partial-"
+
+FileId = Tuple[int, int]  # (device, inode): survives renames, unlike the path
+
+
+@dataclass
+class StoredFile:
+    area: str
+    size: int
+    added: float
+    last_played: float | None = None
+
+
+def _file_id(path: Path) -> FileId | None:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return st.st_dev, st.st_ino
+
+
+class StorageManager:
+    """Tracks media files in the upload and download directories.
+
+    Every finished file is registered with its size and the time it was last
+    played. When the total exceeds `max_bytes` (0 = unlimited), the least
+    recently played files are deleted first; the file that is playing right now
+    is never deleted. Files that are still being written are not registered, so
+    they are never evicted either.
+    """
+
+    def __init__(self, areas: Dict[str, Path], max_bytes: int = 0, index_path: Path = STORAGE_INDEX) -> None:
+        self._areas = areas
+        self._max_bytes = max_bytes
+        self._index_path = index_path
+        self._lock = threading.Lock()
+        self._files: Dict[str, StoredFile] = {}  # absolute path -> entry
+        self._playing: Set[FileId] = set()
+        self._evicted_files = 0
+        self._evicted_bytes = 0
+        self._load()
+
+    def scan(self) -> None:
+        """Reconcile the index with the directories: remove leftovers, register untracked files"""
+        started = time.monotonic()
+        removed = 0
+        with self._lock:
+            seen: Set[str] = set()
+            for area, directory in self._areas.items():
+                if not directory.is_dir():
+                    continue
+                for path in directory.iterdir():
+                    if not path.is_file() or path.name in _INDEX_NAMES:
+                        continue
+                    key = str(path)
+                    if any(fnmatch.fnmatch(path.name, pattern) for pattern in _LEFTOVER_PATTERNS) or (
+                        path.name.startswith(PARTIAL_UPLOAD_PREFIX) and key not in self._files
+                    ):
+                        LOGGER.info("Removing leftover partial file %s", path)
+                        self._unlink(path)
+                        removed += 1
+                        continue
+                    seen.add(key)
+                    size = path.stat().st_size
+                    entry = self._files.get(key)
+                    if entry is None:
+                        self._files[key] = StoredFile(area=area, size=size, added=path.stat().st_mtime)
+                    else:
+                        entry.size = size
+            for key in [k for k in self._files if k not in seen]:
+                del self._files[key]
+            self._evict_locked(0)
+            self._save_locked()
+            total = sum(e.size for e in self._files.values())
+        LOGGER.info(
+            "Storage scan: %d files, %d bytes, %d leftovers removed in %.2fs",
+            len(self._files),
+            total,
+            removed,
+            time.monotonic() - started,
+        )
+
+    def add(self, path: str | Path) -> None:
+        """Register a finished file and enforce the quota"""
+        path = Path(path)
+        area = self._area_of(path)
+        if area is None or not path.exists():
+            return
+        with self._lock:
+            key = str(path)
+            entry = self._files.get(key)
+            if entry is None:
+                self._files[key] = StoredFile(area=area, size=path.stat().st_size, added=time.time())
+            else:
+                entry.size = path.stat().st_size
+            self._evict_locked(0)
+            self._save_locked()
+
+    def make_room(self, nbytes: int) -> None:
+        """Evict ahead of a file of `nbytes` that is about to be written"""
+        with self._lock:
+            self._evict_locked(nbytes)
+            self._save_locked()
+
+    def set_playing(self, paths: Iterable[str | Path]) -> None:
+        """Record which local files the player is using; they are exempt from eviction"""
+        ids = {file_id for file_id in (_file_id(Path(p)) for p in paths) if file_id is not None}
+        now = time.time()
+        with self._lock:
+            self._playing = ids
+            if not ids:
+                return
+            for key, entry in self._files.items():
+                if _file_id(Path(key)) in ids:
+                    entry.last_played = now
+            self._save_locked()
+
+    def is_playing(self, path: str | Path) -> bool:
+        file_id = _file_id(Path(path))
+        with self._lock:
+            return file_id is not None and file_id in self._playing
+
+    def usage(self) -> dict:
+        with self._lock:
+            self._prune_missing_locked()
+            areas = {
+                area: {"directory": str(directory), "files": 0, "bytes": 0}
+                for area, directory in self._areas.items()
+            }
+            files: List[dict] = []
+            for key, entry in sorted(self._files.items(), key=lambda kv: self._recency(kv[1])):
+                areas[entry.area]["files"] += 1
+                areas[entry.area]["bytes"] += entry.size
+                files.append(
+                    {
+                        "area": entry.area,
+                        "name": Path(key).name,
+                        "size": entry.size,
+                        "added": entry.added,
+                        "last_played": entry.last_played,
+                        "playing": _file_id(Path(key)) in self._playing,
+                    }
+                )
+            return {
+                "bytes": sum(a["bytes"] for a in areas.values()),
+                "max_bytes": self._max_bytes,
+                "areas": areas,
+                "evicted_files": self._evicted_files,
+                "evicted_bytes": self._evicted_bytes,
+                "files": files,  # eviction order: least recently played first
+            }
+
+    def _area_of(self, path: Path) -> str | None:
+        for area, directory in self._areas.items():
+            if path.parent == directory:
+                return area
+        return None
+
+    @staticmethod
+    def _recency(entry: StoredFile) -> float:
+        return entry.last_played if entry.last_played is not None else entry.added
+
+    def _prune_missing_locked(self) -> None:
+        # Other code (the download cache's own cap, failed uploads) also deletes files
+        for key in [k for k in self._files if not Path(k).exists()]:
+            del self._files[key]
+
+    def _evict_locked(self, reserve: int) -> None:
+        if not self._max_bytes:
+            return
+        self._prune_missing_locked()
+        total = sum(e.size for e in self._files.values()) + reserve
+        if total <= self._max_bytes:
+            return
+        for key in sorted(self._files, key=lambda k: self._recency(self._files[k])):
+            if total <= self._max_bytes:
+                break
+            path = Path(key)
+            if _file_id(path) in self._playing:
+                continue
+            entry = self._files.pop(key)
+            LOGGER.info("Evicting %s (%d bytes, last played %s)", path, entry.size, entry.last_played)
+            if self._unlink(path):
+                total -= entry.size
+                self._evicted_files += 1
+                self._evicted_bytes += entry.size
+        if total > self._max_bytes:
+            LOGGER.warning("Storage is over its quota (%d > %d bytes) with nothing left to evict", total, self._max_bytes)
+
+    @staticmethod
+    def _unlink(path: Path) -> bool:
+        try:
+            path.unlink(missing_ok=True)
+            return True
+        except OSError as e:
+            # Windows cannot delete a file another process still has open
+            LOGGER.warning("Failed to remove %s: %s", path, e)
+            return False
+
+    def _load(self) -> None:
+        if not self._index_path.exists():
+            return
+        try:
+            with self._index_path.open("r", encoding="utf-8") as fh:
+                data = json.load(fh)
+            self._files = {
+                key: StoredFile(**raw) for key, raw in data.get("files", {}).items() if raw.get("area") in self._areas
+            }
+        except (OSError, ValueError, TypeError) as e:
+            LOGGER.warning("Ignoring unreadable storage index %s: %s", self._index_path, e)
+            self._files = {}
+
+    def _save_locked(self) -> None:
+        tmp_path = self._index_path.with_suffix(".tmp")
+        try:
+            self._index_path.parent.mkdir(parents=True, exist_ok=True)
+            with tmp_path.open("w", encoding="utf-8") as fh:
+                json.dump({"files": {k: asdict(e) for k, e in self._files.items()}}, fh, indent=2)
+            os.replace(tmp_path, self._index_path)
+        except OSError as e:
+            LOGGER.warning("Failed to write storage index %s: %s", self._index_path, e)
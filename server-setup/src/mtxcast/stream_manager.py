@@ -2,24 +2,40 @@ from __future__ import annotations
 
 import asyncio
 import logging
-from dataclasses import dataclass
+import time
+from dataclasses import dataclass, field, replace
 from enum import Enum, auto
-from typing import Optional, Protocol
+from pathlib import Path
+from typing import Any, Callable, List, Optional, Protocol, Tuple
 
 from aiortc import RTCPeerConnection
 from aiortc.mediastreams import MediaStreamTrack
 
-from .metadata import MetadataPayload, MetadataResolver
+from .coalesce import LatestWins
+from .metadata import MetadataPayload, MetadataResolver, ResolvedMedia
+from .qoe import QoeRecorder
+from .resolution_cache import normalize_url
 from .sleep_inhibitor import SleepInhibitor
+from .storage import StorageManager
+from .tracing import current_span, span, traced
 
 LOGGER = logging.getLogger(__name__)
 
+# A position report is only published when it differs from the position extrapolated
+# from the current snapshot by more than this, so steady playback does not churn versions
+POSITION_TOLERANCE = 0.25  # seconds
+# Longest a seek holds back the next one while the player buffers at the new position
+SEEK_SETTLE_TIMEOUT = 1.5  # seconds
+
 
 @dataclass
 class PlaybackMetrics:
     position: Optional[float] = None  # seconds
     duration: Optional[float] = None  # seconds
     is_seekable: bool = False
+    playback_rate: float = 1.0
+    is_advancing: bool = False  # playing and not stalled
+    sampled_at: Optional[float] = None  # time.monotonic() when position was read
 
 
 class PlayerTransport(Protocol):
@@ -46,8 +62,9 @@ class StreamType(Enum):
     WHIP = auto()
 
 
-@dataclass
+@dataclass(frozen=True)
 class PlayerStatus:
+    version: int = 0  # incremented on every published change
     stream_type: StreamType = StreamType.IDLE
     title: Optional[str] = None
     is_playing: bool = False
@@ -55,34 +72,174 @@ class PlayerStatus:
     position: Optional[float] = None
     duration: Optional[float] = None
     is_seekable: bool = False
+    # Clients extrapolate the position between snapshots:
+    # position + (server_now - sampled_at) * playback_rate, while is_advancing
+    sampled_at: Optional[float] = None  # server time.monotonic() at which position was sampled
+    playback_rate: float = 1.0
+    is_advancing: bool = False
+
+    def position_at(self, now: float) -> Optional[float]:
+        """Position extrapolated to monotonic time `now`"""
+        if self.position is None or self.sampled_at is None or not self.is_advancing:
+            return self.position
+        position = self.position + (now - self.sampled_at) * self.playback_rate
+        return min(position, self.duration) if self.duration else position
+
+
+class CastSupersededError(RuntimeError):
+    """A newer cast replaced this one before it reached the screen"""
+
+
+# Casts of the same URL whose start times fall in the same bucket are treated as one
+START_TIME_BUCKET = 2.0  # seconds
+
+CastKey = Tuple[str, int]
+
+
+def cast_key(payload: MetadataPayload) -> CastKey:
+    return normalize_url(str(payload.source_url)), int((payload.start_time or 0.0) // START_TIME_BUCKET)
+
+
+@dataclass
+class _Cast:
+    """A metadata cast on its way to the screen, shared by identical requests"""
+
+    key: CastKey
+    task: asyncio.Task | None = None
+    phase: str | None = None
+    listeners: List[Callable[[str], None]] = field(default_factory=list)
+    trace_id: str | None = None  # trace holding the resolve and play spans
+
+    def enter(self, phase: str) -> None:
+        self.phase = phase
+        for listener in self.listeners:
+            listener(phase)
 
 
 class StreamManager:
-    def __init__(self, player: PlayerTransport, resolver: MetadataResolver) -> None:
+    def __init__(
+        self,
+        player: PlayerTransport,
+        resolver: MetadataResolver,
+        storage: StorageManager | None = None,
+        qoe: QoeRecorder | None = None,
+    ) -> None:
         self._player = player
         self._resolver = resolver
+        self._storage = storage
+        self._qoe = qoe
         self._status = PlayerStatus()
         self._lock = asyncio.Lock()
         self._sleep_inhibitor = SleepInhibitor()
+        self._cast: _Cast | None = None
+        self._progressive: ResolvedMedia | None = None  # on screen and served by the loopback server
+        self._cast_counts = {"started": 0, "joined": 0, "superseded": 0}
+        self._changed = asyncio.Event()  # replaced after every publish; see wait_for_change()
+        # Slider drags send bursts of these; only the newest pending target is applied
+        self._seeks: LatestWins[float, PlayerStatus] = LatestWins("seek", self._apply_seek, self._seek_settled)
+        self._volumes: LatestWins[float, PlayerStatus] = LatestWins("volume", self._apply_volume)
+        self._seek_issued_at = 0.0
 
     @property
     def status(self) -> PlayerStatus:
         return self._status
 
-    async def handle_metadata(self, payload: MetadataPayload) -> PlayerStatus:
+    @property
+    def cast_in_flight(self) -> bool:
+        """A /metadata cast is still resolving or buffering"""
+        return self._cast is not None and not self._cast.task.done()
+
+    @traced("StreamManager.handle_metadata")
+    async def handle_metadata(
+        self,
+        payload: MetadataPayload,
+        on_phase: Callable[[str], None] | None = None,
+    ) -> PlayerStatus:
+        """Resolve and play `payload`, cancelling any cast that has not reached the screen yet.
+
+        A request identical to the cast in flight (same normalized URL and
+        start-time bucket) joins it instead: one resolution, one play_url, and
+        every caller gets the same result. `on_phase` is called with
+        "resolving" and then "buffering" as the cast progresses.
+        """
+        key = cast_key(payload)
+        cast = self._cast
+        if cast is not None and cast.key == key and not cast.task.done():
+            LOGGER.info("Joining identical in-flight cast of %s", payload.source_url)
+            self._cast_counts["joined"] += 1
+            # The shared cast's spans are in the trace of the request that started it
+            current_span().event("joined_cast", trace_id=cast.trace_id)
+        else:
+            previous = cast
+            trace = current_span().trace
+            cast = _Cast(key, trace_id=trace.trace_id if trace is not None else None)
+            cast.task = asyncio.create_task(self._cast_metadata(payload, cast.enter))
+            self._cast = cast
+            self._cast_counts["started"] += 1
+            if previous is not None and not previous.task.done():
+                LOGGER.info("Superseding in-flight cast with %s", payload.source_url)
+                self._cast_counts["superseded"] += 1
+                previous.task.cancel()
+        if on_phase is not None:
+            cast.listeners.append(on_phase)
+            if cast.phase is not None:
+                on_phase(cast.phase)
+        try:
+            # Shielded: a caller going away must not cancel a cast others are waiting for
+            return await asyncio.shield(cast.task)
+        except asyncio.CancelledError:
+            if cast.task.cancelled() and self._cast is not cast:
+                raise CastSupersededError(f"Cast of {payload.source_url} was superseded by a newer cast") from None
+            raise
+        finally:
+            if self._cast is cast and cast.task.done():
+                self._cast = None
+
+    async def _cast_metadata(self, payload: MetadataPayload, on_phase: Callable[[str], None]) -> PlayerStatus:
+        # Resolve without the lock so a newer cast can cancel this one at any
+        # point; the lock only serializes access to the player
+        on_phase("resolving")
+        resolved = await self._resolver.resolve(payload)
+        on_phase("buffering")
+        try:
+            with span("wait_for_player"):
+                await self._lock.acquire()
+        except asyncio.CancelledError:
+            # Superseded before it reached the player
+            self._release(resolved)
+            raise
+        try:
+            return await self._play_resolved_impl(resolved)
+        finally:
+            self._lock.release()
+
+    async def play_resolved(self, resolved: ResolvedMedia) -> PlayerStatus:
+        """Play media that has already been resolved (e.g. by the play queue)"""
         async with self._lock:
-            resolved = await self._resolver.resolve(payload)
-            
-            # If file_path is set (e.g., for niconico), use file playback
-            # Note: We use _handle_file_impl here because we already hold the lock
-            if resolved.file_path:
-                LOGGER.info("Using downloaded file for playback: %s", resolved.file_path)
-                try:
-                    return await self._handle_file_impl(resolved.file_path, resolved.start_time, resolved.title)
-                except Exception as e:
-                    LOGGER.error("Error playing file %s: %s", resolved.file_path, e, exc_info=True)
-                    raise
-            
+            return await self._play_resolved_impl(resolved)
+
+    async def _play_resolved_impl(self, resolved: ResolvedMedia) -> PlayerStatus:
+        """Internal implementation of resolved media playback (assumes lock is already held)"""
+        if resolved.file_path:
+            delivery = "file"
+        elif resolved.video_url and resolved.audio_url:
+            delivery = "separated"
+        else:
+            delivery = "progressive" if resolved.progressive else "stream"
+        self._begin_qoe(delivery, resolved.source_url, resolved.extractor, resolved.title)
+        
+        # If file_path is set (e.g., for niconico), use file playback
+        # Note: We use _handle_file_impl here because we already hold the lock
+        if resolved.file_path:
+            LOGGER.info("Using downloaded file for playback: %s", resolved.file_path)
+            try:
+                return await self._handle_file_impl(resolved.file_path, resolved.start_time, resolved.title)
+            except Exception as e:
+                LOGGER.error("Error playing file %s: %s", resolved.file_path, e, exc_info=True)
+                self._end_qoe("error")
+                raise
+        
+        try:
             # Check if we have separated streams
             if resolved.video_url and resolved.audio_url:
                 await self._player.play_separated_streams(
@@ -93,45 +250,97 @@ class StreamManager:
                 )
             else:
                 await self._player.play_url(resolved.playback_url, resolved.start_time, resolved.title)
-            
-            # Start sleep inhibition when casting begins
-            self._sleep_inhibitor.start()
-            
-            self._status = PlayerStatus(
-                stream_type=StreamType.METADATA,
-                title=resolved.title,
-                is_playing=True,
-                volume=self._status.volume,
-                position=resolved.start_time,
-                duration=None,
-                is_seekable=True,
-            )
-            return self._status
+        except Exception:
+            self._end_qoe("error")
+            self._release(resolved)
+            raise
+        except asyncio.CancelledError:
+            self._release(resolved)
+            raise
+        self._set_playing_files(
+            resolved.local_path,
+            resolved.video_file_path,
+            resolved.audio_file_path,
+            progressive=resolved if resolved.progressive else None,
+        )
+        
+        # Start sleep inhibition when casting begins
+        self._sleep_inhibitor.start()
+        
+        return self._publish(
+            stream_type=StreamType.METADATA,
+            title=resolved.title,
+            is_playing=True,
+            position=resolved.start_time,
+            sampled_at=time.monotonic(),
+            is_advancing=False,
+            duration=None,
+            is_seekable=True,
+        )
+
+    def _begin_qoe(
+        self,
+        delivery: str,
+        source_url: str | None = None,
+        extractor: str | None = None,
+        title: str | None = None,
+    ) -> None:
+        """Start the QoE report of a new playback session (ending the previous one as replaced)"""
+        if self._qoe is not None:
+            self._qoe.begin(delivery, source_url=source_url, extractor=extractor, title=title)
+
+    def _end_qoe(self, reason: str) -> None:
+        if self._qoe is not None:
+            self._qoe.end(reason)
+
+    def _set_playing_files(self, *paths: str | Path | None, progressive: ResolvedMedia | None = None) -> None:
+        """Tell storage which local files are on screen so they are not evicted.
+
+        Whatever was on screen before is replaced, so its loopback URL (if it
+        was progressive) is no longer served.
+        """
+        if self._storage is not None:
+            self._storage.set_playing(p for p in paths if p)
+        previous, self._progressive = self._progressive, progressive
+        if previous is not None and previous is not progressive:
+            self._resolver.release(previous)
+
+    def _release(self, resolved: ResolvedMedia) -> None:
+        """Drop the loopback URL of media that did not make it to the screen"""
+        if resolved is not self._progressive:
+            self._resolver.release(resolved)
 
     async def handle_whip_track(self, track: MediaStreamTrack, pc: RTCPeerConnection, title: str | None = None) -> PlayerStatus:
         async with self._lock:
             LOGGER.info("Attaching WHIP track to player")
+            self._begin_qoe("whip", title=title)
             await self._player.attach_webrtc_track(track, pc)
             LOGGER.info("WHIP track attached successfully")
+            self._set_playing_files()
             
             # Start sleep inhibition when casting begins
             self._sleep_inhibitor.start()
             
-            self._status = PlayerStatus(
+            return self._publish(
                 stream_type=StreamType.WHIP,
                 title=title or "Live WHIP Stream",
                 is_playing=True,
-                volume=self._status.volume,
                 position=None,
+                sampled_at=None,
+                is_advancing=False,
                 duration=None,
                 is_seekable=False,
             )
-            return self._status
 
     async def handle_file(self, file_path: str, start_time: float = 0.0, title: str | None = None) -> PlayerStatus:
         """Handle file playback with lock management"""
         async with self._lock:
-            return await self._handle_file_impl(file_path, start_time, title)
+            self._begin_qoe("file", title=title or Path(file_path).name)
+            try:
+                return await self._handle_file_impl(file_path, start_time, title)
+            except Exception:
+                self._end_qoe("error")
+                raise
     
     async def _handle_file_impl(self, file_path: str, start_time: float = 0.0, title: str | None = None) -> PlayerStatus:
         """Internal implementation of file playback (assumes lock is already held)"""
@@ -165,70 +374,156 @@ class StreamManager:
         except Exception as e:
             LOGGER.error("Error in play_url: %s", e, exc_info=True)
             raise
+        self._set_playing_files(path)
         
         # Start sleep inhibition when casting begins
         self._sleep_inhibitor.start()
         
-        self._status = PlayerStatus(
+        return self._publish(
             stream_type=StreamType.METADATA,
             title=title,
             is_playing=True,
-            volume=self._status.volume,
             position=start_time,
+            sampled_at=time.monotonic(),
+            is_advancing=False,
             duration=None,
             is_seekable=True,
         )
-        return self._status
 
     async def pause(self) -> PlayerStatus:
         async with self._lock:
             await self._player.pause()
-            self._status.is_playing = False
-            return self._status
+            now = time.monotonic()
+            # Freeze the extrapolated position now rather than when the player reports back
+            return self._publish(
+                is_playing=False,
+                position=self._status.position_at(now),
+                sampled_at=now,
+                is_advancing=False,
+            )
 
     async def resume(self) -> PlayerStatus:
         async with self._lock:
             await self._player.resume()
-            self._status.is_playing = True
-            return self._status
+            return self._publish(is_playing=True)
 
     async def seek(self, position: float) -> PlayerStatus:
+        return await self._seeks.submit(position)
+
+    async def set_volume(self, volume: float) -> PlayerStatus:
+        return await self._volumes.submit(volume)
+
+    def control_stats(self) -> dict:
+        """Counts of coalesced seek and volume commands, and of joined and superseded casts"""
+        return {"seek": self._seeks.stats(), "volume": self._volumes.stats(), "cast": dict(self._cast_counts)}
+
+    async def _apply_seek(self, position: float) -> PlayerStatus:
         async with self._lock:
+            self._seek_issued_at = time.monotonic()
             await self._player.seek(position)
             return self._status
 
-    async def set_volume(self, volume: float) -> PlayerStatus:
+    async def _seek_settled(self, position: float) -> None:
+        """Wait until the player reports playback after the seek (or stays paused), bounded by a timeout"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + SEEK_SETTLE_TIMEOUT
+        while True:
+            status = self._status
+            if status.stream_type != StreamType.METADATA:
+                return
+            reported = status.sampled_at is not None and status.sampled_at >= self._seek_issued_at
+            if reported and (status.is_advancing or not status.is_playing):
+                return
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            try:
+                await asyncio.wait_for(self.wait_for_change(status.version), remaining)
+            except asyncio.TimeoutError:
+                return
+
+    async def _apply_volume(self, volume: float) -> PlayerStatus:
         async with self._lock:
             await self._player.set_volume(volume)
-            self._status.volume = volume
-            return self._status
+            return self._publish(volume=volume)
 
     async def current_status(self) -> PlayerStatus:
+        """Latest published snapshot; never waits for the lock"""
+        return self._status
+
+    def update_metrics(self, metrics: PlaybackMetrics) -> None:
+        """Publish playback progress reported by the player, unless the snapshot already predicts it"""
+        current = self._status
+        if current.stream_type != StreamType.METADATA:
+            return
+        sampled_at = metrics.sampled_at if metrics.sampled_at is not None else time.monotonic()
+        predicted = current.position_at(sampled_at)
+        unchanged = (
+            (metrics.duration, metrics.is_seekable, metrics.playback_rate, metrics.is_advancing)
+            == (current.duration, current.is_seekable, current.playback_rate, current.is_advancing)
+        )
+        if unchanged and predicted is not None and metrics.position is not None:
+            if abs(metrics.position - predicted) <= POSITION_TOLERANCE:
+                return
+        self._publish(
+            position=metrics.position,
+            duration=metrics.duration,
+            is_seekable=metrics.is_seekable,
+            playback_rate=metrics.playback_rate,
+            is_advancing=metrics.is_advancing,
+            sampled_at=sampled_at,
+        )
+
+    def _publish(self, **changes: Any) -> PlayerStatus:
+        # Snapshots are immutable, so readers never see a half-applied update
+        # and never need the lock; the version lets clients detect changes
+        self._status = replace(self._status, version=self._status.version + 1, **changes)
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+        return self._status
+
+    async def wait_for_change(self, since_version: int) -> PlayerStatus:
+        """Return the first snapshot newer than `since_version`, waiting for one if needed"""
+        while self._status.version <= since_version:
+            await self._changed.wait()
+        return self._status
+
+    async def on_playback_finished(self) -> PlayerStatus:
+        """Record that the player stopped by itself at the end of the media"""
         async with self._lock:
-            metrics = await self._player.get_metrics()
-            self._status.position = metrics.position
-            self._status.duration = metrics.duration
-            self._status.is_seekable = metrics.is_seekable
+            if self._status.stream_type == StreamType.METADATA:
+                self._sleep_inhibitor.stop()
+                self._set_playing_files()
+                return self._publish(
+                    stream_type=StreamType.IDLE,
+                    title=None,
+                    is_playing=False,
+                    position=None,
+                    sampled_at=None,
+                    is_advancing=False,
+                    duration=None,
+                    is_seekable=False,
+                )
             return self._status
 
     async def stop(self) -> PlayerStatus:
         async with self._lock:
             await self._player.stop()
+            self._set_playing_files()
             
             # Stop sleep inhibition when casting ends
             self._sleep_inhibitor.stop()
             
-            volume = self._status.volume
-            self._status = PlayerStatus(
+            return self._publish(
                 stream_type=StreamType.IDLE,
                 title=None,
                 is_playing=False,
-                volume=volume,
                 position=None,
+                sampled_at=None,
+                is_advancing=False,
                 duration=None,
                 is_seekable=False,
             )
-            return self._status
 
 
 
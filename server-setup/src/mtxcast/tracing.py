@@ -0,0 +1,247 @@
+"""Span-based tracing of casts, from the HTTP request to the first frame on screen."""
+
+from __future__ import annotations
+
+import contextvars
+import functools
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, TypeVar
+
+LOGGER = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_current: contextvars.ContextVar["Span | None"] = contextvars.ContextVar("mtxcast_span", default=None)
+
+
+class Span:
+    """One timed step of a trace.
+
+    Spans opened with `span()` nest through the current context, including
+    into tasks and threads started from it. Code that runs outside that
+    context (Qt signal handlers) keeps a reference and uses `child()`.
+    """
+
+    def __init__(self, trace: "Trace", name: str, parent_id: str | None, attributes: Dict[str, Any]) -> None:
+        self.trace = trace
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.events: List[Dict[str, Any]] = []
+        self.start = time.monotonic()
+        self.end: float | None = None
+        self.status = "ok"  # "ok", "error" or "cancelled"
+        trace.add(self)
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def event(self, name: str, **attributes: Any) -> None:
+        """Record a point in time within the span"""
+        self.events.append({"name": name, "at": time.monotonic(), "attributes": attributes})
+
+    def child(self, name: str, **attributes: Any) -> "Span":
+        """Start a span under this one without making it current; call `finish()` on it"""
+        return Span(self.trace, name, self.span_id, attributes)
+
+    def finish(self, status: str | None = None, **attributes: Any) -> None:
+        if self.end is not None:
+            return
+        self.end = time.monotonic()
+        if status is not None:
+            self.status = status
+        self.attributes.update(attributes)
+
+    def to_dict(self, origin: float) -> Dict[str, Any]:
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ms": (self.start - origin) * 1000,
+            "duration_ms": (self.end - self.start) * 1000 if self.end is not None else None,
+            "status": self.status,
+            "attributes": self.attributes,
+            "events": [
+                {"name": e["name"], "at_ms": (e["at"] - origin) * 1000, "attributes": e["attributes"]}
+                for e in self.events
+            ],
+        }
+
+
+class _NoopSpan:
+    """Stands in for a span when no trace is active, so callers need no checks"""
+
+    trace = None
+    span_id = None
+
+    def set(self, **attributes: Any) -> None:
+        pass
+
+    def event(self, name: str, **attributes: Any) -> None:
+        pass
+
+    def child(self, name: str, **attributes: Any) -> "_NoopSpan":
+        return self
+
+    def finish(self, status: str | None = None, **attributes: Any) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    def __init__(self, name: str) -> None:
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.created = time.time()
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()  # spans are also opened from resolver threads
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def _snapshot(self) -> List[Span]:
+        with self._lock:
+            return list(self.spans)
+
+    def summary(self) -> Dict[str, Any]:
+        spans = self._snapshot()
+        origin = spans[0].start if spans else 0.0
+        ends = [s.end for s in spans if s.end is not None]
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "created": self.created,
+            "attributes": spans[0].attributes if spans else {},
+            "spans": len(spans),
+            "open_spans": len(spans) - len(ends),
+            "duration_ms": (max(ends) - origin) * 1000 if ends else None,
+            "errors": [s.name for s in spans if s.status == "error"],
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        spans = self._snapshot()
+        origin = spans[0].start if spans else 0.0
+        return {**self.summary(), "spans": [s.to_dict(origin) for s in spans]}
+
+    def to_chrome(self) -> Dict[str, Any]:
+        """Chrome trace-event format, for chrome://tracing or ui.perfetto.dev"""
+        spans = self._snapshot()
+        origin = spans[0].start if spans else 0.0
+        now = time.monotonic()
+        events: List[Dict[str, Any]] = []
+        for s in spans:
+            args = {**s.attributes, "status": s.status}
+            events.append(
+                {
+                    "name": s.name,
+                    "ph": "X",
+                    "ts": (s.start - origin) * 1e6,
+                    "dur": ((s.end if s.end is not None else now) - s.start) * 1e6,
+                    "pid": 1,
+                    "tid": 1,
+                    "args": args,
+                }
+            )
+            for e in s.events:
+                events.append(
+                    {
+                        "name": e["name"],
+                        "ph": "i",
+                        "s": "t",
+                        "ts": (e["at"] - origin) * 1e6,
+                        "pid": 1,
+                        "tid": 1,
+                        "args": e["attributes"],
+                    }
+                )
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"trace_id": self.trace_id}}
+
+
+class Tracer:
+    """Keeps the most recent traces in memory"""
+
+    def __init__(self, history: int = 50) -> None:
+        self._history = history
+        self._traces: OrderedDict[str, Trace] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start_trace(self, name: str, **attributes: Any) -> Span:
+        """A new trace and its root span"""
+        trace = Trace(name)
+        with self._lock:
+            self._traces[trace.trace_id] = trace
+            while len(self._traces) > self._history:
+                self._traces.popitem(last=False)
+        return Span(trace, name, None, attributes)
+
+    def get(self, trace_id: str) -> Trace:
+        with self._lock:
+            trace = self._traces.get(trace_id)
+        if trace is None:
+            raise KeyError(trace_id)
+        return trace
+
+    def recent(self) -> List[Trace]:
+        """Traces newest first"""
+        with self._lock:
+            return list(reversed(self._traces.values()))
+
+
+TRACER = Tracer()
+
+
+def current_span() -> Span | _NoopSpan:
+    return _current.get() or NOOP_SPAN
+
+
+@contextmanager
+def span(name: str, root: bool = False, **attributes: Any) -> Iterator[Span | _NoopSpan]:
+    """Time the block as a child of the current span.
+
+    With `root=True` a new trace starts here; otherwise, outside any trace,
+    nothing is recorded.
+    """
+    parent = _current.get()
+    if root:
+        current: Span | _NoopSpan = TRACER.start_trace(name, **attributes)
+    elif parent is not None:
+        current = parent.child(name, **attributes)
+    else:
+        yield NOOP_SPAN
+        return
+    token = _current.set(current)  # type: ignore[arg-type]
+    try:
+        yield current
+    except BaseException as e:
+        # CancelledError is a BaseException: a superseded cast shows up as cancelled
+        if isinstance(e, Exception):
+            current.finish("error", error=str(e) or type(e).__name__)
+        else:
+            current.finish("cancelled")
+        raise
+    finally:
+        current.finish()
+        _current.reset(token)
+
+
+def traced(name: str) -> Callable[[Callable[..., Awaitable[T]]], Callable[..., Awaitable[T]]]:
+    """Decorator running a coroutine function inside `span(name)`"""
+
+    def decorator(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> T:
+            with span(name):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,724 @@
+"""Streaming receipt of uploaded media files."""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import tempfile
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Awaitable, BinaryIO, Dict, Optional, Set
+
+from pydantic import BaseModel
+from starlette.requests import Request
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+from .metadata import ResolvedMedia
+from .progressive import GrowingFile, LocalMediaServer
+from .storage import PARTIAL_UPLOAD_PREFIX, StorageManager
+from .stream_manager import StreamManager
+
+LOGGER = logging.getLogger(__name__)
+
+UPLOAD_DIR = Path.home() / ".mtxcast" / "uploads"
+
+# Bytes buffered in memory before they are handed to a thread for writing and hashing
+_WRITE_CHUNK_SIZE = 1024 * 1024
+# Allowance for multipart boundaries and part headers when checking Content-Length
+_MULTIPART_OVERHEAD = 64 * 1024
+# Plain form fields are small; anything larger is not a form field we accept
+_MAX_FIELD_BYTES = 64 * 1024
+_SHA256_RE = re.compile(r"[0-9a-f]{64}")
+_CONTENT_RANGE_RE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+class InvalidUploadError(ValueError):
+    """The request is not an acceptable media upload"""
+
+
+class UploadTooLargeError(ValueError):
+    """The upload exceeds the configured maximum size"""
+
+
+class UploadConflictError(ValueError):
+    """The request does not fit the upload's current state (e.g. a range at the wrong offset)"""
+
+
+@dataclass
+class ReceivedUpload:
+    path: Path
+    size: int
+    sha256: str
+    filename: str | None = None
+    content_type: str | None = None
+    fields: Dict[str, str] = field(default_factory=dict)
+    deduplicated: bool = False  # `path` is an earlier upload with the same content, not a new file
+
+
+class _ChunkWriter:
+    """Buffers data and writes/hashes it in a thread one chunk at a time."""
+
+    def __init__(self, fh: BinaryIO, hasher: Any = None) -> None:
+        self._fh = fh
+        self._pending = bytearray()
+        self._hash = hasher if hasher is not None else hashlib.sha256()
+        self.written = 0
+
+    def feed(self, data: bytes) -> None:
+        self._pending += data
+
+    async def flush(self, force: bool = False) -> bool:
+        """Write buffered data once a full chunk has accumulated (or always, with `force`)"""
+        if not self._pending or (not force and len(self._pending) < _WRITE_CHUNK_SIZE):
+            return False
+        chunk = bytes(self._pending)
+        self._pending.clear()
+        # hashlib releases the GIL for large buffers, so hashing in the thread is cheap for the loop
+        await asyncio.to_thread(self._write, chunk)
+        return True
+
+    def _write(self, chunk: bytes) -> None:
+        self._fh.write(chunk)
+        self._fh.flush()  # readers of a file that is still uploading look at the disk
+        self._hash.update(chunk)
+        self.written += len(chunk)
+
+    def drain(self) -> None:
+        """Write whatever is buffered without going through the event loop"""
+        if self._pending:
+            chunk = bytes(self._pending)
+            self._pending.clear()
+            self._write(chunk)
+
+    def close(self) -> None:
+        self._fh.close()
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+
+class _MultipartReceiver:
+    """Collects multipart callbacks, streaming the file part to disk."""
+
+    def __init__(self, directory: Path, max_bytes: int) -> None:
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._headers: Dict[bytes, bytes] = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._name: str | None = None
+        self._field_value = bytearray()
+        self._is_file = False
+        self._writer: _ChunkWriter | None = None
+        self.path: Path | None = None
+        self.size = 0
+        self.filename: str | None = None
+        self.content_type: str | None = None
+        self.fields: Dict[str, str] = {}
+
+    def callbacks(self) -> Dict[str, object]:
+        return {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        }
+
+    def _on_part_begin(self) -> None:
+        self._headers = {}
+        self._name = None
+        self._is_file = False
+        self._field_value = bytearray()
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        self._name = options.get(b"name", b"").decode("utf-8", "replace")
+        if self._name != "file":
+            return
+        if self._writer is not None:
+            raise InvalidUploadError("Only one file may be uploaded per request")
+        content_type = self._headers.get(b"content-type", b"").decode("latin-1")
+        if not any(content_type.startswith(prefix) for prefix in ("video/", "audio/")):
+            raise InvalidUploadError(
+                f"Unsupported file type: {content_type}. Only video and audio files are supported."
+            )
+        self._is_file = True
+        self.content_type = content_type
+        self.filename = options.get(b"filename", b"file").decode("utf-8", "replace")
+        self._directory.mkdir(parents=True, exist_ok=True)
+        fd, name = tempfile.mkstemp(prefix=PARTIAL_UPLOAD_PREFIX, suffix=Path(self.filename).suffix, dir=self._directory)
+        self._writer = _ChunkWriter(os.fdopen(fd, "wb"))
+        self.path = Path(name)
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._is_file:
+            self.size += end - start
+            if self._max_bytes and self.size > self._max_bytes:
+                raise UploadTooLargeError(f"Upload exceeds the maximum size of {self._max_bytes} bytes")
+            assert self._writer is not None
+            self._writer.feed(data[start:end])
+        else:
+            self._field_value += data[start:end]
+            if len(self._field_value) > _MAX_FIELD_BYTES:
+                raise InvalidUploadError(f"Form field {self._name!r} is too large")
+
+    def _on_part_end(self) -> None:
+        if not self._is_file and self._name:
+            self.fields[self._name] = self._field_value.decode("utf-8", "replace")
+        self._is_file = False
+
+    async def flush(self, force: bool = False) -> None:
+        if self._writer is not None:
+            await self._writer.flush(force)
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+
+    def discard(self) -> None:
+        self.close()
+        if self.path is not None:
+            self.path.unlink(missing_ok=True)
+
+    def hexdigest(self) -> str:
+        return self._writer.hexdigest() if self._writer is not None else hashlib.sha256().hexdigest()
+
+
+def find_by_hash(directory: Path, sha256: str) -> Path | None:
+    """A stored upload with this SHA-256 digest, if there is one"""
+    sha256 = sha256.lower()
+    if not _SHA256_RE.fullmatch(sha256) or not directory.is_dir():
+        return None
+    for path in directory.glob(f"{sha256}*"):
+        if path.is_file() and path.stem == sha256:
+            return path
+    return None
+
+
+def store_by_hash(path: Path, sha256: str) -> Path:
+    """Move a completed upload to its content-addressed name, dropping it if that copy already exists"""
+    target = path.with_name(f"{sha256}{path.suffix.lower()}")
+    existing = find_by_hash(path.parent, sha256)
+    if existing is not None and existing != path:
+        path.unlink(missing_ok=True)
+        LOGGER.info("Upload is a duplicate of %s", existing)
+        return existing
+    try:
+        os.replace(path, target)
+    except OSError as e:
+        # Windows cannot rename a file the player has open; it keeps its temporary name
+        LOGGER.warning("Could not rename %s to %s: %s", path, target.name, e)
+        return path
+    return target
+
+
+async def receive_multipart_upload(
+    request: Request,
+    directory: Path = UPLOAD_DIR,
+    max_bytes: int = 0,
+) -> ReceivedUpload:
+    """Stream the `file` part of a multipart/form-data request to disk.
+
+    Memory use is bounded by one write chunk regardless of the file size; the
+    SHA-256 digest is computed while writing. `max_bytes` (0 = unlimited) is
+    enforced from Content-Length before anything is read, and again while
+    streaming for chunked requests.
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or not options.get(b"boundary"):
+        raise InvalidUploadError("Expected a multipart/form-data request")
+
+    content_length = request.headers.get("content-length")
+    if max_bytes and content_length and content_length.isdigit():
+        if int(content_length) > max_bytes + _MULTIPART_OVERHEAD:
+            raise UploadTooLargeError(f"Upload exceeds the maximum size of {max_bytes} bytes")
+
+    receiver = _MultipartReceiver(directory, max_bytes)
+    parser = MultipartParser(options[b"boundary"], receiver.callbacks())
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            await receiver.flush()
+        parser.finalize()
+        await receiver.flush(force=True)
+        receiver.close()
+    except BaseException:
+        receiver.discard()
+        raise
+
+    if receiver.path is None:
+        raise InvalidUploadError("No file part in the request")
+    deduplicated = find_by_hash(receiver.path.parent, receiver.hexdigest()) is not None
+    path = store_by_hash(receiver.path, receiver.hexdigest())
+    LOGGER.info("Upload received: %s (%d bytes)", path, receiver.size)
+    return ReceivedUpload(
+        path=path,
+        size=receiver.size,
+        sha256=receiver.hexdigest(),
+        filename=receiver.filename,
+        content_type=receiver.content_type,
+        fields=receiver.fields,
+        deduplicated=deduplicated,
+    )
+
+
+# --- Play while uploading -------------------------------------------------
+
+_NEED_MORE = -1  # _streamable_prefix: not enough data to decide yet
+_EBML_MAGIC = b"\x1a\x45\xdf\xa3"  # Matroska / WebM
+_TS_SYNC = 0x47
+_TS_PACKET = 188
+# Containers that can be played from the front without an index at the end
+_STREAMABLE_MAGICS = (b"OggS", b"fLaC", b"ID3", b"RIFF")
+
+
+def _mp4_prefix(fh: BinaryIO, received: int) -> int | None:
+    """Walk top-level MP4 boxes; bytes needed if moov precedes mdat, None if it does not"""
+    offset = 0
+    while offset + 8 <= received:
+        fh.seek(offset)
+        header = fh.read(16)
+        size = int.from_bytes(header[0:4], "big")
+        box_type = header[4:8]
+        if size == 1:
+            if len(header) < 16:
+                return _NEED_MORE
+            size = int.from_bytes(header[8:16], "big")
+        elif size == 0:
+            size = None  # box extends to the end of the file
+        if box_type == b"moov":
+            # Playable once the whole index is here
+            return offset + size if size else None
+        if box_type == b"mdat" or size is None or size < 8:
+            # Media data before the index (not "faststart"): QMediaPlayer would
+            # have to read the end of the file first
+            return None
+        offset += size
+    return _NEED_MORE
+
+
+def _streamable_prefix(path: Path, received: int, prefix_bytes: int) -> int | None:
+    """Bytes that must have arrived before playback can start.
+
+    Returns _NEED_MORE when the head of the file does not tell yet, and None when
+    the container needs the complete file (e.g. MP4 with moov after mdat).
+    """
+    if received < 12:
+        return _NEED_MORE
+    with path.open("rb") as fh:
+        head = fh.read(min(received, _TS_PACKET * 3))
+        if head[4:8] in (b"ftyp", b"moov", b"free", b"skip", b"wide"):
+            required = _mp4_prefix(fh, received)
+            return required if required in (_NEED_MORE, None) else max(required, prefix_bytes)
+    if head.startswith(_EBML_MAGIC) or head.startswith(_STREAMABLE_MAGICS):
+        return prefix_bytes
+    if head[0] == _TS_SYNC:
+        if len(head) < _TS_PACKET * 3:
+            return _NEED_MORE
+        if head[_TS_PACKET] == _TS_SYNC and head[_TS_PACKET * 2] == _TS_SYNC:
+            return prefix_bytes
+    return None
+
+
+class UploadSessionPayload(BaseModel):
+    filename: str
+    size: Optional[int] = None  # lets the player seek into parts that have not arrived yet
+    content_type: Optional[str] = None
+    sha256: Optional[str] = None  # if the server already has this file, nothing needs to be sent
+    start_time: float = 0.0
+    play: bool = True  # start playback as soon as enough of the file has arrived
+
+
+@dataclass
+class UploadSession:
+    upload_id: str
+    filename: str
+    content_type: str
+    path: Path
+    growing: GrowingFile
+    expected_size: int | None = None
+    expected_sha256: str | None = None
+    start_time: float = 0.0
+    play: bool = True
+    # "created", "uploading" (a PUT is running), "incomplete" (resumable), "complete" or "failed"
+    status: str = "created"
+    received: int = 0  # bytes on disk; the offset the next range must start at
+    sha256: str | None = None
+    deduplicated: bool = False
+    streamable: bool | None = None  # None until the head of the file has been inspected
+    playable_after: int | None = None  # bytes needed before playback starts
+    playback_started: bool = False
+    playback_url: str | None = None  # loopback URL while the upload plays as it arrives
+    error: str | None = None
+    created: float = 0.0
+    updated: float = 0.0  # monotonic time of the last activity
+    started_at: float | None = None
+    finished_at: float | None = None
+    hasher: Any = field(default_factory=hashlib.sha256, repr=False)  # digest of the first `received` bytes
+    receiver: asyncio.Task | None = field(default=None, repr=False)  # task writing the body of the running PUT
+
+    def to_dict(self) -> Dict[str, Any]:
+        elapsed = ((self.finished_at or time.monotonic()) - self.started_at) if self.started_at else 0.0
+        return {
+            "id": self.upload_id,
+            "filename": self.filename,
+            "content_type": self.content_type,
+            "status": self.status,
+            "size": self.expected_size,
+            "received": self.received,
+            "bytes_per_second": self.received / elapsed if elapsed > 0 else None,
+            "playable_after": self.playable_after,
+            "playback_started": self.playback_started,
+            "sha256": self.sha256,
+            "deduplicated": self.deduplicated,
+            "error": self.error,
+        }
+
+
+def _parse_content_range(header: str) -> tuple[int, int, int | None]:
+    """`bytes start-end/total` -> (start, end exclusive, total or None)"""
+    match = _CONTENT_RANGE_RE.fullmatch(header.strip())
+    if not match:
+        raise InvalidUploadError(f"Malformed Content-Range header: {header!r}")
+    start, last = int(match.group(1)), int(match.group(2))
+    total = None if match.group(3) == "*" else int(match.group(3))
+    if last < start or (total is not None and last >= total):
+        raise InvalidUploadError(f"Invalid Content-Range: {header!r}")
+    return start, last + 1, total
+
+
+class UploadManager:
+    """Resumable upload sessions whose files can be played while they arrive.
+
+    A session is created first (returning immediately with its ID). The body
+    is then PUT in one request, or in `Content-Range` pieces followed by
+    finalize(); an interrupted session resumes from `received`. Sessions that
+    announce a SHA-256 the server already stores complete without any bytes
+    being sent. Completed files are stored under their digest, so the same
+    content is kept once.
+
+    Once the container is known to be playable from the front and enough
+    bytes are on disk, playback starts through the loopback media server;
+    reads past the received data block until it arrives.
+    """
+
+    def __init__(
+        self,
+        manager: StreamManager,
+        media_server: LocalMediaServer,
+        directory: Path = UPLOAD_DIR,
+        max_bytes: int = 0,
+        prefix_bytes: int = 4 * 1024 * 1024,
+        idle_timeout: float = 6 * 3600,
+        storage: StorageManager | None = None,
+    ) -> None:
+        self._manager = manager
+        self._media_server = media_server
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._prefix_bytes = prefix_bytes
+        self._idle_timeout = idle_timeout  # unfinished sessions are dropped after this long without data
+        self._storage = storage
+        self._sessions: OrderedDict[str, UploadSession] = OrderedDict()
+        self._history = 50  # finished sessions kept for reporting
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def close(self) -> None:
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def create(self, payload: UploadSessionPayload) -> UploadSession:
+        content_type = payload.content_type or mimetypes.guess_type(payload.filename)[0] or ""
+        if not any(content_type.startswith(prefix) for prefix in ("video/", "audio/")):
+            raise InvalidUploadError(
+                f"Unsupported file type: {content_type}. Only video and audio files are supported."
+            )
+        if self._max_bytes and payload.size and payload.size > self._max_bytes:
+            raise UploadTooLargeError(f"Upload exceeds the maximum size of {self._max_bytes} bytes")
+        expected_sha256 = payload.sha256.lower() if payload.sha256 else None
+        if expected_sha256 is not None and not _SHA256_RE.fullmatch(expected_sha256):
+            raise InvalidUploadError("sha256 must be 64 hexadecimal characters")
+        self._expire_idle()
+
+        existing = find_by_hash(self._directory, expected_sha256) if expected_sha256 else None
+        if existing is not None:
+            return self._create_deduplicated(payload, content_type, existing)
+
+        if self._storage is not None and payload.size:
+            self._storage.make_room(payload.size)
+        self._directory.mkdir(parents=True, exist_ok=True)
+        fd, name = tempfile.mkstemp(prefix=PARTIAL_UPLOAD_PREFIX, suffix=Path(payload.filename).suffix, dir=self._directory)
+        os.close(fd)
+        session = UploadSession(
+            upload_id=uuid.uuid4().hex,
+            filename=payload.filename,
+            content_type=content_type,
+            path=Path(name),
+            growing=GrowingFile(name, expected_size=payload.size),
+            expected_size=payload.size,
+            expected_sha256=expected_sha256,
+            start_time=payload.start_time,
+            play=payload.play,
+            created=time.time(),
+            updated=time.monotonic(),
+        )
+        self._sessions[session.upload_id] = session
+        self._trim_history()
+        return session
+
+    def _create_deduplicated(self, payload: UploadSessionPayload, content_type: str, path: Path) -> UploadSession:
+        size = path.stat().st_size
+        growing = GrowingFile(path)
+        growing.finish()
+        session = UploadSession(
+            upload_id=uuid.uuid4().hex,
+            filename=payload.filename,
+            content_type=content_type,
+            path=path,
+            growing=growing,
+            expected_size=size,
+            expected_sha256=path.stem,
+            start_time=payload.start_time,
+            play=payload.play,
+            status="complete",
+            received=size,
+            sha256=path.stem,
+            deduplicated=True,
+            created=time.time(),
+            updated=time.monotonic(),
+        )
+        LOGGER.info("Upload of %s skipped: already stored as %s", payload.filename, path)
+        self._sessions[session.upload_id] = session
+        if session.play:
+            session.playback_started = True
+            self._spawn(self._manager.handle_file(str(path), session.start_time, session.filename))
+        self._trim_history()
+        return session
+
+    def get(self, upload_id: str) -> UploadSession:
+        session = self._sessions.get(upload_id)
+        if session is None:
+            raise KeyError(upload_id)
+        return session
+
+    async def receive(self, session: UploadSession, request: Request) -> UploadSession:
+        """Append the request body to the session's file.
+
+        With a `Content-Range` header the body is one piece of the file and must
+        start at `received`; finalize() completes the upload. Without one the
+        body is the whole file and the upload is finalized when it ends.
+        """
+        if session.status == "uploading":
+            # Usually a request whose client gave up and retried before the server noticed
+            await self._supersede(session)
+        if session.status in ("complete", "failed"):
+            raise UploadConflictError(f"Upload {session.upload_id} is already {session.status}")
+
+        content_range = request.headers.get("content-range")
+        if content_range:
+            start, end, total = _parse_content_range(content_range)
+            if total is not None:
+                if session.expected_size is None:
+                    session.expected_size = total
+                elif total != session.expected_size:
+                    raise InvalidUploadError("Content-Range total does not match the announced size")
+        else:
+            start, end = 0, session.expected_size
+        if start != session.received:
+            raise UploadConflictError(f"Expected data starting at byte {session.received}, got {start}")
+        limit = end if end is not None else session.expected_size
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and end is not None and int(content_length) != end - start:
+            raise InvalidUploadError("Content-Length does not match the range being sent")
+
+        session.status = "uploading"
+        session.started_at = session.started_at or time.monotonic()
+        receiver = asyncio.ensure_future(self._receive_body(session, request, start, limit))
+        session.receiver = receiver
+        try:
+            await receiver
+        except asyncio.CancelledError:
+            if session.receiver is receiver:
+                raise
+            raise UploadConflictError(f"Upload {session.upload_id} was resumed by a newer request") from None
+        finally:
+            if session.receiver is receiver:
+                session.receiver = None
+
+        if end is not None and session.received != end:
+            raise UploadConflictError(f"Received {session.received - start} of {end - start} bytes; resume from {session.received}")
+        if not content_range:
+            return await self.finalize(session)
+        return session
+
+    async def _receive_body(self, session: UploadSession, request: Request, start: int, limit: int | None) -> None:
+        writer = _ChunkWriter(session.path.open("ab"), session.hasher)
+        fed = start
+        try:
+            async for chunk in request.stream():
+                fed += len(chunk)
+                if self._max_bytes and fed > self._max_bytes:
+                    raise UploadTooLargeError(f"Upload exceeds the maximum size of {self._max_bytes} bytes")
+                if limit is not None and fed > limit:
+                    raise InvalidUploadError("Request body is longer than the range being sent")
+                writer.feed(chunk)
+                if await writer.flush():
+                    self._advance(session, start + writer.written)
+                    await self._maybe_start_playback(session)
+            await writer.flush(force=True)
+        except UploadTooLargeError as e:
+            writer.close()
+            self._fail(session, e)
+            raise
+        except BaseException as e:
+            # Everything fed so far lies inside the range: keep it so the client can resume
+            writer.drain()
+            writer.close()
+            self._advance(session, start + writer.written)
+            session.status = "incomplete"
+            LOGGER.info("Upload %s interrupted at %d bytes: %r", session.upload_id, session.received, e)
+            raise
+        writer.close()
+        self._advance(session, start + writer.written)
+        await self._maybe_start_playback(session)
+        session.status = "incomplete"
+
+    async def _supersede(self, session: UploadSession) -> None:
+        """Stop the request still writing to `session`, keeping what it stored"""
+        while session.status == "uploading" and session.receiver is not None:
+            receiver = session.receiver
+            session.receiver = None
+            LOGGER.info("Upload %s: a new request replaces the one still receiving data", session.upload_id)
+            receiver.cancel()
+            await asyncio.wait({receiver})
+        if session.status == "uploading":
+            raise UploadConflictError(f"Upload {session.upload_id} is already receiving data")
+
+    async def finalize(self, session: UploadSession) -> UploadSession:
+        """Check that the whole file arrived, store it under its digest and play it"""
+        if session.status == "complete":
+            return session
+        if session.status not in ("created", "incomplete"):
+            raise UploadConflictError(f"Upload {session.upload_id} cannot be finalized while {session.status}")
+        if session.received == 0:
+            raise UploadConflictError("No data has been received")
+        if session.expected_size is not None and session.received != session.expected_size:
+            raise UploadConflictError(
+                f"Only {session.received} of {session.expected_size} bytes received; resume from {session.received}"
+            )
+        digest = session.hasher.hexdigest()
+        if session.expected_sha256 is not None and digest != session.expected_sha256:
+            error = InvalidUploadError(f"SHA-256 mismatch: expected {session.expected_sha256}, got {digest}")
+            self._fail(session, error)
+            raise error
+
+        # A rename keeps the file's identity, but a duplicate is replaced by the earlier copy
+        was_playing = self._storage is not None and self._storage.is_playing(session.path)
+        session.path = await asyncio.to_thread(store_by_hash, session.path, digest)
+        if was_playing:
+            self._storage.set_playing([session.path])
+        session.sha256 = digest
+        session.expected_size = session.received
+        session.status = "complete"
+        session.finished_at = time.monotonic()
+        session.growing.finish(session.path)
+        if self._storage is not None:
+            await asyncio.to_thread(self._storage.add, session.path)
+        LOGGER.info("Upload %s complete: %s (%d bytes)", session.upload_id, session.path, session.received)
+        if session.play and not session.playback_started:
+            # Not streamable (or too small to bother): play the finished file
+            session.playback_started = True
+            self._spawn(self._manager.handle_file(str(session.path), session.start_time, session.filename))
+        self._trim_history()
+        return session
+
+    def _advance(self, session: UploadSession, received: int) -> None:
+        session.received = received
+        session.updated = time.monotonic()
+        session.growing.notify()
+
+    async def _maybe_start_playback(self, session: UploadSession) -> None:
+        if not session.play or session.playback_started:
+            return
+        if session.streamable is None:
+            required = await asyncio.to_thread(_streamable_prefix, session.path, session.received, self._prefix_bytes)
+            if required == _NEED_MORE:
+                return
+            session.streamable = required is not None
+            session.playable_after = required
+            if required is None:
+                LOGGER.info("Upload %s is not streamable; playing it once complete", session.upload_id)
+        if not session.streamable or session.received < session.playable_after:
+            return
+        session.playback_started = True
+        url = self._media_server.register(session.growing, session.path.suffix)
+        session.playback_url = url
+        LOGGER.info("Starting playback of upload %s after %d bytes: %s", session.upload_id, session.received, url)
+        resolved = ResolvedMedia(
+            playback_url=url,
+            title=session.filename,
+            start_time=session.start_time,
+            progressive=True,
+            local_path=str(session.path),  # protects the upload from eviction while it plays
+        )
+        self._spawn(self._manager.play_resolved(resolved))
+
+    def _fail(self, session: UploadSession, error: BaseException) -> None:
+        session.status = "failed"
+        session.error = str(error) or type(error).__name__
+        session.finished_at = time.monotonic()
+        session.growing.fail(error if isinstance(error, Exception) else RuntimeError(session.error))
+        if session.playback_url is not None:
+            self._media_server.unregister(session.playback_url)
+        if not session.playback_started:
+            session.path.unlink(missing_ok=True)
+        LOGGER.warning("Upload %s failed: %s", session.upload_id, session.error)
+
+    def _expire_idle(self) -> None:
+        now = time.monotonic()
+        for session in list(self._sessions.values()):
+            if session.status in ("created", "incomplete") and now - session.updated > self._idle_timeout:
+                LOGGER.info("Dropping idle upload %s (%d bytes received)", session.upload_id, session.received)
+                self._fail(session, UploadConflictError("Upload expired"))
+
+    def _trim_history(self) -> None:
+        finished = [k for k, s in self._sessions.items() if s.status in ("complete", "failed")]
+        for key in finished[: max(0, len(finished) - self._history)]:
+            del self._sessions[key]
+
+    def _spawn(self, coro: Awaitable[Any]) -> None:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._on_task_done)
+
+    def _on_task_done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            LOGGER.error("Playback of upload failed: %s", task.exception())
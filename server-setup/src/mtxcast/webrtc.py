@@ -11,10 +11,13 @@ from aiortc.contrib.media import MediaBlackhole
 from fastapi import HTTPException
 from cryptography.x509.base import InvalidVersion
 
+from .metrics import Gauge
 from .stream_manager import StreamManager
 
 LOGGER = logging.getLogger(__name__)
 
+WHIP_PEERS = Gauge("mtxcast_whip_peer_connections", "Open WHIP peer connections")
+
 
 # Some WHIP clients (e.g., certain OBS builds) emit DTLS certificates with a non-standard
 # version number, causing cryptography.x509 to raise InvalidVersion. We patch the aiortc
@@ -37,6 +40,7 @@ class WhipEndpoint:
         self._manager = manager
         self._pcs: dict[str, RTCPeerConnection] = {}
         self._cleanup_lock = asyncio.Lock()
+        WHIP_PEERS.set_function(lambda: len(self._pcs))
 
     async def handle_offer(self, sdp_offer: str, client_info: Optional[str] = None) -> Tuple[str, str]:
         """
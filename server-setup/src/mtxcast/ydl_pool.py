@@ -0,0 +1,74 @@
+"""Pool of pre-initialized YoutubeDL instances, one set per option profile."""
+
+from __future__ import annotations
+
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Mapping
+
+from yt_dlp import YoutubeDL
+
+LOGGER = logging.getLogger(__name__)
+
+
+class YdlPool:
+    """Hands out warm YoutubeDL instances instead of constructing one per call.
+
+    Building a YoutubeDL sets up extractors, option parsing and the HTTP opener,
+    which is wasted work when every resolve uses one of a handful of option
+    sets. Instances are not thread-safe, so each one is checked out exclusively;
+    when a profile has no idle instance a new one is created rather than making
+    the caller wait.
+    """
+
+    def __init__(self, profiles: Mapping[str, Dict[str, Any]], size: int = 1) -> None:
+        self._profiles = dict(profiles)
+        self._size = size
+        self._idle: Dict[str, List[YoutubeDL]] = {name: [] for name in self._profiles}
+        self._lock = threading.Lock()
+
+    def warm_up(self) -> None:
+        """Create `size` idle instances for every profile."""
+        for name in self._profiles:
+            with self._lock:
+                missing = self._size - len(self._idle[name])
+            for _ in range(max(0, missing)):
+                ydl = self._create(name)
+                with self._lock:
+                    self._idle[name].append(ydl)
+        LOGGER.info("YoutubeDL pool warmed up (%d profiles)", len(self._profiles))
+
+    @contextmanager
+    def acquire(self, profile: str, **overrides: Any) -> Iterator[YoutubeDL]:
+        """Check out an instance of `profile`, with `overrides` applied to its params for this use only."""
+        with self._lock:
+            idle = self._idle[profile]
+            ydl = idle.pop() if idle else None
+        if ydl is None:
+            ydl = self._create(profile)
+
+        saved = {key: ydl.params.get(key) for key in overrides}
+        ydl.params.update(overrides)
+        try:
+            yield ydl
+        finally:
+            ydl.params.update(saved)
+            with self._lock:
+                self._idle[profile].append(ydl)
+
+    def close(self) -> None:
+        with self._lock:
+            instances = [ydl for idle in self._idle.values() for ydl in idle]
+            for idle in self._idle.values():
+                idle.clear()
+        for ydl in instances:
+            try:
+                ydl.close()
+            except Exception as e:  # pragma: no cover - defensive
+                LOGGER.debug("Error closing YoutubeDL instance: %s", e)
+
+    def _create(self, profile: str) -> YoutubeDL:
+        LOGGER.debug("Creating YoutubeDL instance for profile %s", profile)
+        # YoutubeDL keeps a reference to the params dict; give each instance its own copy
+        return YoutubeDL(dict(self._profiles[profile]))
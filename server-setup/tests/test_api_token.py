@@ -0,0 +1,45 @@
+"""API token check shared by the HTTP endpoints."""
+
+from __future__ import annotations
+
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from mtxcast.api_server import _token_dependency  # noqa: E402
+
+
+def _check(expected: str | None, **headers: str | None) -> None:
+    asyncio.run(_token_dependency(expected)(**headers))
+
+
+def test_no_token_configured_allows_everything() -> None:
+    _check(None)
+    _check(None, x_api_token="anything", authorization="Bearer anything")
+
+
+def test_x_api_token_header() -> None:
+    _check("secret", x_api_token="secret")
+    with pytest.raises(HTTPException) as e:
+        _check("secret", x_api_token="wrong")
+    assert e.value.status_code == 401
+
+
+def test_bearer_token_as_sent_by_prometheus() -> None:
+    _check("secret", authorization="Bearer secret")
+    _check("secret", authorization="bearer  secret ")
+
+
+@pytest.mark.parametrize(
+    "authorization",
+    [None, "Bearer wrong", "Basic secret", "secret", "Bearer"],
+)
+def test_invalid_authorization_is_rejected(authorization: str | None) -> None:
+    with pytest.raises(HTTPException) as e:
+        _check("secret", authorization=authorization)
+    assert e.value.status_code == 401